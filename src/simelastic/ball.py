@@ -12,13 +12,23 @@ import copy
 import math
 import numpy as np
 
+from .ball_state import BallState, Vector3DView
 from .container3D import Container3D, Cuboid3D
+from .overlap_grid import OverlapGrid
 from .vector3D import Vector3D
 
 from .default_parameters import DEFAULT_BALL_RADIUS
 
 
 class Ball:
+    """Single ball.
+
+    The ball data are stored in a BallState instance (see ball_state.py),
+    and the Ball instance simply accesses the row `index` of the arrays
+    of that state. A new Ball owns a BallState with a single ball, while
+    the balls in a BallCollection are lightweight views of the state
+    shared by all the balls of the collection.
+    """
     def __init__(
             self,
             position=None,
@@ -31,41 +41,29 @@ class Ball:
             check_within_container=True
     ):
         if position is None:
-            self.position = Vector3D()
-        elif isinstance(position, Vector3D):
-            self.position = position
-        else:
+            position = Vector3D()
+        elif not isinstance(position, Vector3D):
             raise ValueError(f'{position=} is not a Vector3D instance')
 
         if velocity is None:
-            self.velocity = Vector3D()
-        elif isinstance(velocity, Vector3D):
-            self.velocity = velocity
-        else:
+            velocity = Vector3D()
+        elif not isinstance(velocity, Vector3D):
             raise ValueError(f'{velocity=} is not a Vector3D instance')
 
         if radius is None:
-            self.radius = DEFAULT_BALL_RADIUS
-        else:
-            self.radius = radius
+            radius = DEFAULT_BALL_RADIUS
 
         if mass is None:
-            self.mass = 1.0
-        else:
-            self.mass = mass
+            mass = 1.0
 
         if rgbcolor is None:
-            self.rgbcolor = Vector3D(1, 0, 0)
-        elif isinstance(rgbcolor, Vector3D):
-            self.rgbcolor = rgbcolor
-        else:
+            rgbcolor = Vector3D(1, 0, 0)
+        elif not isinstance(rgbcolor, Vector3D):
             raise ValueError(f'{rgbcolor=} is not a Vector3D instance')
-        
+
         if rgbcolor_on_speed is None:
-            self.rgbcolor_on_speed = None
-        elif isinstance(rgbcolor_on_speed, Vector3D):
-            self.rgbcolor_on_speed = rgbcolor_on_speed
-        else:
+            pass
+        elif not isinstance(rgbcolor_on_speed, Vector3D):
             raise ValueError(f'{rgbcolor_on_speed=} is not None nor a Vector3D instance')        
 
         if container is None:
@@ -77,14 +75,107 @@ class Ball:
 
         # check ball fits within container
         if check_within_container:
-            if container.can_host_ball(self.position, self.radius):
-                self.container = container
-            else:
-                raise ValueError(f'new ball with position: {repr(self.position)} ' +
-                                 f'and radius: {self.radius} ' +
+            if not container.can_host_ball(position, radius):
+                raise ValueError(f'new ball with position: {repr(position)} ' +
+                                 f'and radius: {radius} ' +
                                  f'outside container={repr(container)}')
+
+        self.state = BallState()
+        self.index = self.state.append(
+            position=position,
+            velocity=velocity,
+            radius=radius,
+            mass=mass,
+            rgbcolor=rgbcolor,
+            rgbcolor_on_speed=rgbcolor_on_speed,
+            container=container
+        )
+
+    @classmethod
+    def view(cls, state, index):
+        """Return a Ball instance accessing ball #index of a BallState."""
+        ball = cls.__new__(cls)
+        ball.state = state
+        ball.index = index
+        return ball
+
+    def __deepcopy__(self, memo):
+        # the copy is a standalone ball (it does not copy the whole state)
+        return Ball(
+            position=self.position,
+            velocity=self.velocity,
+            radius=self.radius,
+            mass=self.mass,
+            rgbcolor=self.rgbcolor,
+            rgbcolor_on_speed=self.rgbcolor_on_speed,
+            container=copy.deepcopy(self.container, memo),
+            check_within_container=False
+        )
+
+    @property
+    def position(self):
+        return Vector3DView(self.state, 'position', self.index)
+
+    @position.setter
+    def position(self, value):
+        self.state.position[self.index] = [value.x, value.y, value.z]
+        self.state.version += 1
+
+    @property
+    def velocity(self):
+        return Vector3DView(self.state, 'velocity', self.index)
+
+    @velocity.setter
+    def velocity(self, value):
+        self.state.velocity[self.index] = [value.x, value.y, value.z]
+
+    @property
+    def rgbcolor(self):
+        return Vector3DView(self.state, 'rgbcolor', self.index)
+
+    @rgbcolor.setter
+    def rgbcolor(self, value):
+        self.state.rgbcolor[self.index] = [value.x, value.y, value.z]
+
+    @property
+    def rgbcolor_on_speed(self):
+        if self.state.has_rgbcolor_on_speed[self.index]:
+            return Vector3DView(self.state, 'rgbcolor_on_speed', self.index)
+        else:
+            return None
+
+    @rgbcolor_on_speed.setter
+    def rgbcolor_on_speed(self, value):
+        if value is None:
+            self.state.has_rgbcolor_on_speed[self.index] = False
         else:
-            self.container = container
+            self.state.rgbcolor_on_speed[self.index] = [value.x, value.y, value.z]
+            self.state.has_rgbcolor_on_speed[self.index] = True
+
+    @property
+    def radius(self):
+        return float(self.state.radius[self.index])
+
+    @radius.setter
+    def radius(self, value):
+        self.state.radius[self.index] = value
+        self.state.version += 1
+
+    @property
+    def mass(self):
+        return float(self.state.mass[self.index])
+
+    @mass.setter
+    def mass(self, value):
+        self.state.mass[self.index] = value
+
+    @property
+    def container(self):
+        return self.state.container[self.index]
+
+    @container.setter
+    def container(self, value):
+        self.state.container[self.index] = value
 
     def __str__(self):
         output = '<Ball instance>\n'
@@ -110,42 +201,41 @@ class Ball:
         return output
 
     def distance2ball(self, newball):
-        dist = math.sqrt(
-            (self.position.x - newball.position.x) ** 2 +
-            (self.position.y - newball.position.y) ** 2 +
-            (self.position.z - newball.position.z) ** 2
-        )
-        return dist
+        delta = self.state.position[self.index] - newball.state.position[newball.index]
+        return math.sqrt(delta.dot(delta))
 
     def collision_with_container(self):
         return self.container.collision_with_container(self)
 
-    def update_position(self, t, nround=12):
-        self.position.x = np.round(self.position.x + self.velocity.x * t, nround)
-        self.position.y = np.round(self.position.y + self.velocity.y * t, nround)
-        self.position.z = np.round(self.position.z + self.velocity.z * t, nround)
-        if self.rgbcolor_on_speed is not None:
-            if (self.velocity.x**2 + self.velocity.y**2 + self.velocity.z**2) > 0:
-                self.rgbcolor = self.rgbcolor_on_speed
-
-    def time_to_collision_with_ball(self, newball, nround=12):
-        vx_relative = self.velocity.x - newball.velocity.x
-        vy_relative = self.velocity.y - newball.velocity.y
-        vz_relative = self.velocity.z - newball.velocity.z
-        if (vx_relative == 0) and (vy_relative == 0) and (vz_relative == 0):
+    def update_position(self, t, nround=None):
+        state = self.state
+        position = state.position[self.index]
+        velocity = state.velocity[self.index]
+        position += velocity * t
+        if nround is not None:
+            np.round(position, nround, out=position)
+        state.time[self.index] += t
+        state.version += 1
+        if state.has_rgbcolor_on_speed[self.index]:
+            if velocity.dot(velocity) > 0:
+                state.rgbcolor[self.index] = state.rgbcolor_on_speed[self.index]
+
+    def time_to_collision_with_ball(self, newball, nround=None):
+        v_relative = self.state.velocity[self.index] - newball.state.velocity[newball.index]
+        if not v_relative.any():
             tmin = np.inf
         else:
-            delta_x = self.position.x - newball.position.x
-            delta_y = self.position.y - newball.position.y
-            delta_z = self.position.z - newball.position.z
-            dcol = self.radius + newball.radius
-            a = vx_relative ** 2 + vy_relative ** 2 + vz_relative ** 2
-            b = 2 * delta_x * vx_relative + \
-                2 * delta_y * vy_relative + \
-                2 * delta_z * vz_relative
-            c = delta_x ** 2 + delta_y ** 2 + delta_z ** 2 - dcol ** 2
+            delta = self.state.position[self.index] - newball.state.position[newball.index]
+            dcol = self.state.radius[self.index] + newball.state.radius[newball.index]
+            a = v_relative.dot(v_relative)
+            b = 2 * delta.dot(v_relative)
+            c = delta.dot(delta) - dcol ** 2
             delta = b * b - 4 * a * c
-            if delta <= 0:
+            if nround is None and c < 0 and b < 0:
+                # overlapping balls approaching each other (due to
+                # rounding errors) collide immediately
+                tmin = 0.0
+            elif delta <= 0:
                 tmin = np.inf
             else:
                 tmin1 = (-b + math.sqrt(delta)) / (2 * a)
@@ -154,48 +244,106 @@ class Ball:
                 tmin2 = (-b - math.sqrt(delta)) / (2 * a)
                 if tmin2 < 0:
                     tmin2 = np.inf
-                tmin = np.min([tmin1, tmin2])
+                tmin = min(tmin1, tmin2)
                 derivative = 2 * a * tmin + b
                 if derivative >= 0:
                     tmin = np.inf
+        if nround is None:
+            return tmin
         return np.round(tmin, nround)
 
-    def update_collision_with(self, newball, nround=12):
-        delta_x = self.position.x - newball.position.x
-        delta_y = self.position.y - newball.position.y
-        delta_z = self.position.z - newball.position.z
-        vx_relative = self.velocity.x - newball.velocity.x
-        vy_relative = self.velocity.y - newball.velocity.y
-        vz_relative = self.velocity.z - newball.velocity.z
-        relativeposition12 = Vector3D(delta_x, delta_y, delta_z)
-        relativevelocity12 = Vector3D(vx_relative, vy_relative, vz_relative)
+    def update_collision_with(self, newball, nround=None):
+        state1, i1 = self.state, self.index
+        state2, i2 = newball.state, newball.index
+        velocity1 = state1.velocity[i1]
+        velocity2 = state2.velocity[i2]
+        relativeposition12 = state1.position[i1] - state2.position[i2]
+        relativevelocity12 = velocity1 - velocity2
         dotnum = relativeposition12.dot(relativevelocity12)
         dotden = relativeposition12.dot(relativeposition12)
         factor = dotnum / dotden
-        corr1 = 2 * newball.mass / (self.mass + newball.mass) * factor
-        corr2 = -2 * self.mass / (self.mass + newball.mass) * factor
-        self.velocity.x = np.round(self.velocity.x - corr1 * delta_x, nround)
-        self.velocity.y = np.round(self.velocity.y - corr1 * delta_y, nround)
-        self.velocity.z = np.round(self.velocity.z - corr1 * delta_z, nround)
-        newball.velocity.x = np.round(newball.velocity.x - corr2 * delta_x, nround)
-        newball.velocity.y = np.round(newball.velocity.y - corr2 * delta_y, nround)
-        newball.velocity.z = np.round(newball.velocity.z - corr2 * delta_z, nround)
-        if newball.rgbcolor_on_speed is not None:
-            if (newball.velocity.x**2 + newball.velocity.y**2 + newball.velocity.z**2) > 0:
-                newball.rgbcolor = newball.rgbcolor_on_speed
-
+        mass1 = state1.mass[i1]
+        mass2 = state2.mass[i2]
+        corr1 = 2 * mass2 / (mass1 + mass2) * factor
+        corr2 = -2 * mass1 / (mass1 + mass2) * factor
+        velocity1 -= corr1 * relativeposition12
+        velocity2 -= corr2 * relativeposition12
+        if nround is not None:
+            np.round(velocity1, nround, out=velocity1)
+            np.round(velocity2, nround, out=velocity2)
+        # either ball can be the one at rest before the collision
+        for state, i, velocity in [(state1, i1, velocity1), (state2, i2, velocity2)]:
+            if state.has_rgbcolor_on_speed[i]:
+                if velocity.dot(velocity) > 0:
+                    state.rgbcolor[i] = state.rgbcolor_on_speed[i]
 
 
 class BallCollection:
+    """Collection of balls sharing a single BallState.
+
+    The values of the balls inserted in the collection are copied into
+    the shared state, and the entries of self.dict are Ball views of the
+    corresponding rows of that state. The overlap of new balls with the
+    balls already in the collection is checked with a spatial hash (see
+    OverlapGrid), which is updated on every insertion and rebuilt when
+    the state has been modified.
+    """
     def __init__(self):
         self.nballs = 0
         self.dict = dict()
+        self.state = BallState()
+        self._grid = None
 
     def __str__(self):
         output = '<BallCollection instance>\n'
         output += f'    nballs = {self.nballs}'
         return output
 
+    def __getstate__(self):
+        # the overlap grid is a cache that is not pickled
+        state = self.__dict__.copy()
+        state['_grid'] = None
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        """BallCollection sharing an existing BallState (no overlap check)."""
+        if not isinstance(state, BallState):
+            raise ValueError(f'state: {state} is not a BallState instance')
+        newcollection = cls()
+        newcollection.state = state
+        newcollection.nballs = state.nballs
+        newcollection.dict = {i: Ball.view(state, i) for i in range(state.nballs)}
+        newcollection._grid = None
+        return newcollection
+
+    def __deepcopy__(self, memo):
+        newcollection = BallCollection.__new__(BallCollection)
+        memo[id(self)] = newcollection
+        newcollection.nballs = self.nballs
+        newcollection.state = copy.deepcopy(self.state, memo)
+        newcollection.dict = {i: Ball.view(newcollection.state, i) for i in range(self.nballs)}
+        newcollection._grid = None
+        return newcollection
+
+    def _append(self, newball):
+        grid = self._grid
+        if grid is not None and not grid.is_valid():
+            grid = self._grid = None
+        index = self.state.append(
+            position=newball.position,
+            velocity=newball.velocity,
+            radius=newball.radius,
+            mass=newball.mass,
+            rgbcolor=newball.rgbcolor,
+            rgbcolor_on_speed=newball.rgbcolor_on_speed,
+            container=newball.container
+        )
+        self.dict[self.nballs] = Ball.view(self.state, index)
+        self.nballs += 1
+        if grid is not None:
+            grid.insert(index)
+
     def __add__(self, bc):
         if isinstance(bc, BallCollection):
             nballs_bc = bc.nballs
@@ -204,14 +352,12 @@ class BallCollection:
             for i in range(nballs_bc):
                 newball = bc.dict[i]
                 if self.check_ball_overlap(newball, warning=True):
-                    self.dict[self.nballs] = copy.deepcopy(newball)
-                    self.nballs += 1
+                    self._append(newball)
                 else:
                     raise ValueError('Overlap between balls')
         elif isinstance(bc, Ball):
             if self.check_ball_overlap(bc, warning=True):
-                self.dict[self.nballs] = copy.deepcopy(bc)
-                self.nballs += 1
+                self._append(bc)
         else:
             raise ValueError(f'bc: {type(bc)} is not a BallCollection instance')
         return self
@@ -220,8 +366,7 @@ class BallCollection:
         if not isinstance(newball, Ball):
             raise ValueError(f'newball: {newball} is not a Ball instance')
         if self.check_ball_overlap(newball, warning=warning):
-            self.dict[self.nballs] = copy.deepcopy(newball)
-            self.nballs += 1
+            self._append(newball)
             return True
         else:
             return False
@@ -233,17 +378,25 @@ class BallCollection:
             if not isinstance(newball, Ball):
                 raise ValueError(f'newball: {newball} is not a Ball instance')
             if self.check_ball_overlap(newball):
-                self.dict[self.nballs] = copy.deepcopy(newball)
-                self.nballs += 1
+                self._append(newball)
+
+    def overlap_grid(self, radius=0):
+        """Spatial hash of the balls, valid for new balls with the given radius."""
+        grid = self._grid
+        if grid is None or not grid.is_valid() or not grid.can_check(radius):
+            grid = self._grid = OverlapGrid(self.state, min_cell_size=2 * radius)
+        return grid
 
     def check_ball_overlap(self, newball, warning=True):
         if self.nballs == 0:
             return True
-        for idball in self.dict:
+        radius = newball.radius
+        grid = self.overlap_grid(radius)
+        idball = grid.find_overlap(newball.state.position[newball.index], radius)
+        if idball is None:
+            return True
+        if warning:
             b = self.dict[idball]
-            if b.distance2ball(newball) < b.radius + newball.radius:
-                if warning:
-                    print(f'newball: {repr(newball)} ' +
-                          f'overlaps with previous ball #{idball}: {repr(b)}')
-                return False
-        return True
+            print(f'newball: {repr(newball)} ' +
+                  f'overlaps with previous ball #{idball}: {repr(b)}')
+        return False
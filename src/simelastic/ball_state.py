@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2025 Nicolás Cardiel
+#
+# This file is part of simelastic
+#
+# SPDX-License-Identifier: GPL-3.0+
+# License-Filename: LICENSE
+#
+
+import numpy as np
+
+from .vector3D import Vector3D
+
+
+class BallState:
+    """Structure-of-arrays storage of the state of a set of balls.
+
+    Positions, velocities and colors are stored in contiguous float64
+    arrays of shape (N, 3), and radii and masses in arrays of shape (N,).
+    The container of each ball is kept in a Python list. The arrays are
+    allocated with some extra capacity, so that balls can be appended
+    without reallocating the buffers every time.
+
+    The attribute version is increased every time the positions or the
+    radii are modified by the methods of the package (code writing
+    directly in the arrays must increase it as well), so that indices
+    built from them (see OverlapGrid) can detect that they are outdated.
+
+    Each ball also has a local clock (the array time): its position is
+    the one at that time. This allows run_simulation to move only the
+    balls involved in each event (see .advance()); .synchronize() brings
+    all the balls to the same time before their state is used
+    elsewhere.
+    """
+    def __init__(self, capacity=1):
+        self.nballs = 0
+        self.version = 0
+        capacity = max(1, capacity)
+        self._position = np.zeros((capacity, 3))
+        self._velocity = np.zeros((capacity, 3))
+        self._rgbcolor = np.zeros((capacity, 3))
+        self._rgbcolor_on_speed = np.zeros((capacity, 3))
+        self._has_rgbcolor_on_speed = np.zeros(capacity, dtype=bool)
+        self._radius = np.zeros(capacity)
+        self._mass = np.zeros(capacity)
+        self._time = np.zeros(capacity)
+        self.container = []
+
+    def __str__(self):
+        output = '<BallState instance>\n'
+        output += f'    nballs = {self.nballs}'
+        return output
+
+    @classmethod
+    def from_arrays(
+            cls,
+            position=None,
+            velocity=None,
+            radius=None,
+            mass=None,
+            rgbcolor=None,
+            rgbcolor_on_speed=None,
+            container=None
+    ):
+        """Create a BallState from arrays with shape (N, 3) and (N,).
+
+        rgbcolor_on_speed can be None or an array with NaN values in the
+        rows of the balls without color on speed. The same container is
+        assigned to all the balls.
+        """
+        position = np.asarray(position, dtype=float).reshape(-1, 3)
+        nballs = len(position)
+        state = cls(capacity=nballs)
+        state.nballs = nballs
+        state.position[:] = position
+        state.velocity[:] = velocity
+        state.radius[:] = radius
+        state.mass[:] = mass
+        state.rgbcolor[:] = rgbcolor
+        if rgbcolor_on_speed is not None:
+            rgbcolor_on_speed = np.asarray(rgbcolor_on_speed, dtype=float)
+            state.has_rgbcolor_on_speed[:] = ~np.any(np.isnan(rgbcolor_on_speed), axis=1)
+            state.rgbcolor_on_speed[:] = np.nan_to_num(rgbcolor_on_speed)
+        state.container = [container] * nballs
+        return state
+
+    @property
+    def position(self):
+        return self._position[:self.nballs]
+
+    @property
+    def velocity(self):
+        return self._velocity[:self.nballs]
+
+    @property
+    def rgbcolor(self):
+        return self._rgbcolor[:self.nballs]
+
+    @property
+    def rgbcolor_on_speed(self):
+        return self._rgbcolor_on_speed[:self.nballs]
+
+    @property
+    def has_rgbcolor_on_speed(self):
+        return self._has_rgbcolor_on_speed[:self.nballs]
+
+    @property
+    def radius(self):
+        return self._radius[:self.nballs]
+
+    @property
+    def mass(self):
+        return self._mass[:self.nballs]
+
+    @property
+    def time(self):
+        return self._time[:self.nballs]
+
+    def update_position(self, t, nround=None):
+        """Move all the balls during a time t (see Ball.update_position)."""
+        position = self.position
+        velocity = self.velocity
+        position += velocity * t
+        if nround is not None:
+            np.round(position, nround, out=position)
+        self.time[:] += t
+        self.version += 1
+        moving = self.has_rgbcolor_on_speed & np.any(velocity != 0, axis=1)
+        self.rgbcolor[moving] = self.rgbcolor_on_speed[moving]
+
+    def advance(self, ids, time, nround=None):
+        """Move the balls ids from their local times to time.
+
+        If nround is not None, the positions are rounded to nround
+        decimals.
+        """
+        ids = np.asarray(ids, dtype=int)
+        velocity = self.velocity[ids]
+        position = self.positions_at(ids, time)
+        if nround is not None:
+            np.round(position, nround, out=position)
+        self.position[ids] = position
+        self.time[ids] = time
+        self.version += 1
+        moving = ids[self.has_rgbcolor_on_speed[ids] & np.any(velocity != 0, axis=1)]
+        self.rgbcolor[moving] = self.rgbcolor_on_speed[moving]
+
+    def synchronize(self, time, nround=None):
+        """Move all the balls from their local times to time (see .advance())."""
+        position = self.position
+        velocity = self.velocity
+        position += velocity * (time - self.time)[:, np.newaxis]
+        if nround is not None:
+            np.round(position, nround, out=position)
+        self.time[:] = time
+        self.version += 1
+        moving = self.has_rgbcolor_on_speed & np.any(velocity != 0, axis=1)
+        self.rgbcolor[moving] = self.rgbcolor_on_speed[moving]
+
+    def positions_at(self, ids, time):
+        """Positions (M, 3) of the balls ids at time, without moving them."""
+        return self.position[ids] + self.velocity[ids] * (time - self.time[ids])[:, np.newaxis]
+
+    def _grow(self, capacity):
+        for name in ['_position', '_velocity', '_rgbcolor', '_rgbcolor_on_speed',
+                     '_has_rgbcolor_on_speed', '_radius', '_mass', '_time']:
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.nballs] = old[:self.nballs]
+            setattr(self, name, new)
+
+    def append(
+            self,
+            position=None,
+            velocity=None,
+            radius=None,
+            mass=None,
+            rgbcolor=None,
+            rgbcolor_on_speed=None,
+            container=None
+    ):
+        """Append a new ball and return its index."""
+        if self.nballs == len(self._radius):
+            self._grow(2 * len(self._radius))
+        i = self.nballs
+        self._position[i] = [position.x, position.y, position.z]
+        self._velocity[i] = [velocity.x, velocity.y, velocity.z]
+        self._rgbcolor[i] = [rgbcolor.x, rgbcolor.y, rgbcolor.z]
+        if rgbcolor_on_speed is None:
+            self._rgbcolor_on_speed[i] = 0
+            self._has_rgbcolor_on_speed[i] = False
+        else:
+            self._rgbcolor_on_speed[i] = [rgbcolor_on_speed.x, rgbcolor_on_speed.y, rgbcolor_on_speed.z]
+            self._has_rgbcolor_on_speed[i] = True
+        self._radius[i] = radius
+        self._mass[i] = mass
+        self._time[i] = 0
+        self.container.append(container)
+        self.nballs += 1
+        return i
+
+
+class Vector3DView(Vector3D):
+    """Vector3D whose coordinates live in a row of a BallState array.
+
+    Reading or modifying the x, y and z attributes accesses directly
+    the corresponding row of the array `name` of the BallState instance.
+    """
+    def __init__(self, state, name, index):
+        self.state = state
+        self.name = name
+        self.index = index
+
+    @property
+    def x(self):
+        return float(getattr(self.state, self.name)[self.index, 0])
+
+    @x.setter
+    def x(self, value):
+        getattr(self.state, self.name)[self.index, 0] = value
+        self.state.version += 1
+
+    @property
+    def y(self):
+        return float(getattr(self.state, self.name)[self.index, 1])
+
+    @y.setter
+    def y(self, value):
+        getattr(self.state, self.name)[self.index, 1] = value
+        self.state.version += 1
+
+    @property
+    def z(self):
+        return float(getattr(self.state, self.name)[self.index, 2])
+
+    @z.setter
+    def z(self, value):
+        getattr(self.state, self.name)[self.index, 2] = value
+        self.state.version += 1
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2025 Nicolás Cardiel
+#
+# This file is part of simelastic
+#
+# SPDX-License-Identifier: GPL-3.0+
+# License-Filename: LICENSE
+#
+
+import numpy as np
+
+from .container3D import Cuboid3D
+
+
+class CellList:
+    """Uniform grid of cells used as broad phase for ball-ball collisions.
+
+    The space between `lower` and `upper` is divided in cells whose size
+    is, at least, `min_cell_size` along each axis. When this size is not
+    smaller than the largest ball diameter, two balls can only collide
+    when they are in the same or in neighbouring cells. The cell of each
+    ball must be kept up to date through cell-crossing events, as in
+    classic event-driven molecular dynamics.
+    """
+    def __init__(self, lower, upper, min_cell_size, position):
+        self.lower = np.asarray(lower, dtype=float)
+        extent = np.asarray(upper, dtype=float) - self.lower
+        # avoid cells slightly smaller than min_cell_size due to rounding errors
+        ncells = np.floor(extent / (min_cell_size * (1 + 1e-6))).astype(int)
+        self.ncells = np.maximum(1, ncells)
+        self.cell_size = extent / self.ncells
+        position = np.asarray(position, dtype=float).reshape(-1, 3)
+        ball_cell = np.floor((position - self.lower) / self.cell_size).astype(int)
+        ball_cell = np.clip(ball_cell, 0, self.ncells - 1)
+        self.set_ball_cell(ball_cell)
+
+    def __str__(self):
+        output = '<CellList instance>\n'
+        output += f'    ncells = {self.ncells.tolist()}\n'
+        output += f'    cell_size = {self.cell_size.tolist()}\n'
+        output += f'    nballs = {len(self.ball_cell)}'
+        return output
+
+    @classmethod
+    def from_containers(cls, containers, radius, position):
+        """Cell list covering the Cuboid3D containers of the balls.
+
+        If any of the containers is not a Cuboid3D instance, None is
+        returned.
+        """
+        lower = np.full(3, np.inf)
+        upper = np.full(3, -np.inf)
+        for container in {id(c): c for c in containers}.values():
+            if not isinstance(container, Cuboid3D):
+                return None
+            lower = np.minimum(lower, [container.xmin, container.ymin, container.zmin])
+            upper = np.maximum(upper, [container.xmax, container.ymax, container.zmax])
+        if np.any(np.isinf(lower)):
+            return None
+        return cls(lower, upper, 2 * np.max(radius), position)
+
+    def set_ball_cell(self, ball_cell):
+        """Assign the cell (N, 3) of every ball."""
+        self.ball_cell = np.asarray(ball_cell, dtype=int).reshape(-1, 3).tolist()
+        self.cells = dict()
+        for i, cell in enumerate(self.ball_cell):
+            self.cells.setdefault(tuple(cell), set()).add(i)
+
+    @property
+    def total_cells(self):
+        return int(np.prod(self.ncells))
+
+    def neighbours(self, i):
+        """Balls in the same or in the 26 neighbouring cells of ball i."""
+        cx, cy, cz = self.ball_cell[i]
+        result = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for dz in (-1, 0, 1):
+                    cell = self.cells.get((cx + dx, cy + dy, cz + dz))
+                    if cell:
+                        result.extend(cell)
+        result.remove(i)
+        return result
+
+    def time_to_cell_crossing(self, i, position, velocity):
+        """Time to the next cell crossing of ball i.
+
+        Returns (t, axis, direction), where direction is +1 or -1
+        depending on the cell index increasing or decreasing along axis.
+        If the ball does not leave its cell, (np.inf, -1, 0) is returned.
+        """
+        cell = self.ball_cell[i]
+        tmin, axis_min, direction_min = np.inf, -1, 0
+        for axis in range(3):
+            v = velocity[axis]
+            c = cell[axis]
+            if v > 0 and c < self.ncells[axis] - 1:
+                t = (self.lower[axis] + (c + 1) * self.cell_size[axis] - position[axis]) / v
+                direction = 1
+            elif v < 0 and c > 0:
+                t = (self.lower[axis] + c * self.cell_size[axis] - position[axis]) / v
+                direction = -1
+            else:
+                continue
+            if t < tmin:
+                tmin, axis_min, direction_min = t, axis, direction
+        # rounding errors can lead to slightly negative times
+        return max(tmin, 0.0), axis_min, direction_min
+
+    def move(self, i, axis, direction):
+        """Move ball i to the neighbouring cell along axis."""
+        cell = self.ball_cell[i]
+        key = tuple(cell)
+        self.cells[key].discard(i)
+        if not self.cells[key]:
+            del self.cells[key]
+        cell[axis] = min(max(cell[axis] + direction, 0), self.ncells[axis] - 1)
+        self.cells.setdefault(tuple(cell), set()).add(i)
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2025 Nicolás Cardiel
+#
+# This file is part of simelastic
+#
+# SPDX-License-Identifier: GPL-3.0+
+# License-Filename: LICENSE
+#
+
+import json
+import numpy as np
+import os
+from pathlib import Path
+import time
+
+from .ball import BallCollection
+from .container3D import container_from_dict
+
+CHECKPOINT_FORMAT = 'simelastic-checkpoint'
+CHECKPOINT_VERSION = 1
+
+# arrays of the BallState stored in the checkpoint
+CHECKPOINT_ARRAYS = ['position', 'velocity', 'rgbcolor', 'rgbcolor_on_speed', 'has_rgbcolor_on_speed',
+                     'radius', 'mass', 'time']
+
+
+def save_checkpoint(
+        filename=None,
+        balls=None,
+        time=None,
+        tstart=None,
+        time_interval=None,
+        stage=0,
+        completed=False,
+        rng=None,
+        events=None
+):
+    """Save the state of a simulation in a .npz file.
+
+    The file contains the arrays of the BallState (including the local
+    clocks of the balls, which need not be synchronized), the index of
+    the container of each ball, and a JSON string with the simulation
+    time, the start time and time interval of the current call to
+    run_simulation (stage), the description of the containers and the
+    state of the random number generator rng (if any). The dictionary
+    of arrays events (the pending events of run_simulation) is stored
+    with the prefix 'events_'. The file is written with a temporary
+    name and then renamed, so that an interruption does not destroy
+    the previous checkpoint.
+    """
+    if not isinstance(balls, BallCollection):
+        raise ValueError(f'balls: {balls} is not an instance of BallCollection')
+    state = balls.state
+    containers = []
+    container_ids = dict()
+    container_index = np.zeros(state.nballs, dtype=int)
+    for i, container in enumerate(state.container):
+        if id(container) not in container_ids:
+            container_ids[id(container)] = len(containers)
+            containers.append(container.to_dict())
+        container_index[i] = container_ids[id(container)]
+    metadata = {
+        'format': CHECKPOINT_FORMAT,
+        'version': CHECKPOINT_VERSION,
+        'time': time,
+        'tstart': tstart,
+        'time_interval': time_interval,
+        'stage': stage,
+        'completed': completed,
+        'containers': containers,
+        'rng': None if rng is None else rng.bit_generator.state
+    }
+    arrays = {name: getattr(state, name) for name in CHECKPOINT_ARRAYS}
+    if events is not None:
+        arrays.update({f'events_{name}': value for name, value in events.items()})
+    filename = Path(filename)
+    tmpfile = filename.with_name(f'{filename.name}.tmp{os.getpid()}')
+    with open(tmpfile, 'wb') as f:
+        np.savez(f, metadata=np.array(json.dumps(metadata)), container_index=container_index, **arrays)
+    os.replace(tmpfile, filename)
+
+
+class Checkpoint:
+    """Simulation state read from a file created by save_checkpoint."""
+    def __init__(self, filename=None):
+        if filename is None:
+            raise ValueError('Undefined filename')
+        self.filename = Path(filename)
+        with np.load(self.filename) as data:
+            metadata = json.loads(str(data['metadata']))
+            if metadata.get('format') != CHECKPOINT_FORMAT:
+                raise ValueError(f'{self.filename} is not a {CHECKPOINT_FORMAT} file')
+            self.arrays = {name: data[name] for name in CHECKPOINT_ARRAYS}
+            self.container_index = data['container_index']
+            events = {name[7:]: data[name] for name in data.files if name.startswith('events_')}
+        self.events = events if events else None
+        self.time = metadata['time']
+        self.tstart = metadata['tstart']
+        self.time_interval = metadata['time_interval']
+        self.stage = metadata['stage']
+        self.completed = metadata['completed']
+        self.containers = metadata['containers']
+        self.rng_state = metadata['rng']
+
+    def __str__(self):
+        output = '<Checkpoint instance>\n'
+        output += f'    filename = {self.filename}\n'
+        output += f'    nballs = {len(self.container_index)}\n'
+        output += f'    time = {self.time}\n'
+        output += f'    stage = {self.stage}\n'
+        output += f'    completed = {self.completed}'
+        return output
+
+    def restore(self, balls, rng=None):
+        """Copy the saved state into an existing BallCollection.
+
+        The balls are modified in place, so that the references held by
+        the caller remain valid. The containers equal to the current
+        ones are kept (preserving their identity); the others are
+        replaced by the saved ones. If rng is given, its state is also
+        restored.
+        """
+        if not isinstance(balls, BallCollection):
+            raise ValueError(f'balls: {balls} is not an instance of BallCollection')
+        state = balls.state
+        if state.nballs != len(self.container_index):
+            raise ValueError(f'balls.nballs: {state.nballs} does not match the checkpoint nballs: '
+                             f'{len(self.container_index)}')
+        for name in CHECKPOINT_ARRAYS:
+            getattr(state, name)[:] = self.arrays[name]
+        state.version += 1
+        containers = [container_from_dict(container_dict) for container_dict in self.containers]
+        for i, k in enumerate(self.container_index.tolist()):
+            if state.container[i].to_dict() != self.containers[k]:
+                state.container[i] = containers[k]
+        if rng is not None:
+            if self.rng_state is None:
+                raise ValueError(f'No random number generator state in {self.filename}')
+            rng.bit_generator.state = self.rng_state
+
+
+class Checkpointer:
+    """Periodic checkpoints of a simulation.
+
+    An instance is passed to every call to run_simulation (each call is
+    a stage of the simulation), which saves the state of the balls in
+    filename every interval seconds (wall-clock time) and at the end of
+    the stage. When resume is True the last checkpoint is read first:
+    run_simulation then skips the stages already completed and continues
+    the interrupted one from the saved time.
+
+    Parameters
+    ----------
+    filename : str or Path
+        Checkpoint file (.npz).
+    interval : float
+        Wall-clock time (seconds) between checkpoints.
+    resume : bool
+        If True, continue from the checkpoint stored in filename.
+    rng : numpy.random.Generator or None
+        Random number generator whose state is saved and restored.
+    """
+    def __init__(self, filename=None, interval=600, resume=False, rng=None):
+        if filename is None:
+            raise ValueError('Undefined filename')
+        self.filename = Path(filename)
+        self.interval = interval
+        self.rng = rng
+        self.stage = -1
+        if resume:
+            self.saved = Checkpoint(self.filename)
+            print(f'Resuming from checkpoint {self.filename} (stage {self.saved.stage}, time {self.saved.time})')
+        else:
+            self.saved = None
+        self.last_save = time.monotonic()
+
+    def __str__(self):
+        output = '<Checkpointer instance>\n'
+        output += f'    filename = {self.filename}\n'
+        output += f'    interval = {self.interval}\n'
+        output += f'    stage = {self.stage}'
+        return output
+
+    def next_stage(self):
+        """Start a new stage and return its number."""
+        self.stage += 1
+        return self.stage
+
+    def due(self):
+        return time.monotonic() - self.last_save >= self.interval
+
+    def save(self, balls, sinks, time_now, tstart, time_interval, completed=False, events=None):
+        """Flush the sinks and save a checkpoint of the current stage."""
+        for s in sinks:
+            s.flush()
+        save_checkpoint(
+            filename=self.filename,
+            balls=balls,
+            time=time_now,
+            tstart=tstart,
+            time_interval=time_interval,
+            stage=self.stage,
+            completed=completed,
+            rng=self.rng,
+            events=events
+        )
+        self.last_save = time.monotonic()
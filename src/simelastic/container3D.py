@@ -20,6 +20,7 @@ from .default_parameters import DEFAULT_CUBOID3D_XMIN, DEFAULT_CUBOID3D_XMAX
 from .default_parameters import DEFAULT_CUBOID3D_YMIN, DEFAULT_CUBOID3D_YMAX
 from .default_parameters import DEFAULT_CUBOID3D_ZMIN, DEFAULT_CUBOID3D_ZMAX
 from .default_parameters import DEFAULT_CYLINDER_RADIUS, DEFAULT_CYLINDER_HEIGHT
+from .default_parameters import DEFAULT_TIME_TOLERANCE
 
 
 class Container3D(ABC):
@@ -27,18 +28,31 @@ class Container3D(ABC):
     def __init__(self):
         self.type = None
 
+    @abstractmethod
+    def to_dict(self):
+        raise NotImplementedError("no .to_dict method")
+
     @abstractmethod
     def new_xyz_for_ball(self, rng, ball_radius=None):
         raise NotImplementedError("no .new_random_ball method")
 
+    @abstractmethod
+    def sample_positions(self, rng, n, ball_radius=None):
+        raise NotImplementedError("no .sample_positions method")
+
     @abstractmethod
     def can_host_ball(self, ball_position=None, ball_radius=None):
         raise NotImplementedError("no .can_host_ball method")
 
     @abstractmethod
-    def collision_with_container(self, ball=None, nround=12):
+    def collision_with_container(self, ball=None, nround=None):
         raise NotImplementedError("no .collision_with_container method")
 
+    @abstractmethod
+    def collision_times_with_container(self, position=None, velocity=None, radius=None, nround=None,
+                                       time_tolerance=DEFAULT_TIME_TOLERANCE):
+        raise NotImplementedError("no .collision_times_with_container method")
+
 
 class Cuboid3D(Container3D):
     def __init__(
@@ -70,6 +84,12 @@ class Cuboid3D(Container3D):
                f'ymin={self.ymin}, ymax={self.ymax}, ' + \
                f'zmin={self.zmin}, zmax={self.zmax})'
 
+    def to_dict(self):
+        return {'type': self.type,
+                'xmin': self.xmin, 'xmax': self.xmax,
+                'ymin': self.ymin, 'ymax': self.ymax,
+                'zmin': self.zmin, 'zmax': self.zmax}
+
     def new_xyz_for_ball(self, rng, ball_radius=None):
         if ball_radius is None:
             ball_radius = DEFAULT_BALL_RADIUS
@@ -85,6 +105,17 @@ class Cuboid3D(Container3D):
         z = rng.uniform(self.zmin + ball_radius, self.zmax - ball_radius, 1)[0]
         return Vector3D(x, y, z)
 
+    def sample_positions(self, rng, n, ball_radius=None):
+        """Uniform random positions (n, 3) of balls fitting within the container."""
+        if ball_radius is None:
+            ball_radius = DEFAULT_BALL_RADIUS
+        lower = np.array([self.xmin, self.ymin, self.zmin], dtype=float) + ball_radius
+        upper = np.array([self.xmax, self.ymax, self.zmax], dtype=float) - ball_radius
+        for axis, name in enumerate(['X', 'Y', 'Z']):
+            if lower[axis] > upper[axis]:
+                raise ValueError(f'The ball diameter: {2 * ball_radius} is larger than the container {name} size')
+        return rng.uniform(lower, upper, size=(n, 3))
+
     def can_host_ball(self, ball_position=None, ball_radius=None):
         if not isinstance(ball_position, Vector3D):
             raise ValueError(f'position:{ball_position} is not a Vector3D instance')
@@ -110,46 +141,61 @@ class Cuboid3D(Container3D):
                                 result = False                
         return result
     
-    def collision_with_container(self, ball=None, nround=12):
-        # collision with wall at x=xmax or x=xmin
-        if ball.velocity.x == 0:
-            tx = np.inf
-        elif ball.velocity.x > 0:
-            tx = (self.xmax - ball.radius - ball.position.x) / ball.velocity.x
-        else:
-            tx = (self.xmin + ball.radius - ball.position.x) / ball.velocity.x
-        # collision with wall at y=ymax or y=ymin
-        if ball.velocity.y == 0:
-            ty = np.inf
-        elif ball.velocity.y > 0:
-            ty = (self.ymax - ball.radius - ball.position.y) / ball.velocity.y
-        else:
-            ty = (self.ymin + ball.radius - ball.position.y) / ball.velocity.y
-        # collision with wall at z=zmax or z=zmin
-        if ball.velocity.z == 0:
-            tz = np.inf
-        elif ball.velocity.z > 0:
-            tz = (self.zmax - ball.radius - ball.position.z) / ball.velocity.z
-        else:
-            tz = (self.zmin + ball.radius - ball.position.z) / ball.velocity.z
-        # time before collision
-        tx = np.round(tx, nround)
-        ty = np.round(ty, nround)
-        tz = np.round(tz, nround)
-        tmin = np.min([tx, ty, tz])
+    def collision_with_container(self, ball=None, nround=None):
+        position = np.array([[ball.position.x, ball.position.y, ball.position.z]])
+        velocity = np.array([[ball.velocity.x, ball.velocity.y, ball.velocity.z]])
+        tmin, hit = self.collision_times_with_container(position, velocity, [ball.radius], nround=nround)
+        tmin = tmin[0]
+        tx_hit, ty_hit, tz_hit = hit[0]
         # future ball just after collision
         future_ball = copy.deepcopy(ball)
         if not np.isinf(tmin):
-            future_ball.update_position(tmin)
+            future_ball.update_position(tmin, nround=nround)
             # reverse velocity accordingly
-            if tx == tmin:
+            if tx_hit:
                 future_ball.velocity.x = -future_ball.velocity.x
-            if ty == tmin:
+            if ty_hit:
                 future_ball.velocity.y = -future_ball.velocity.y
-            if tz == tmin:
+            if tz_hit:
                 future_ball.velocity.z = -future_ball.velocity.z
         return tmin, future_ball
 
+    def collision_times_with_container(self, position=None, velocity=None, radius=None, nround=None,
+                                       time_tolerance=DEFAULT_TIME_TOLERANCE):
+        """Time to the next collision with the walls for N balls at once.
+
+        The positions and velocities are arrays with shape (N, 3), and the
+        radii an array with shape (N,). Returns the time to the next
+        collision of each ball (np.inf for balls at rest) and a boolean
+        mask with shape (N, 3) indicating the axes along which the
+        velocity must be reversed at that time (several walls can be hit
+        simultaneously). No Ball instance is created nor copied.
+
+        If nround is not None, the times are rounded to nround decimals
+        and the walls hit at the same time are those with equal times.
+        Otherwise, the walls hit within time_tolerance of the first one
+        are hit simultaneously, and balls slightly beyond a wall (due to
+        rounding errors) moving outwards hit it immediately.
+        """
+        position = np.asarray(position, dtype=float)
+        velocity = np.asarray(velocity, dtype=float)
+        radius = np.asarray(radius, dtype=float)[:, np.newaxis]
+        lower = np.array([self.xmin, self.ymin, self.zmin]) + radius
+        upper = np.array([self.xmax, self.ymax, self.zmax]) - radius
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(velocity > 0, (upper - position) / velocity, np.inf)
+            t = np.where(velocity < 0, (lower - position) / velocity, t)
+        if nround is not None:
+            t = np.round(t, nround)
+            tmin = t.min(axis=1)
+            hit = (t == tmin[:, np.newaxis])
+        else:
+            np.clip(t, 0, None, out=t)
+            tmin = t.min(axis=1)
+            hit = (t <= tmin[:, np.newaxis] + time_tolerance)
+        hit &= np.isfinite(tmin)[:, np.newaxis]
+        return tmin, hit
+
 
 class VerticalCylinder3D(Container3D):
     def __init__(
@@ -178,6 +224,14 @@ class VerticalCylinder3D(Container3D):
                f'height={self.height}, ' + \
                f'base_center_position={repr(self.base_center_position)})'
 
+    def to_dict(self):
+        return {'type': self.type,
+                'radius': self.radius,
+                'height': self.height,
+                'base_center_position': [self.base_center_position.x,
+                                         self.base_center_position.y,
+                                         self.base_center_position.z]}
+
     def new_xyz_for_ball(self, rng, ball_radius=None):
         if ball_radius is None:
             ball_radius = DEFAULT_BALL_RADIUS
@@ -200,6 +254,26 @@ class VerticalCylinder3D(Container3D):
         zz = self.base_center_position.z + z
         return Vector3D(xx, yy, zz)
 
+    def sample_positions(self, rng, n, ball_radius=None):
+        """Uniform random positions (n, 3) of balls fitting within the container.
+
+        The distance to the axis is sampled as rmax * sqrt(u), with u
+        uniform in [0, 1), which gives a uniform density within the
+        circle of radius rmax without rejection sampling.
+        """
+        if ball_radius is None:
+            ball_radius = DEFAULT_BALL_RADIUS
+        if ball_radius > self.radius:
+            raise ValueError(f'The ball radius: {ball_radius} does not fit within the cylinder radius: {self.radius}')
+        if 2 * ball_radius > self.height:
+            raise ValueError(f'The ball diameter: {2 * ball_radius} does not fit ' +
+                             f'within the cylinder height: {self.height}')
+        rdist = (self.radius - ball_radius) * np.sqrt(rng.uniform(0, 1, n))
+        phi = rng.uniform(0, 2 * np.pi, n)
+        z = rng.uniform(ball_radius, self.height - ball_radius, n)
+        base = self.base_center_position
+        return np.column_stack([base.x + rdist * np.cos(phi), base.y + rdist * np.sin(phi), base.z + z])
+
     def can_host_ball(self, ball_position=None, ball_radius=None):
         if not isinstance(ball_position, Vector3D):
             raise ValueError(f'position: {ball_position} is not a Vector3D instance')
@@ -221,5 +295,22 @@ class VerticalCylinder3D(Container3D):
                     result = False
         return result
     
-    def collision_with_container(self, ball=None, nround=12):
+    def collision_with_container(self, ball=None, nround=None):
         raise ValueError('Still undefined function')
+
+    def collision_times_with_container(self, position=None, velocity=None, radius=None, nround=None,
+                                       time_tolerance=DEFAULT_TIME_TOLERANCE):
+        raise ValueError('Still undefined function')
+
+
+def container_from_dict(container_dict):
+    """Create a Container3D instance from the output of its .to_dict() method."""
+    container_dict = dict(container_dict)
+    container_type = container_dict.pop('type', None)
+    if container_type == 'Cuboid3D':
+        return Cuboid3D(**container_dict)
+    elif container_type == 'VerticalCylinder3D':
+        x, y, z = container_dict.pop('base_center_position')
+        return VerticalCylinder3D(base_center_position=Vector3D(x, y, z), **container_dict)
+    else:
+        raise ValueError(f'Unexpected container type: {container_type}')
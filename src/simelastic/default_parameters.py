@@ -10,6 +10,10 @@
 
 DEFAULT_BALL_RADIUS = 0.5
 
+# events closer in time than this are simultaneous (when the positions,
+# velocities and times are not rounded, see run_simulation)
+DEFAULT_TIME_TOLERANCE = 1e-12
+
 DEFAULT_CUBOID3D_XMIN = -5
 DEFAULT_CUBOID3D_XMAX = 5
 DEFAULT_CUBOID3D_YMIN = -5
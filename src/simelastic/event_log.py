@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2025 Nicolás Cardiel
+#
+# This file is part of simelastic
+#
+# SPDX-License-Identifier: GPL-3.0+
+# License-Filename: LICENSE
+#
+
+import copy
+import numpy as np
+
+from .ball import BallCollection
+from .snapshot_sink import SnapshotSink
+
+
+class EventLog(SnapshotSink):
+    """Compact record of the evolution of a BallCollection.
+
+    Instead of storing a full copy of the balls after every collision,
+    the log keeps a single copy of the initial BallCollection and, for
+    each event, the time, the indices of the balls whose velocity (or
+    color) changed, and the position, velocity and color of those balls
+    just after the event. Between events the balls move in straight
+    lines, so the full state at any time can be rebuilt from the log.
+
+    The log is kept in memory; it is the default sink of run_simulation.
+    """
+    reads_all_balls = False
+
+    def __init__(self, balls=None, time=0):
+        super().__init__()
+        self.initial_balls = None
+        self.nballs = 0
+        self.time = []
+        self.ids = []
+        self.position = []
+        self.velocity = []
+        self.rgbcolor = []
+        self._index = None
+        if balls is not None:
+            self.start(time, balls)
+
+    def __str__(self):
+        output = '<EventLog instance>\n'
+        output += f'    nballs = {self.nballs}\n'
+        output += f'    nevents = {self.nevents}\n'
+        output += f'    tstart = {self.tstart}\n'
+        output += f'    tend = {self.tend}'
+        return output
+
+    def __getstate__(self):
+        # the per-ball index is a cache that is not pickled
+        state = self.__dict__.copy()
+        state['_index'] = None
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault('_index', None)
+        self.__dict__.update(state)
+
+    @property
+    def nevents(self):
+        return len(self.time)
+
+    def start(self, time, balls):
+        if not isinstance(balls, BallCollection):
+            raise ValueError(f'balls: {balls} is not an instance of BallCollection')
+        self.initial_balls = copy.deepcopy(balls)
+        self.nballs = balls.nballs
+        self.tstart = time
+        self.tend = time
+
+    def record(self, time, ids, balls):
+        """Store the state of the balls ids at time."""
+        if balls.nballs != self.nballs:
+            raise ValueError(f'balls.nballs: {balls.nballs} does not match nballs: {self.nballs}')
+        state = balls.state
+        ids = np.asarray(ids, dtype=int)
+        self.time.append(time)
+        self.ids.append(ids)
+        self.position.append(state.position[ids].copy())
+        self.velocity.append(state.velocity[ids].copy())
+        self.rgbcolor.append(state.rgbcolor[ids].copy())
+        self.tend = time
+
+    def resume(self, time, balls):
+        """Discard the events at times >= time and record the state of all the balls."""
+        if not self.started:
+            raise ValueError('An EventLog is kept in memory and cannot be resumed after restarting the program')
+        nkeep = int(np.searchsorted(self.time, time, side='left'))
+        for name in ['time', 'ids', 'position', 'velocity', 'rgbcolor']:
+            del getattr(self, name)[nkeep:]
+        self.tend = self.time[-1] if nkeep > 0 else self.tstart
+        self.record(time, np.arange(balls.nballs), balls)
+
+    def iter_states(self):
+        """Iterate over the distinct event times.
+
+        For each time, yields (time, position, velocity, rgbcolor), where
+        the arrays (with shape (N, 3)) contain the state of all the balls
+        after all the events at that time. The yielded arrays are reused
+        in the following iterations, and must be copied if needed.
+        """
+        state = self.initial_balls.state
+        position = state.position.copy()
+        velocity = state.velocity.copy()
+        rgbcolor = state.rgbcolor.copy()
+        tlast = np.full(self.nballs, float(self.tstart))
+        current_position = position.copy()
+        t = self.tstart
+        for k in range(self.nevents + 1):
+            if k < self.nevents:
+                tk = self.time[k]
+            else:
+                tk = None
+            if tk != t:
+                current_position[:] = position + velocity * (t - tlast)[:, np.newaxis]
+                yield t, current_position, velocity, rgbcolor
+                t = tk
+            if tk is not None:
+                ids = self.ids[k]
+                position[ids] = self.position[k]
+                velocity[ids] = self.velocity[k]
+                rgbcolor[ids] = self.rgbcolor[k]
+                tlast[ids] = tk
+
+    def dense(self):
+        """Full state of the balls at every distinct event time.
+
+        Returns (time, position, velocity, rgbcolor), with shapes (T,)
+        and (T, N, 3).
+        """
+        time, position, velocity, rgbcolor = [], [], [], []
+        for t, p, v, c in self.iter_states():
+            time.append(t)
+            position.append(p.copy())
+            velocity.append(v.copy())
+            rgbcolor.append(c.copy())
+        return np.array(time), np.array(position), np.array(velocity), np.array(rgbcolor)
+
+    def state_at(self, t):
+        """Position, velocity and color of all the balls at time t."""
+        position, velocity, rgbcolor = self.states_at(t)
+        return position[0], velocity[0], rgbcolor[0]
+
+    def per_ball_index(self):
+        """Event records sorted by ball and time.
+
+        Returns (key, time, position, velocity, rgbcolor), where the
+        records of every ball (including its initial state at tstart)
+        are contiguous and sorted in time, and key is an integer that
+        increases with the ball index and, for the same ball, with the
+        time of the record. The result is cached until new events are
+        recorded.
+        """
+        if self._index is not None and self._index[0] == self.nevents:
+            return self._index[1]
+        state = self.initial_balls.state
+        nrecords = [self.nballs] + [len(ids) for ids in self.ids]
+        ball = np.concatenate([np.arange(self.nballs)] + self.ids).astype(int)
+        time = np.repeat(np.array([self.tstart] + self.time, dtype=float), nrecords)
+        position = np.concatenate([state.position] + self.position).reshape(-1, 3)
+        velocity = np.concatenate([state.velocity] + self.velocity).reshape(-1, 3)
+        rgbcolor = np.concatenate([state.rgbcolor] + self.rgbcolor).reshape(-1, 3)
+        # integer rank of each record time, to build an exact sort key
+        self.unique_times = np.unique(time)
+        rank = np.searchsorted(self.unique_times, time)
+        key = ball * len(self.unique_times) + rank
+        # stable sort: for several records of a ball at the same time,
+        # the last one recorded comes last
+        order = np.argsort(key, kind='stable')
+        index = (key[order], time[order], position[order], velocity[order], rgbcolor[order])
+        self._index = (self.nevents, index)
+        return index
+
+    def states_at(self, times):
+        """Position, velocity and color of all the balls at several times.
+
+        Between events the balls move in straight lines, so the position
+        of a ball at time t is pos_k + vel_k * (t - t_k), where k is the
+        last event of that ball before t. The records of every ball are
+        located with a single binary search, without rebuilding the full
+        state at every event time.
+
+        Parameters
+        ----------
+        times : array_like
+            Times (F,) at which the state is computed. Times before
+            tstart are extrapolated from the initial state.
+
+        Returns
+        -------
+        position, velocity, rgbcolor : numpy.ndarray
+            Arrays with shape (F, N, 3).
+        """
+        times = np.atleast_1d(np.asarray(times, dtype=float))
+        key, time, position, velocity, rgbcolor = self.per_ball_index()
+        rank = np.searchsorted(self.unique_times, times, side='right') - 1
+        rank = np.clip(rank, 0, None)
+        query = np.arange(self.nballs)[np.newaxis, :] * len(self.unique_times) + rank[:, np.newaxis]
+        k = np.searchsorted(key, query, side='right') - 1
+        dt = times[:, np.newaxis] - time[k]
+        return position[k] + velocity[k] * dt[:, :, np.newaxis], velocity[k], rgbcolor[k]
+
+    def positions_at(self, times):
+        """Position of all the balls at several times, with shape (F, N, 3)."""
+        return self.states_at(times)[0]
+
+    def snapshot_at(self, t):
+        """BallCollection with the state of the balls at time t."""
+        snapshot = copy.deepcopy(self.initial_balls)
+        position, velocity, rgbcolor = self.state_at(t)
+        snapshot.state.position[:] = position
+        snapshot.state.velocity[:] = velocity
+        snapshot.state.rgbcolor[:] = rgbcolor
+        return snapshot
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2023-2025 Nicolás Cardiel
+#
+# This file is part of simelastic
+#
+# SPDX-License-Identifier: GPL-3.0+
+# License-Filename: LICENSE
+#
+
+import heapq
+
+# event types; when two events happen at the same time, the one
+# with the lowest type is processed first
+EVENT_WALL = 0
+EVENT_BALL = 1
+EVENT_CELL = 2
+
+
+class EventQueue:
+    """Priority queue of predicted collision events.
+
+    Events are invalidated lazily: each event stores the collision
+    counters of the balls involved at prediction time, and it is
+    discarded when popped if any of those counters has changed since
+    then (i.e., if any of the balls has been involved in a different
+    collision in the meantime).
+    """
+    def __init__(self, nballs=0):
+        self.nballs = nballs
+        self.ncollisions = [0] * nballs
+        self.heap = []
+        self.max_heap_size = max(1024, 4 * nballs)
+
+    def __str__(self):
+        output = '<EventQueue instance>\n'
+        output += f'    nballs = {self.nballs}\n'
+        output += f'    nevents = {len(self.heap)}'
+        return output
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push_wall(self, t, i):
+        """Insert collision of ball i with the container walls at time t."""
+        self.push(t, EVENT_WALL, i, -1)
+
+    def push_ball(self, t, i, j):
+        """Insert collision between balls i and j at time t."""
+        self.push(t, EVENT_BALL, i, j)
+
+    def push_cell(self, t, i):
+        """Insert crossing of ball i to a neighbouring cell at time t."""
+        self.push(t, EVENT_CELL, i, -1)
+
+    def push(self, t, event_type, i, j):
+        if j < 0:
+            nj = -1
+        else:
+            nj = self.ncollisions[j]
+        heapq.heappush(self.heap, (t, event_type, i, j, self.ncollisions[i], nj))
+        if len(self.heap) > self.max_heap_size:
+            self.compact()
+
+    def invalidate(self, i):
+        """Discard every pending event involving ball i."""
+        self.ncollisions[i] += 1
+
+    def is_valid(self, event):
+        t, event_type, i, j, ni, nj = event
+        if ni != self.ncollisions[i]:
+            return False
+        if j >= 0 and nj != self.ncollisions[j]:
+            return False
+        return True
+
+    def pop(self):
+        """Return (t, event_type, i, j) of the next valid event.
+
+        If the queue does not contain any valid event, None is returned.
+        """
+        while self.heap:
+            event = heapq.heappop(self.heap)
+            if self.is_valid(event):
+                return event[:4]
+        return None
+
+    def valid_events(self):
+        """List of (t, event_type, i, j) of the pending valid events."""
+        return [event[:4] for event in self.heap if self.is_valid(event)]
+
+    def next_time(self):
+        """Time of the next valid event (inf if there is none)."""
+        while self.heap and not self.is_valid(self.heap[0]):
+            heapq.heappop(self.heap)
+        if self.heap:
+            return self.heap[0][0]
+        return float('inf')
+
+    def compact(self):
+        """Remove invalidated events to keep the heap size bounded."""
+        self.heap = [event for event in self.heap if self.is_valid(event)]
+        heapq.heapify(self.heap)
+        self.max_heap_size = max(1024, 4 * self.nballs, 2 * len(self.heap))
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2025 Nicolás Cardiel
+#
+# This file is part of simelastic
+#
+# SPDX-License-Identifier: GPL-3.0+
+# License-Filename: LICENSE
+#
+
+import hashlib
+import json
+import numpy as np
+import os
+from pathlib import Path
+import shutil
+
+from .event_log import EventLog
+from .trajectory import Trajectory
+
+# to be increased when the rendering changes, so that the frames
+# rendered by previous versions are not reused
+FRAME_CACHE_VERSION = 1
+
+
+def source_hash(source):
+    """SHA-256 digest of the content of an EventLog or a Trajectory."""
+    sha = hashlib.sha256()
+    if isinstance(source, Trajectory):
+        sha.update(json.dumps(source.container.to_dict(), sort_keys=True).encode())
+        for array in [source.radius, source.mass, source.time, source.position, source.velocity, source.rgbcolor]:
+            array = np.asarray(array)
+            sha.update(str(array.shape).encode())
+            # read the memory-mapped arrays in chunks of frames
+            for i in range(0, max(len(array), 1), 1024):
+                sha.update(np.ascontiguousarray(array[i:i + 1024]).tobytes())
+    elif isinstance(source, EventLog):
+        state = source.initial_balls.state
+        sha.update(json.dumps(state.container[0].to_dict(), sort_keys=True).encode())
+        for array in [state.position, state.velocity, state.rgbcolor, state.radius, state.mass,
+                      np.array([source.tstart] + source.time, dtype=float)]:
+            sha.update(np.ascontiguousarray(array).tobytes())
+        for ids, position, velocity, rgbcolor in zip(source.ids, source.position, source.velocity, source.rgbcolor):
+            for array in [ids, position, velocity, rgbcolor]:
+                sha.update(np.ascontiguousarray(array).tobytes())
+    else:
+        raise ValueError(f'source: {source} is not an EventLog or Trajectory instance')
+    return sha.hexdigest()
+
+
+class FrameCache:
+    """Content-addressed cache of rendered PNG frames.
+
+    Each frame is stored as cache_dir/xx/<key>.png, where key is the
+    SHA-256 digest of everything that determines the image (see
+    .key()), so that frames rendered in previous runs are reused when
+    only some of the rendering parameters (e.g., the time range) change.
+    """
+    def __init__(self, cache_dir=None):
+        if cache_dir is None:
+            raise ValueError('Undefined cache_dir')
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def __str__(self):
+        output = '<FrameCache instance>\n'
+        output += f'    cache_dir = {self.cache_dir}'
+        return output
+
+    @staticmethod
+    def key(**parameters):
+        """Digest of the parameters (which must be JSON serializable)."""
+        parameters['cache_version'] = FRAME_CACHE_VERSION
+        text = json.dumps(parameters, sort_keys=True)
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def path(self, key):
+        return self.cache_dir / key[:2] / f'{key}.png'
+
+    def contains(self, key):
+        return self.path(key).is_file()
+
+    def read(self, key):
+        with open(self.path(key), 'rb') as f:
+            return f.read()
+
+    def write(self, key, data):
+        """Store the PNG data of a frame."""
+        path = self.path(key)
+        path.parent.mkdir(exist_ok=True)
+        # write and rename, so that an interrupted write does not leave
+        # a truncated file in the cache
+        tmpfile = path.with_suffix(f'.tmp{os.getpid()}')
+        with open(tmpfile, 'wb') as f:
+            f.write(data)
+        os.replace(tmpfile, path)
+
+    def store_file(self, key, pngfile):
+        """Store a PNG file in the cache."""
+        with open(pngfile, 'rb') as f:
+            self.write(key, f.read())
+
+    def copy_to(self, key, pngfile):
+        """Copy a cached frame to pngfile."""
+        shutil.copyfile(self.path(key), pngfile)
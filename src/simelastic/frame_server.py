@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2025 Nicolás Cardiel
+#
+# This file is part of simelastic
+#
+# SPDX-License-Identifier: GPL-3.0+
+# License-Filename: LICENSE
+#
+
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import os
+from pathlib import Path
+import queue
+import subprocess
+import tempfile
+import threading
+from tqdm import tqdm
+
+from .write_frame_server_js import write_frame_server_js
+
+
+class FrameServer:
+    """Long-lived headless browser that renders frames on demand.
+
+    The browser is launched and the HTML scene is loaded only once. Each
+    call to .render() asks the node process (see write_frame_server_js)
+    to display a frame and save a screenshot, avoiding the startup of
+    a new browser for every frame.
+
+    Parameters
+    ----------
+    htmlfile : str or Path
+        HTML file defining the scene and a setFrame(k) function.
+    jsfile : str or Path
+        Name of the JavaScript file to be created, which is removed when
+        the server is closed. The messages of the node process are
+        written to a file with the same name and extension .log (they
+        are not piped, since a long render could fill the pipe and
+        block the browser).
+    width, height : int
+        Size of the PNG frames.
+    node_modules : str or Path
+        Directory where puppeteer has been installed. By default,
+        node_modules in the current directory (where time_rendering
+        installs it).
+    """
+    def __init__(self, htmlfile=None, jsfile=None, width=1600, height=900, node_modules=None):
+        if htmlfile is None:
+            raise ValueError(f'Undefined htmlfile')
+        if jsfile is None:
+            raise ValueError(f'Undefined jsfile')
+        self.htmlfile = Path(htmlfile)
+        self.jsfile = Path(jsfile)
+        self.logfile = self.jsfile.with_suffix('.log')
+        if node_modules is None:
+            node_modules = Path('node_modules')
+        self.node_modules = Path(node_modules).absolute()
+        self.width = width
+        self.height = height
+        self.process = None
+        self.flog = None
+
+    def __str__(self):
+        output = '<FrameServer instance>\n'
+        output += f'    htmlfile = {self.htmlfile}\n'
+        output += f'    jsfile = {self.jsfile}\n'
+        output += f'    running = {self.process is not None}'
+        return output
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self):
+        """Launch the browser and load the HTML scene."""
+        write_frame_server_js(jsfile=self.jsfile, htmlfile=self.htmlfile, width=self.width, height=self.height)
+        command_line_list = ['node', self.jsfile.name]
+        self.flog = open(self.logfile, 'wt')
+        # the modules are looked for in NODE_PATH, since the script is
+        # not within the directory where puppeteer has been installed
+        env = os.environ.copy()
+        node_path = [str(self.node_modules)]
+        if env.get('NODE_PATH'):
+            node_path.append(env['NODE_PATH'])
+        env['NODE_PATH'] = os.pathsep.join(node_path)
+        self.process = subprocess.Popen(
+            command_line_list,
+            cwd=self.jsfile.parent,
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=self.flog,
+            text=True,
+            bufsize=1
+        )
+        self.expect('ready')
+
+    def expect(self, message):
+        """Read a reply from the node process and check that it starts with message."""
+        line = self.process.stdout.readline().rstrip('\n')
+        if line != message and not line.startswith(message + ' '):
+            self.process.kill()
+            self.process.wait()
+            self.process.stdout.close()
+            self.process = None
+            self.flog.close()
+            with open(self.logfile, 'rt') as flog:
+                stderr = flog.read()
+            print(f'Error executing node {self.jsfile.name}: {stderr}')
+            raise SystemExit()
+        return line[len(message) + 1:]
+
+    def render(self, k, pngfile=None):
+        """Render frame k and save it as pngfile.
+
+        If pngfile is None, the PNG image is returned as bytes.
+        """
+        if self.process is None:
+            raise ValueError('The frame server has not been started')
+        if pngfile is None:
+            self.process.stdin.write(f'{k} -\n')
+        else:
+            self.process.stdin.write(f'{k} {Path(pngfile).absolute()}\n')
+        self.process.stdin.flush()
+        data = self.expect(f'done {k}')
+        if pngfile is None:
+            return base64.b64decode(data)
+
+    def close(self):
+        """Close the browser and remove the JavaScript file."""
+        self.jsfile.unlink(missing_ok=True)
+        if self.process is None:
+            return
+        self.process.stdin.close()
+        self.process.wait()
+        self.process.stdout.close()
+        self.process = None
+        self.flog.close()
+
+
+def render_frames(htmlfile=None, frames=None, width=1600, height=900, jobs=1, jsdir=None):
+    """Render frames in parallel with several frame servers.
+
+    Parameters
+    ----------
+    htmlfile : str or Path
+        HTML file defining the scene and a setFrame(k) function.
+    frames : list
+        List of (k, pngfile) with the frames to be rendered.
+    width, height : int
+        Size of the PNG frames.
+    jobs : int
+        Number of frame servers (i.e., of browsers) working at the same
+        time. Each one renders an interleaved subset of the frames.
+    jsdir : str or Path
+        Directory in which the JavaScript and log files of the servers
+        are created. By default, a temporary directory.
+    """
+    if frames is None:
+        raise ValueError(f'Undefined frames')
+    if jobs < 1:
+        raise ValueError(f'jobs: {jobs} must be >= 1')
+    jobs = min(jobs, max(len(frames), 1))
+    if jsdir is None:
+        with tempfile.TemporaryDirectory() as jsdir:
+            render_frames(htmlfile=htmlfile, frames=frames, width=width, height=height, jobs=jobs, jsdir=jsdir)
+        return
+    failed = threading.Event()
+
+    with tqdm(total=len(frames)) as progress:
+        def worker(j):
+            jsfile = Path(jsdir) / f'frame_server_{j}.js'
+            try:
+                with FrameServer(htmlfile=htmlfile, jsfile=jsfile, width=width, height=height) as frame_server:
+                    for k, pngfile in frames[j::jobs]:
+                        if failed.is_set():
+                            break
+                        frame_server.render(k, pngfile)
+                        progress.update(1)
+            except BaseException:
+                failed.set()
+                raise
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            # the exceptions of the workers are raised here
+            list(executor.map(worker, range(jobs)))
+
+
+def iter_frames(htmlfile=None, frames=None, width=1600, height=900, jobs=1, jsdir=None, maxsize=4):
+    """Render the frames in parallel and yield them in order.
+
+    The frames with indices in the list frames are rendered by jobs
+    frame servers, as in render_frames, but instead of being saved to
+    disk the PNG images are yielded as (k, bytes), in the same order as
+    in frames. The n-th frame of the list is rendered by the server
+    n % jobs, so that the frames are collected in order from the queue
+    of each server. Each server renders at most maxsize frames in
+    advance, which bounds the memory used. The JavaScript and log files
+    of the servers are created in jsdir (by default, a temporary
+    directory).
+    """
+    if frames is None:
+        raise ValueError(f'Undefined frames')
+    if jobs < 1:
+        raise ValueError(f'jobs: {jobs} must be >= 1')
+    frames = list(frames)
+    jobs = min(jobs, max(len(frames), 1))
+    if len(frames) == 0:
+        return
+    if jsdir is None:
+        with tempfile.TemporaryDirectory() as jsdir:
+            yield from iter_frames(htmlfile=htmlfile, frames=frames, width=width, height=height, jobs=jobs,
+                                   jsdir=jsdir, maxsize=maxsize)
+        return
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=maxsize) for j in range(jobs)]
+
+    def put(j, item):
+        while not stop.is_set():
+            try:
+                queues[j].put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def worker(j):
+        jsfile = Path(jsdir) / f'frame_server_{j}.js'
+        try:
+            with FrameServer(htmlfile=htmlfile, jsfile=jsfile, width=width, height=height) as frame_server:
+                for k in frames[j::jobs]:
+                    if stop.is_set():
+                        break
+                    put(j, (k, frame_server.render(k)))
+        except BaseException as error:
+            put(j, (None, error))
+
+    threads = [threading.Thread(target=worker, args=(j,), daemon=True) for j in range(jobs)]
+    for thread in threads:
+        thread.start()
+    try:
+        for n in range(len(frames)):
+            k, data = queues[n % jobs].get()
+            if k is None:
+                raise data
+            yield k, data
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2025 Nicolás Cardiel
+#
+# This file is part of simelastic
+#
+# SPDX-License-Identifier: GPL-3.0+
+# License-Filename: LICENSE
+#
+
+import numpy as np
+
+from .cell_list import CellList
+from .container3D import Cuboid3D
+from .event_queue import EventQueue, EVENT_WALL, EVENT_BALL, EVENT_CELL
+from .random_balls_in_container import balls_at_positions, isotropic_velocities
+
+from .ball import DEFAULT_BALL_RADIUS
+
+# relative excess of the final radius during the growth, so that
+# rounding errors do not make touching balls overlap
+GROWTH_GAP = 1e-9
+
+
+def growing_collision_times(dp, dv, sigma, rate):
+    """Times for pairs of balls whose radii grow at a given rate to touch.
+
+    dp and dv (N, 3) are the relative positions and velocities, and
+    sigma the current sum of radii, which increases at 2 * rate. The
+    pairs already in contact and approaching collide immediately. The
+    pairs that never collide get np.inf.
+    """
+    a = np.einsum('ij,ij->i', dv, dv) - 4 * rate ** 2
+    b = 2 * (np.einsum('ij,ij->i', dp, dv) - 2 * rate * sigma)
+    c = np.einsum('ij,ij->i', dp, dp) - sigma ** 2
+    disc = b ** 2 - 4 * a * c
+    denominator = -b + np.sqrt(np.clip(disc, 0, None))
+    valid = (c > 0) & (disc >= 0) & (denominator > 0)
+    t = np.full(len(c), np.inf)
+    # numerically stable form of the smallest positive root
+    t[valid] = 2 * c[valid] / denominator[valid]
+    t[(c <= 0) & (b < 0)] = 0.0
+    return t
+
+
+def grown_balls_in_empty_container(
+        container=None,
+        nballs=1,
+        radius=None,
+        mass=1,
+        random_speed=0,
+        rgbcolor=None,
+        rgbcolor_on_speed=None,
+        growth_rate=0.1,
+        max_collisions_per_ball=1000,
+        seed=1234,
+        debug=False
+):
+    """Insert balls within an empty container by growing them.
+
+    The balls are packed with the Lubachevsky-Stillinger algorithm:
+    they start as points at random positions, moving with unit speed
+    in random directions, and their radii grow at growth_rate while
+    they collide elastically with each other and with the walls of the
+    Cuboid3D container, until they reach radius. Each collision adds a
+    normal velocity 2 * growth_rate to the separation, so that the
+    balls move apart faster than they grow. Since this increases the
+    kinetic energy, the velocities are rescaled to unit rms speed every
+    nballs collisions. The simulation is event-driven, with a cell list
+    and a lazy update of the positions, so the cost per collision does
+    not depend on the number of balls.
+
+    Smaller values of growth_rate reach higher packing fractions (up to
+    about 0.64, random close packing) at the cost of more collisions.
+    A ValueError is raised if the number of collisions exceeds
+    max_collisions_per_ball * nballs, which means that the balls have
+    jammed before reaching radius. The final velocities are drawn as in
+    random_balls_in_empty_container.
+    """
+    if not isinstance(container, Cuboid3D):
+        raise ValueError(f'container: {container} is not a Cuboid3D instance')
+    if growth_rate <= 0:
+        raise ValueError(f'growth_rate: {growth_rate} must be > 0')
+
+    rng = np.random.default_rng(seed)
+
+    if radius is None:
+        radius = DEFAULT_BALL_RADIUS
+
+    lower = np.array([container.xmin, container.ymin, container.zmin], dtype=float)
+    upper = np.array([container.xmax, container.ymax, container.zmax], dtype=float)
+    if np.any(upper - lower < 2 * radius):
+        raise ValueError(f'The ball diameter: {2 * radius} is larger than the container size')
+    lower_list, upper_list = lower.tolist(), upper.tolist()
+    position = container.sample_positions(rng, nballs, ball_radius=0)
+    velocity = isotropic_velocities(rng, nballs, 1.0)
+    # time of the last update of the position of each ball
+    ball_time = np.zeros(nballs)
+    tend = radius * (1 + GROWTH_GAP) / growth_rate
+
+    cells = CellList(lower, upper, 2 * radius * (1 + GROWTH_GAP), position)
+    queue = EventQueue(nballs)
+    wall_hits = dict()
+    cell_crossings = dict()
+
+    def advance(i, t):
+        position[i] += velocity[i] * (t - ball_time[i])
+        ball_time[i] = t
+
+    def predict(i, t):
+        """Predict the next events of ball i, updated to time t."""
+        r = growth_rate * t
+        sigma = 2 * r
+        p = position[i]
+        v = velocity[i]
+        # walls: the gaps shrink at the speed of the ball plus growth_rate
+        twall, wall_hits[i] = np.inf, None
+        for axis, (pk, vk, lk, uk) in enumerate(zip(p.tolist(), v.tolist(), lower_list, upper_list)):
+            for side, gap, approach in [(1, uk - r - pk, vk + growth_rate), (-1, pk - lk - r, growth_rate - vk)]:
+                if approach > 0 and max(gap, 0.0) / approach < twall:
+                    twall, wall_hits[i] = max(gap, 0.0) / approach, (axis, side)
+        queue.push_wall(t + twall, i)
+        # cell crossing
+        tcell, axis, direction = cells.time_to_cell_crossing(i, p, v)
+        if tcell < np.inf:
+            cell_crossings[i] = (axis, direction)
+            queue.push_cell(t + tcell, i)
+        # neighbouring balls
+        neighbours = cells.neighbours(i)
+        if neighbours:
+            neighbours = np.array(neighbours)
+            pj = position[neighbours] + velocity[neighbours] * (t - ball_time[neighbours])[:, np.newaxis]
+            tball = growing_collision_times(pj - p, velocity[neighbours] - v, sigma, growth_rate)
+            for j, tj in zip(neighbours[tball < np.inf].tolist(), tball[tball < np.inf].tolist()):
+                queue.push_ball(t + tj, i, j)
+
+    def restart(t):
+        """Rescale the velocities to unit rms speed and predict all the events."""
+        nonlocal queue
+        position[:] += velocity * (t - ball_time)[:, np.newaxis]
+        ball_time[:] = t
+        velocity[:] /= np.sqrt(np.mean(np.einsum('ij,ij->i', velocity, velocity)))
+        queue = EventQueue(nballs)
+        for i in range(nballs):
+            predict(i, t)
+
+    restart(0.0)
+    max_collisions = max_collisions_per_ball * nballs
+    ncollisions = 0
+    while True:
+        event = queue.pop()
+        if event is None or event[0] > tend:
+            break
+        t, event_type, i, j = event
+        advance(i, t)
+        queue.invalidate(i)
+        if event_type == EVENT_WALL:
+            axis, side = wall_hits[i]
+            velocity[i, axis] = -velocity[i, axis] - 2 * side * growth_rate
+            ncollisions += 1
+        elif event_type == EVENT_BALL:
+            advance(j, t)
+            queue.invalidate(j)
+            normal = position[i] - position[j]
+            normal /= np.linalg.norm(normal)
+            # elastic collision of equal masses plus a separation of
+            # 2 * growth_rate on each ball
+            impulse = (2 * growth_rate - np.dot(velocity[i] - velocity[j], normal)) * normal
+            velocity[i] += impulse
+            velocity[j] -= impulse
+            ncollisions += 1
+        else:
+            cells.move(i, *cell_crossings[i])
+        if ncollisions > max_collisions:
+            packing_fraction = nballs * 4 / 3 * np.pi * (growth_rate * t) ** 3 / np.prod(upper - lower)
+            raise ValueError(f'Too many collisions: the balls jammed with radius {growth_rate * t} '
+                             f'(packing fraction {packing_fraction:.4f})')
+        if event_type != EVENT_CELL and ncollisions % nballs == 0:
+            if debug:
+                print(f'Time {t}, radius {growth_rate * t}, {ncollisions} collisions')
+            restart(t)
+        else:
+            predict(i, t)
+            if event_type == EVENT_BALL:
+                predict(j, t)
+
+    position += velocity * (tend - ball_time)[:, np.newaxis]
+
+    balls = balls_at_positions(rng, container, position, radius, mass, random_speed, rgbcolor, rgbcolor_on_speed)
+
+    if not debug:
+        print(f'{nballs} balls grown in empty container {container.type} after {ncollisions} collisions')
+
+    return balls
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2025 Nicolás Cardiel
+#
+# This file is part of simelastic
+#
+# SPDX-License-Identifier: GPL-3.0+
+# License-Filename: LICENSE
+#
+
+import math
+import numpy as np
+
+# the cells are identified by an integer key that is a linear function of
+# the cell indices, so that the keys of the neighbouring cells are obtained
+# by adding constant offsets (distant cells sharing a key only add
+# candidates that are discarded when computing the distances)
+KEY_BASE = 2 ** 21
+NEIGHBOUR_OFFSETS = [dx + dy * KEY_BASE + dz * KEY_BASE ** 2
+                     for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)]
+
+
+class OverlapGrid:
+    """Spatial hash of the balls of a BallState used to detect overlaps.
+
+    The balls are binned in cubic cells whose size is not smaller than
+    the sum of the radii of any two balls, so that a new ball can only
+    overlap with the balls in its own cell or in the 26 neighbouring
+    cells. Only the non-empty cells are stored (in a dictionary), so the
+    grid does not need to know the limits of the containers.
+
+    The grid is valid while the number of balls and the version of the
+    state (increased when the positions or the radii are modified) do
+    not change, except for the balls inserted through .insert().
+    """
+    def __init__(self, state, min_cell_size=0):
+        self.state = state
+        self.version = state.version
+        self.nballs = 0
+        self.max_radius = float(np.max(state.radius, initial=0))
+        # any cell size is valid if all the radii are zero
+        self.cell_size = max(2 * self.max_radius, min_cell_size) or 1.0
+        self.cells = dict()
+        for i in range(state.nballs):
+            self.insert(i)
+
+    def __str__(self):
+        output = '<OverlapGrid instance>\n'
+        output += f'    nballs = {self.nballs}\n'
+        output += f'    cell_size = {self.cell_size}\n'
+        output += f'    ncells = {len(self.cells)}'
+        return output
+
+    def is_valid(self):
+        return self.version == self.state.version and self.nballs == self.state.nballs
+
+    def cell(self, position):
+        """Key of the cell containing position."""
+        x, y, z = position
+        return (math.floor(x / self.cell_size) +
+                math.floor(y / self.cell_size) * KEY_BASE +
+                math.floor(z / self.cell_size) * KEY_BASE ** 2)
+
+    def insert(self, i):
+        """Insert ball #i of the state."""
+        if self.state.radius[i] > self.max_radius:
+            self.max_radius = float(self.state.radius[i])
+        self.cells.setdefault(self.cell(self.state.position[i].tolist()), []).append(i)
+        self.nballs += 1
+
+    def can_check(self, radius):
+        """Check whether the cells are large enough for a ball of this radius."""
+        return radius + self.max_radius <= self.cell_size
+
+    def find_overlap(self, position, radius):
+        """Index of the first ball overlapping with a ball at position (None if no overlap)."""
+        key = self.cell(position)
+        cells = self.cells
+        candidates = []
+        for offset in NEIGHBOUR_OFFSETS:
+            cell = cells.get(key + offset)
+            if cell:
+                candidates.extend(cell)
+        if not candidates:
+            return None
+        candidates = np.array(candidates)
+        delta = self.state.position[candidates] - position
+        distance = np.sqrt(np.einsum('ij,ij->i', delta, delta))
+        overlap = candidates[distance < self.state.radius[candidates] + radius]
+        if len(overlap) == 0:
+            return None
+        return int(overlap.min())
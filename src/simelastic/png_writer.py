@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2025 Nicolás Cardiel
+#
+# This file is part of simelastic
+#
+# SPDX-License-Identifier: GPL-3.0+
+# License-Filename: LICENSE
+#
+
+import numpy as np
+import struct
+import zlib
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def png_chunk(chunk_type, data):
+    """PNG chunk with its length and CRC."""
+    chunk = chunk_type + data
+    return struct.pack('>I', len(data)) + chunk + struct.pack('>I', zlib.crc32(chunk) & 0xffffffff)
+
+
+def png_bytes(image, compression_level=6):
+    """Encode an RGB image (height, width, 3) of type uint8 as PNG."""
+    image = np.asarray(image, dtype=np.uint8)
+    if image.ndim != 3 or image.shape[2] != 3:
+        raise ValueError(f'Unexpected image shape: {image.shape}')
+    height, width = image.shape[:2]
+    # filter type 0 (None) at the beginning of each row
+    raw = np.zeros((height, 1 + 3 * width), dtype=np.uint8)
+    raw[:, 1:] = image.reshape(height, 3 * width)
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    return (PNG_SIGNATURE +
+            png_chunk(b'IHDR', header) +
+            png_chunk(b'IDAT', zlib.compress(raw.tobytes(), compression_level)) +
+            png_chunk(b'IEND', b''))
+
+
+def write_png(filename, image, compression_level=6):
+    """Save an RGB image (height, width, 3) of type uint8 as a PNG file."""
+    with open(filename, 'wb') as f:
+        f.write(png_bytes(image, compression_level=compression_level))
+
+
+def is_valid_png(filename, width=None, height=None):
+    """Check that a file is a complete PNG image.
+
+    The signature, the CRC of every chunk and the presence of the IEND
+    chunk are checked, so that truncated files (e.g., written by an
+    interrupted program) are detected. If width and height are given,
+    the size of the image is also checked.
+    """
+    try:
+        with open(filename, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return False
+    if data[:8] != PNG_SIGNATURE:
+        return False
+    pos = 8
+    header = None
+    while pos + 12 <= len(data):
+        length, = struct.unpack('>I', data[pos:pos + 4])
+        chunk = data[pos + 4:pos + 8 + length]
+        if len(chunk) != 4 + length or pos + 12 + length > len(data):
+            return False
+        crc, = struct.unpack('>I', data[pos + 8 + length:pos + 12 + length])
+        if zlib.crc32(chunk) & 0xffffffff != crc:
+            return False
+        if chunk[:4] == b'IHDR':
+            header = chunk[4:]
+        elif chunk[:4] == b'IEND':
+            if header is None or len(header) < 8:
+                return False
+            if width is not None and height is not None:
+                return struct.unpack('>II', header[:8]) == (width, height)
+            return True
+        pos += 12 + length
+    return False
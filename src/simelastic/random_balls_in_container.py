@@ -8,16 +8,74 @@
 # License-Filename: LICENSE
 #
 
-import math
 import numpy as np
 
-from .ball import Ball, BallCollection
+from .ball import BallCollection
+from .ball_state import BallState
 from .container3D import Container3D
+from .overlap_grid import OverlapGrid
 from .vector3D import Vector3D
 
 from .ball import DEFAULT_BALL_RADIUS
 
 
+def isotropic_velocities(rng, n, speed):
+    """Velocities (n, 3) with modulus speed and random isotropic directions."""
+    phi = rng.uniform(0, 2 * np.pi, n)
+    theta = np.arcsin(rng.uniform(-1, 1, n))
+    return speed * np.column_stack([np.cos(theta) * np.cos(phi), np.cos(theta) * np.sin(phi), np.sin(theta)])
+
+
+def ball_rgbcolors(rng, n, rgbcolor):
+    """Colors (n, 3) from rgbcolor (None, Vector3D or 'random')."""
+    if rgbcolor is None:
+        return np.tile([0.8, 0.8, 0.8], (n, 1))
+    elif isinstance(rgbcolor, Vector3D):
+        return np.tile([rgbcolor.x, rgbcolor.y, rgbcolor.z], (n, 1))
+    elif isinstance(rgbcolor, str):
+        if rgbcolor == 'random':
+            return rng.uniform(0, 1, (n, 3))
+        else:
+            raise ValueError(f'Unexpected rgbcolor: {rgbcolor}')
+    else:
+        raise ValueError(f'Unexpected rgbcolor: {rgbcolor}')
+
+
+def velocities_and_rgbcolors(rng, nballs, random_speed, rgbcolor):
+    """Velocities and colors (N, 3) of new balls.
+
+    The velocities have modulus random_speed and random isotropic
+    directions, and are drawn before the colors (see ball_rgbcolors).
+    """
+    if random_speed > 0:
+        velocity = isotropic_velocities(rng, nballs, random_speed)
+    else:
+        velocity = np.zeros((nballs, 3))
+    return velocity, ball_rgbcolors(rng, nballs, rgbcolor)
+
+
+def balls_at_positions(rng, container, position, radius, mass, random_speed, rgbcolor, rgbcolor_on_speed):
+    """BallCollection with balls at the given positions (N, 3).
+
+    The velocities and the colors are drawn as in
+    random_balls_in_empty_container (see velocities_and_rgbcolors).
+    """
+    nballs = len(position)
+    velocity, rgbcolor = velocities_and_rgbcolors(rng, nballs, random_speed, rgbcolor)
+    if isinstance(rgbcolor_on_speed, Vector3D):
+        rgbcolor_on_speed = np.tile([rgbcolor_on_speed.x, rgbcolor_on_speed.y, rgbcolor_on_speed.z], (nballs, 1))
+    state = BallState.from_arrays(
+        position=position,
+        velocity=velocity,
+        radius=radius,
+        mass=mass,
+        rgbcolor=rgbcolor,
+        rgbcolor_on_speed=rgbcolor_on_speed,
+        container=container
+    )
+    return BallCollection.from_state(state)
+
+
 def random_balls_in_empty_container(
         container=None,
         nballs=1,
@@ -29,6 +87,18 @@ def random_balls_in_empty_container(
         seed=1234,
         debug=False
 ):
+    """Insert balls at random positions within an empty container.
+
+    The velocities (and the colors, when rgbcolor is 'random') of all
+    the balls are drawn at once, and the candidate positions are drawn
+    in batches with container.sample_positions(). Each candidate is
+    accepted if it does not overlap with the balls already inserted,
+    which is checked with a spatial hash (see OverlapGrid). The balls
+    are stored directly in a BallState, without creating a Ball instance
+    for every trial. The random numbers are drawn from
+    np.random.default_rng(seed), so seed can also be a Generator shared
+    by several calls.
+    """
     if not isinstance(container, Container3D):
         raise ValueError(f'container: {container} is not a Container3D instance')
 
@@ -37,51 +107,37 @@ def random_balls_in_empty_container(
     if radius is None:
         radius = DEFAULT_BALL_RADIUS
 
-    balls = BallCollection()
+    velocity, rgbcolor = velocities_and_rgbcolors(rng, nballs, random_speed, rgbcolor)
+
+    state = BallState(capacity=nballs)
+    grid = OverlapGrid(state, min_cell_size=2 * radius)
     nb = 0
     ntrials = 0
-    vx, vy, vz = 0, 0, 0   # avoid PyCharm warning
     while nb < nballs:
-        if (ntrials == 0) and (random_speed > 0):
-            phi = rng.uniform(0, 2 * np.pi, 1)[0]
-            theta = math.asin(rng.uniform(-1, 1, 1)[0])
-            vx = random_speed * math.cos(theta) * math.cos(phi)
-            vy = random_speed * math.cos(theta) * math.sin(phi)
-            vz = random_speed * math.sin(theta)
-        position = container.new_xyz_for_ball(rng, ball_radius=radius)
-        velocity = Vector3D(vx, vy, vz)
-        if rgbcolor is None:
-            rgbcolor = Vector3D(0.8, 0.8, 0.8)
-        elif isinstance(rgbcolor, Vector3D):
-            pass
-        elif isinstance(rgbcolor, str):
-            if rgbcolor == 'random':
-                rgbcolor = Vector3D(rng.uniform(0, 1, 1)[0],
-                                    rng.uniform(0, 1, 1)[0],
-                                    rng.uniform(0, 1, 1)[0])
-            else:
-                raise ValueError(f'Unexpected rgbcolor: {rgbcolor}')
-        else:
-            raise ValueError(f'Unexpected rgbcolor: {rgbcolor}')
-        b = Ball(
-            position=position,
-            radius=radius,
-            mass=mass,
-            velocity=velocity,
-            rgbcolor=rgbcolor,
-            rgbcolor_on_speed=rgbcolor_on_speed,
-            container=container
-        )
-        ntrials += 1
-        if debug:
-            print(f'Inserting ball #{nb} (trial#{ntrials})')
-        if balls.add_single(b, warning=False):
-            nb += 1
-            ntrials = 0
-        if ntrials > 100 * nballs:
-            raise ValueError('Too many attempts to insert ball within container')
+        candidates = container.sample_positions(rng, max(nballs - nb, 256), ball_radius=radius)
+        for position in candidates.tolist():
+            ntrials += 1
+            if debug:
+                print(f'Inserting ball #{nb} (trial#{ntrials})')
+            if grid.find_overlap(position, radius) is None:
+                state.append(
+                    position=Vector3D(*position),
+                    velocity=Vector3D(*velocity[nb]),
+                    radius=radius,
+                    mass=mass,
+                    rgbcolor=Vector3D(*rgbcolor[nb]),
+                    rgbcolor_on_speed=rgbcolor_on_speed,
+                    container=container
+                )
+                grid.insert(nb)
+                nb += 1
+                ntrials = 0
+                if nb == nballs:
+                    break
+            elif ntrials > 100 * nballs:
+                raise ValueError('Too many attempts to insert ball within container')
 
     if not debug:
         print(f'{nballs} balls randomly inserted in empty container {container.type}')
 
-    return balls
+    return BallCollection.from_state(state)
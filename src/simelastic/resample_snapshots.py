@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2025 Nicolás Cardiel
+#
+# This file is part of simelastic
+#
+# SPDX-License-Identifier: GPL-3.0+
+# License-Filename: LICENSE
+#
+
+import numpy as np
+
+
+def step_hold_indices(tarray, tvalues):
+    """Index of the last value in tvalues that is less than or equal to each t.
+
+    If there are not values in tvalues that are less than or equal to t,
+    the index of the first value (i.e., 0) is returned.
+    """
+    indices = np.searchsorted(tvalues, tarray, side='right') - 1
+    return np.clip(indices, 0, len(tvalues) - 1)
+
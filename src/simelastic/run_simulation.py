@@ -13,15 +13,167 @@ import numpy as np
 import sys
 
 from .ball import BallCollection
+from .cell_list import CellList
+from .checkpoint import Checkpointer
+from .default_parameters import DEFAULT_TIME_TOLERANCE
+from .event_log import EventLog
+from .event_queue import EventQueue, EVENT_CELL, EVENT_WALL
+from .snapshot_sink import SnapshotSink
+from .time_to_collision import time_to_collision
+from .uniform_sampler import UniformSampler
+
+
+def predict_wall_events(balls, queue, indices, tnow, dict_wall_hits, nround=None,
+                        time_tolerance=DEFAULT_TIME_TOLERANCE):
+    """Insert in the queue the next collision of each ball with its container."""
+    state = balls.state
+    # balls sharing the same container are processed together
+    groups = dict()
+    for i in indices:
+        groups.setdefault(id(state.container[i]), []).append(i)
+    for group in groups.values():
+        group = np.array(group)
+        container = state.container[group[0]]
+        tmin, hit = container.collision_times_with_container(
+            state.position[group], state.velocity[group], state.radius[group],
+            nround=nround, time_tolerance=time_tolerance
+        )
+        for k in np.flatnonzero(np.isfinite(tmin)).tolist():
+            i = int(group[k])
+            dict_wall_hits[i] = hit[k]
+            queue.push_wall(tnow + tmin[k], i)
+
+
+def predict_ball_events(balls, queue, i, tnow, partners, nround=None):
+    """Insert in the queue the next collisions of ball i with partners."""
+    partners = np.asarray(partners, dtype=int)
+    if len(partners) == 0:
+        return
+    state = balls.state
+    tmin = time_to_collision(
+        state.position[i], state.velocity[i], state.radius[i],
+        state.positions_at(partners, tnow), state.velocity[partners], state.radius[partners],
+        nround=nround
+    )
+    finite = np.isfinite(tmin)
+    for t, j in zip(tmin[finite].tolist(), partners[finite].tolist()):
+        queue.push_ball(tnow + t, i, j)
+
+
+def predict_cell_event(balls, queue, cell_list, i, tnow, dict_cell_crossings):
+    """Insert in the queue the next cell crossing of ball i."""
+    if cell_list is None:
+        return
+    state = balls.state
+    tmin, axis, direction = cell_list.time_to_cell_crossing(
+        i, state.position[i].tolist(), state.velocity[i].tolist()
+    )
+    if not np.isinf(tmin):
+        dict_cell_crossings[i] = (axis, direction)
+        queue.push_cell(tnow + tmin, i)
+
+
+def collision_partners(cell_list, nballs, i):
+    """Balls that can collide with ball i before its next cell crossing."""
+    if cell_list is None:
+        return np.arange(nballs)
+    return np.array(cell_list.neighbours(i), dtype=int)
+
+
+def pending_events(queue, dict_wall_hits, dict_cell_crossings, cell_list, color_changes):
+    """Arrays describing the pending events, to be saved in a checkpoint.
+
+    Saving the predictions (instead of computing them again when the
+    simulation is resumed) guarantees that the resumed simulation is
+    identical to the uninterrupted one.
+    """
+    events = queue.valid_events()
+    wall_hit_ball = sorted(dict_wall_hits)
+    return {
+        'time': np.array([event[0] for event in events], dtype=float),
+        'index': np.array([event[1:] for event in events], dtype=int).reshape(-1, 3),
+        'wall_hit_ball': np.array(wall_hit_ball, dtype=int),
+        'wall_hit': np.array([dict_wall_hits[i] for i in wall_hit_ball], dtype=bool).reshape(-1, 3),
+        'cell_crossing': np.array([(i, axis, direction) for i, (axis, direction) in dict_cell_crossings.items()],
+                                  dtype=int).reshape(-1, 3),
+        'ball_cell': np.array([] if cell_list is None else cell_list.ball_cell, dtype=int).reshape(-1, 3),
+        'color_changes': np.array(color_changes, dtype=int)
+    }
+
+
+def restore_pending_events(events, queue, dict_wall_hits, dict_cell_crossings, cell_list):
+    """Restore the output of pending_events and return the color changes."""
+    for t, (event_type, i, j) in zip(events['time'].tolist(), events['index'].tolist()):
+        queue.push(t, event_type, i, j)
+    for i, hit in zip(events['wall_hit_ball'].tolist(), events['wall_hit']):
+        dict_wall_hits[i] = hit
+    for i, axis, direction in events['cell_crossing'].tolist():
+        dict_cell_crossings[i] = (axis, direction)
+    if cell_list is not None:
+        cell_list.set_ball_cell(events['ball_cell'])
+    return events['color_changes']
 
 
 def run_simulation(
-        dict_snapshots=None,
+        sink=None,
         balls=None,
         time_interval=None,
         time_resolution=2,
+        use_cell_list=True,
+        sample_interval=None,
+        checkpoint=None,
+        local_clocks=True,
+        nround=None,
+        time_tolerance=DEFAULT_TIME_TOLERANCE,
         debug=False
 ):
+    """Event-driven simulation of elastic collisions.
+
+    The predicted collisions (ball-ball and ball-container) are kept in
+    a priority queue. After each event only the predictions involving
+    the balls that have changed their velocity are recomputed, which
+    avoids the rescan of all the ball pairs at every step.
+
+    When use_cell_list is True (and all the containers are Cuboid3D
+    instances), the ball-ball collisions are only predicted between
+    balls in neighbouring cells of a uniform grid (see CellList). The
+    cell of each ball is updated through cell-crossing events, which
+    are not recorded.
+
+    When local_clocks is True, only the balls involved in each event
+    are moved to the time of the event (the other ones keep their
+    position at the time of their last event, see BallState.advance),
+    so that the cost per event does not depend on the number of balls.
+    All the balls are synchronized before being passed to the sinks
+    that read all of them (see SnapshotSink) and at the end of the
+    simulation (the checkpoints store the local clocks instead). When
+    local_clocks is False, all the balls are moved after every event,
+    as in previous versions (the results differ by rounding errors).
+
+    By default, the positions, velocities and predicted times are not
+    rounded: the walls hit within time_tolerance of each other are hit
+    simultaneously, and the overlaps caused by rounding errors are
+    corrected by colliding immediately the overlapping balls that
+    approach each other (and the balls beyond a wall that move
+    outwards). If nround is given, the positions, velocities and times
+    are rounded to nround decimals instead, which reproduces the
+    results of previous versions with nround=12 (and local_clocks=False).
+
+    The evolution of the balls is passed to sink, a SnapshotSink
+    instance (or a list of them), which is returned. By default, an
+    in-memory EventLog is used. Other sinks can stream the results to
+    disk (see TrajectoryWriter) or keep the full copies of the balls
+    after every event (see DictSnapshots). When the sink has already
+    been used in a previous call, the simulation continues from its
+    last recorded time. If sample_interval is given (and sink is None),
+    the default sink is a UniformSampler, which only stores the states
+    every sample_interval time units.
+
+    If checkpoint (a Checkpointer instance) is given, the state of the
+    simulation is saved periodically, so that an interrupted simulation
+    can be resumed. In that case the same Checkpointer must be passed to
+    all the calls that make up the simulation.
+    """
     if balls is None:
         balls = BallCollection()
 
@@ -29,75 +181,160 @@ def run_simulation(
         raise ValueError(f'balls: {balls} is not an instance of BallCollection')
     nballs = balls.nballs
 
-    if dict_snapshots is None:
-        dict_snapshots = dict()
-        # insert time = 0
-        dict_snapshots[0] = copy.deepcopy(balls)
-        tstart = 0
+    if sink is None:
+        if sample_interval is None:
+            sink = EventLog()
+        else:
+            sink = UniformSampler(sample_interval=sample_interval)
+    elif sample_interval is not None:
+        raise ValueError('sample_interval can only be used without sink (see UniformSampler)')
+    if isinstance(sink, (list, tuple)):
+        sinks = sink
     else:
-        if not isinstance(dict_snapshots, dict):
-            raise ValueError(f'dict_snapshots: {dict_snapshots} is not a Python dictionary')
-        tstart = max(dict_snapshots.keys())
+        sinks = [sink]
+    for s in sinks:
+        if not isinstance(s, SnapshotSink):
+            raise ValueError(f'sink: {s} is not a SnapshotSink instance')
+
+    tnow = None
+    resumed = None
+    if checkpoint is not None:
+        if not isinstance(checkpoint, Checkpointer):
+            raise ValueError(f'checkpoint: {checkpoint} is not a Checkpointer instance')
+        stage = checkpoint.next_stage()
+        saved = checkpoint.saved
+        if saved is not None and stage < saved.stage:
+            print(f'Skipping simulation stage {stage} (already computed)')
+            return sink
+        if saved is not None and stage == saved.stage:
+            saved.restore(balls, rng=checkpoint.rng)
+            # the restored balls keep their local clocks, so that the
+            # simulation continues exactly as the interrupted one
+            synchronized_balls = copy.deepcopy(balls)
+            synchronized_balls.state.synchronize(saved.time)
+            for s in sinks:
+                s.resume(saved.time, synchronized_balls)
+            if saved.completed:
+                return sink
+            resumed = saved
+            tstart = saved.tstart
+            time_interval = saved.time_interval
+            tnow = saved.time
+    if tnow is None:
+        if sinks[0].started:
+            tstart = sinks[0].tend
+        else:
+            tstart = 0
+        for s in sinks:
+            if not s.started:
+                # insert time = tstart
+                s.start(tstart, balls)
+            elif s.tend != tstart:
+                raise ValueError(f'sinks with different last recorded times: {s.tend}, {tstart}')
+        tnow = tstart
+
+    ttotal = tnow
 
-    ttotal = tstart
+    state = balls.state
+    if resumed is None:
+        # the balls are synchronized at this point
+        state.time[:] = tnow
+    synchronize_sinks = local_clocks and any(s.reads_all_balls for s in sinks)
 
-    print(f'Running simulation from time {tstart} to {tstart + time_interval}...')
+    # moving balls with rgbcolor_on_speed change their color the first
+    # time they are moved; they are included in the first recorded event
+    color_changes = np.flatnonzero(
+        state.has_rgbcolor_on_speed &
+        np.any(state.velocity != 0, axis=1) &
+        np.any(state.rgbcolor != state.rgbcolor_on_speed, axis=1)
+    )
+
+    # broad phase
+    cell_list = None
+    if use_cell_list and nballs > 1:
+        cell_list = CellList.from_containers(state.container, state.radius, state.position)
+        if cell_list is not None and cell_list.total_cells == 1:
+            cell_list = None
+        if debug:
+            print(cell_list)
+
+    # initial predictions
+    queue = EventQueue(nballs)
+    dict_wall_hits = dict()
+    dict_cell_crossings = dict()
+    if resumed is not None and resumed.events is not None:
+        color_changes = restore_pending_events(resumed.events, queue, dict_wall_hits, dict_cell_crossings,
+                                               cell_list)
+    else:
+        predict_wall_events(balls, queue, range(nballs), tnow, dict_wall_hits, nround, time_tolerance)
+        for i in range(nballs):
+            predict_cell_event(balls, queue, cell_list, i, tnow, dict_cell_crossings)
+            partners = collision_partners(cell_list, nballs, i)
+            predict_ball_events(balls, queue, i, tnow, partners[partners > i], nround)
+
+    print(f'Running simulation from time {tnow} to {tstart + time_interval}...')
     # main loop
     while ttotal <= tstart + time_interval:
         if nballs > 0:
-            # collision with container: minimum time to next collision
-            # of any ball with the container walls; several balls can hit
-            # the walls at the same minimum time
-            tmp_container_tmin = []
-            tmp_container_balls = []
-            for i in range(nballs):
-                b = balls.dict[i]
-                tmin, b_after_collision_with_container = b.collision_with_container()
-                tmp_container_tmin.append(tmin)
-                tmp_container_balls.append(b_after_collision_with_container)
-            tmp_container_tmin = np.array(tmp_container_tmin)
-            tmin_container = min(tmp_container_tmin)
-
-            # next collision with another ball
-            tmp_dict_t_ij = dict()
-            if nballs > 1:
-                for i in range(nballs):
-                    b1 = balls.dict[i]
-                    for j in range(i + 1, nballs):
-                        b2 = balls.dict[j]
-                        tmin = b1.time_to_collision_with_ball(b2)
-                        tmp_dict_t_ij[tmin] = (i, j)
-            tmp_t_keys = np.array([tdum for tdum in tmp_dict_t_ij.keys()])
-            tmin_ball_ball = min(tmp_t_keys)
-
-            # next event: collision with container or with another ball?
-            if np.isinf(tmin_container) and np.isinf(tmin_ball_ball):
+            # next valid event; several events can happen at the same time
+            # (e.g. several balls hitting the walls simultaneously), and
+            # they are processed one after another
+            event = queue.pop()
+            if event is None:
                 break
-
-            if tmin_container <= tmin_ball_ball:
-                tmin = tmin_container
-                affected_balls = np.argwhere(np.array(tmp_container_tmin) <= tmin).flatten()
-                for i in balls.dict:
-                    if i in affected_balls:
-                        balls.dict[i] = tmp_container_balls[i]
-                    else:
-                        balls.dict[i].update_position(tmin)
+            tevent, event_type, ii, jj = event
+            # update location of the balls involved in the event (or all)
+            if local_clocks:
+                state.advance([ii] if jj < 0 else [ii, jj], tevent, nround=nround)
+            else:
+                state.synchronize(tevent, nround=nround)
+            tnow = tevent
+            if event_type == EVENT_CELL:
+                axis, direction = dict_cell_crossings.pop(ii)
+                cell_list.move(ii, axis, direction)
+                affected_balls = [ii]
+            elif event_type == EVENT_WALL:
+                # reverse velocity of the ball hitting the walls
+                hit = dict_wall_hits.pop(ii)
+                state.velocity[ii, hit] = -state.velocity[ii, hit]
+                affected_balls = [ii]
             else:
-                tmin = tmin_ball_ball
-                # update location of all balls
-                for i in balls.dict:
-                    balls.dict[i].update_position(tmin)
                 # update colliding balls
-                ii, jj = tmp_dict_t_ij[tmin]
                 b1 = balls.dict[ii]
                 b2 = balls.dict[jj]
-                b1.update_collision_with(b2)
+                b1.update_collision_with(b2, nround=nround)
+                affected_balls = [ii, jj]
+            # new predictions for the affected balls
+            for i in affected_balls:
+                queue.invalidate(i)
+            predict_wall_events(balls, queue, affected_balls, tnow, dict_wall_hits, nround, time_tolerance)
+            for i in affected_balls:
+                predict_cell_event(balls, queue, cell_list, i, tnow, dict_cell_crossings)
+                partners = collision_partners(cell_list, nballs, i)
+                partners = partners[~np.isin(partners, affected_balls)]
+                predict_ball_events(balls, queue, i, tnow, partners, nround)
+            if event_type == EVENT_CELL:
+                # the velocities have not changed
+                continue
+            ttotal = tevent
+            if len(color_changes) > 0:
+                state.advance(color_changes, tnow, nround=nround)
+                affected_balls = np.union1d(affected_balls, color_changes)
+                color_changes = []
         else:
-            tmin = 1
+            ttotal += 1
+            affected_balls = []
 
-        ttotal += tmin
+        if synchronize_sinks:
+            state.synchronize(tnow, nround=nround)
+        for s in sinks:
+            s.record(ttotal, affected_balls, balls)
+        # the checkpoints are not saved between simultaneous events, so
+        # that the sinks can flush everything recorded so far
+        if checkpoint is not None and checkpoint.due() and queue.next_time() > ttotal:
+            events = pending_events(queue, dict_wall_hits, dict_cell_crossings, cell_list, color_changes)
+            checkpoint.save(balls, sinks, ttotal, tstart, time_interval, events=events)
         ftime = round(ttotal, time_resolution)
-        dict_snapshots[ftime] = copy.deepcopy(balls)
         if not debug:
             sys.stdout.write(f'\rtime: {ftime}')
             sys.stdout.flush()
@@ -105,4 +342,8 @@ def run_simulation(
     if not debug:
         print(' ')
 
-    return dict_snapshots
+    state.synchronize(tnow, nround=nround)
+    if checkpoint is not None:
+        checkpoint.save(balls, sinks, ttotal, tstart, time_interval, completed=True)
+
+    return sink
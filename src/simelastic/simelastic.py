@@ -14,10 +14,14 @@ import pickle
 import sys
 
 from .ball import Ball, BallCollection
+from .checkpoint import Checkpointer
 from .container3D import Cuboid3D
+from .event_log import EventLog
 from .random_balls_in_container import random_balls_in_empty_container
 from .run_simulation import run_simulation
 from .time_rendering import time_rendering
+from .trajectory import Trajectory, TrajectoryWriter
+from .uniform_sampler import UniformSampler
 from .vector3D import Vector3D
 from .version import version
 
@@ -25,20 +29,51 @@ from .version import version
 def main():
     """Generate simulation of elastic collisions in 3D space.
 
-    If nexample is 0, a pickle file (previously generated by this program
-    is loaded to generate the HTML/mp4 output file.
+    If nexample is 0, a trajectory directory or a pickle file (previously
+    generated by this program) is loaded to generate the HTML/mp4 output
+    file.
 
     If nexample is different from 0, a simulation is generated
-    (and saved as a pickle file if requested). 
+    (and saved as a trajectory directory and/or a pickle file). 
     
     """
     parser = argparse.ArgumentParser(description=f"Simulation of elastic collisions (version {version})")
     parser.add_argument("-n", "--nexample", help="Example number", type=int, default=0)
     parser.add_argument("-p", "--pickle", help="Input/Output pickle file name", type=str, default="None")
+    parser.add_argument("-t", "--trajectory", help="Input/Output trajectory directory", type=str, default="None")
     parser.add_argument("-o", "--output", help="Output HTML/MP4 file name", type=str, default="None")
+    parser.add_argument("--html_mode", help="HTML output mode (default 'frames')", type=str,
+                        choices=['frames', 'base64', 'bin'], default='frames')
+    parser.add_argument("--instanced", help="Render the balls with a single InstancedMesh", action="store_true")
     parser.add_argument("--width", help="Width of the PNG frames (default 1600)", type=int, default=1600)
     parser.add_argument("--height", help="Height of the PNG frames (default 900)", type=int, default=900)
     parser.add_argument("--workdir", help="Working directory (default 'dummydir')", type=str, default='dummydir')
+    parser.add_argument("--jobs", help="Number of frames rendered in parallel (default 1)", type=int, default=1)
+    parser.add_argument("--renderer", help="MP4 frame renderer: headless browser or NumPy (default 'browser')",
+                        type=str, choices=['browser', 'numpy'], default='browser')
+    parser.add_argument("--overwrite", help="Delete the content of the working directory if it exists",
+                        action="store_true")
+    parser.add_argument("--resume_frames", help="Keep the valid frames of the working directory rendered with the same "
+                        "parameters (by a previous execution also using --resume_frames) and render the rest",
+                        action="store_true")
+    parser.add_argument("--cache_dir", help="Directory with a cache of rendered frames (default None)", type=str,
+                        default=None)
+    parser.add_argument("--stream", help="Pipe the frames to ffmpeg without saving them as PNG files",
+                        action="store_true")
+    parser.add_argument("--framerate", help="Input frame rate for ffmpeg (default 1)", type=float, default=1)
+    parser.add_argument("--crf", help="Constant rate factor for ffmpeg (default 0)", type=int, default=0)
+    parser.add_argument("--preset", help="Encoding preset for ffmpeg (default 'veryslow')", type=str,
+                        default='veryslow')
+    parser.add_argument("--sample_interval", help="Save the trajectory directory only every sample_interval time "
+                        "units (default None: after every event)", type=float, default=None)
+    parser.add_argument("--checkpoint", help="Checkpoint file (.npz) of the simulation (default None)", type=str,
+                        default=None)
+    parser.add_argument("--checkpoint_interval", help="Seconds between checkpoints (default 600)", type=float,
+                        default=600)
+    parser.add_argument("--resume", help="Continue the simulation from the checkpoint file", action="store_true")
+    parser.add_argument("--seed", help="Seed of the random initial conditions (default 1234)", type=int, default=1234)
+    parser.add_argument("--nround", help="Round positions, velocities and event times to nround decimals, as in "
+                        "previous versions with 12 (default None: use a time tolerance)", type=int, default=None)
     parser.add_argument("--tmin", help="Minimum time (default None)", type=float, default=None)
     parser.add_argument("--tmax", help="Maximum time (default None)", type=float, default=None)
     parser.add_argument("--tstep", help="Time step for rendering (default 1.0)", type=float, default=1.0)
@@ -54,47 +89,116 @@ def main():
     nexample = args.nexample
 
     if nexample == 0:
-        if args.pickle.lower() == 'none':
-            print('ERROR: no input pickle file name provided')
+        if args.pickle.lower() == 'none' and args.trajectory.lower() == 'none':
+            print('ERROR: no input trajectory directory nor pickle file name provided')
             raise SystemExit()
         if args.output.lower() == 'none':
             print('ERROR: no output HTML or MP4 file name provided')
             raise SystemExit()
-        with open(args.pickle, 'rb') as f:
-            pickle_object = pickle.load(f)
-        print(f'Number of snapshots: {len(pickle_object['dict_snapshots'])}')
+        if args.trajectory.lower() != 'none':
+            event_log = None
+            trajectory = Trajectory(args.trajectory)
+            container = trajectory.container
+            print(f'Number of frames: {trajectory.nframes}')
+            tstart, tend = trajectory.tstart, trajectory.tend
+        else:
+            trajectory = None
+            with open(args.pickle, 'rb') as f:
+                pickle_object = pickle.load(f)
+            if 'event_log' not in pickle_object:
+                if 'dict_snapshots' in pickle_object:
+                    # the snapshots of previous versions do not contain
+                    # the events needed to compute the frames
+                    print(f'ERROR: {args.pickle} was created by a previous version of this program, '
+                          f'run the simulation again to create a new pickle file')
+                else:
+                    print(f'ERROR: {args.pickle} does not contain a simulation event log')
+                raise SystemExit()
+            event_log = pickle_object['event_log']
+            container = pickle_object['container']
+            print(f'Number of events: {event_log.nevents}')
+            tstart, tend = event_log.tstart, event_log.tend
         if args.tmin is None:
-            tmin = min(pickle_object['dict_snapshots'].keys())
+            tmin = tstart
         else:
             tmin = args.tmin
         if args.tmax is None:
-            tmax = max(pickle_object['dict_snapshots'].keys())
+            tmax = tend
         else:
             tmax = args.tmax
         tstep = args.tstep
         tarray = np.arange(tmin, tmax + tstep/2, tstep)
         time_rendering(
-            dict_snapshots=pickle_object['dict_snapshots'],
-            container=pickle_object['container'],
+            event_log=event_log,
+            trajectory=trajectory,
+            container=container,
             tarray=tarray,
             ndelay_start=args.ndelay_start,
             fontsize=args.fontsize,
             outfilename=args.output,
+            html_mode=args.html_mode,
+            instanced=args.instanced,
             workdir=args.workdir,
             width=args.width,
             height=args.height,
+            jobs=args.jobs,
+            renderer=args.renderer,
+            cache_dir=args.cache_dir,
+            overwrite=args.overwrite,
+            resume_frames=args.resume_frames,
+            stream=args.stream,
+            framerate=args.framerate,
+            crf=args.crf,
+            preset=args.preset,
             debug=args.debug
         )
         raise SystemExit('End of program')
     else:
-        if args.pickle.lower() == 'none':
-            msg = 'ERROR: no output pickle file name provided'
+        if args.pickle.lower() == 'none' and args.trajectory.lower() == 'none':
+            msg = 'ERROR: no output trajectory directory nor pickle file name provided'
             raise SystemExit(msg)
         if args.output.lower() != 'none':
             msg = 'ERROR: output HTML file name provided but nexample is not 0'
             raise SystemExit(msg)
 
-    dict_snapshots = None
+    # the simulation results are passed to the sinks: an in-memory event
+    # log to be pickled, and/or a trajectory written to disk as the
+    # simulation runs
+    sinks = []
+    event_log = None
+    if args.pickle.lower() != 'none':
+        event_log = EventLog()
+        sinks.append(event_log)
+    trajectory_writer = None
+    if args.trajectory.lower() != 'none':
+        trajectory_writer = TrajectoryWriter(dirname=args.trajectory)
+        if args.sample_interval is None:
+            sinks.append(trajectory_writer)
+        else:
+            sinks.append(UniformSampler(sample_interval=args.sample_interval, sink=trajectory_writer))
+    elif args.sample_interval is not None:
+        raise SystemExit('ERROR: sample_interval requires an output trajectory directory')
+
+    # single random number generator for all the initial conditions,
+    # whose state is saved in the checkpoints
+    rng = np.random.default_rng(args.seed)
+
+    # periodic checkpoints, to continue the simulation if it is interrupted
+    checkpointer = None
+    if args.checkpoint is not None:
+        if args.resume and event_log is not None:
+            msg = 'ERROR: the pickle file is only saved at the end of the simulation and cannot be resumed'
+            raise SystemExit(msg)
+        checkpointer = Checkpointer(
+            filename=args.checkpoint,
+            interval=args.checkpoint_interval,
+            resume=args.resume,
+            rng=rng
+        )
+    elif args.resume:
+        raise SystemExit('ERROR: no checkpoint file provided')
+
+    box = None
     if nexample == 1:
         box = Cuboid3D()
         b1 = Ball(
@@ -111,10 +215,12 @@ def main():
         )
         balls = BallCollection()
         balls.add_list([b1, b2])
-        dict_snapshots = run_simulation(
-            dict_snapshots=None,
+        run_simulation(
+            sink=sinks,
             balls=balls,
             time_interval=1000,
+            checkpoint=checkpointer,
+            nround=args.nround,
             debug=args.debug
         )
 
@@ -125,13 +231,16 @@ def main():
             nballs=100,
             random_speed=0.1,
             rgbcolor='random',
+            seed=rng,
             debug=args.debug
         )
         balls.dict[0].rgbcolor = Vector3D(1.0, 0.0, 0.0)
-        dict_snapshots = run_simulation(
-            dict_snapshots=None,
+        run_simulation(
+            sink=sinks,
             balls=balls,
             time_interval=1000,
+            checkpoint=checkpointer,
+            nround=args.nround,
             debug=args.debug
         )
 
@@ -146,6 +255,7 @@ def main():
             nballs=50,
             random_speed=0.02,
             rgbcolor=Vector3D(1.0, 0.0, 0.0),
+            seed=rng,
             debug=args.debug
         )
         balls2 = random_balls_in_empty_container(
@@ -153,22 +263,27 @@ def main():
             nballs=20,
             random_speed=0.1,
             rgbcolor=Vector3D(0.0, 0.0, 1.0),
+            seed=rng,
             debug=args.debug
         )
         balls = balls1 + balls2
-        dict_snapshots = run_simulation(
-            dict_snapshots=None,
+        run_simulation(
+            sink=sinks,
             balls=balls,
             time_interval=1000,
+            checkpoint=checkpointer,
+            nround=args.nround,
             debug=args.debug
         )
         for idball in balls.dict:
             b = balls.dict[idball]
             b.container = box
-        dict_snapshots = run_simulation(
-            dict_snapshots=dict_snapshots,
+        run_simulation(
+            sink=sinks,
             balls=balls,
             time_interval=1000,
+            checkpoint=checkpointer,
+            nround=args.nround,
             debug=args.debug
         )
 
@@ -185,6 +300,7 @@ def main():
             radius=0.4,
             random_speed=0.00,
             rgbcolor=Vector3D(0.0, 0.0, 1.0),
+            seed=rng,
             debug=args.debug
         )
         balls2 = random_balls_in_empty_container(
@@ -193,6 +309,7 @@ def main():
             radius=0.4,
             random_speed=0.10,
             rgbcolor=Vector3D(1.0, 0.0, 0.0),
+            seed=rng,
             debug=args.debug
         )
         balls3 = random_balls_in_empty_container(
@@ -201,22 +318,27 @@ def main():
             radius=0.4,
             random_speed=0.00,
             rgbcolor=Vector3D(0.0, 0.0, 1.0),
+            seed=rng,
             debug=args.debug
         )
         balls = balls1 + balls2 + balls3
-        dict_snapshots = run_simulation(
-            dict_snapshots=None,
+        run_simulation(
+            sink=sinks,
             balls=balls,
             time_interval=1000,
+            checkpoint=checkpointer,
+            nround=args.nround,
             debug=args.debug
         )
         for idball in balls.dict:
             b = balls.dict[idball]
             b.container = box
-        dict_snapshots = run_simulation(
-            dict_snapshots=dict_snapshots,
+        run_simulation(
+            sink=sinks,
             balls=balls,
             time_interval=1000,
+            checkpoint=checkpointer,
+            nround=args.nround,
             debug=args.debug
         )
 
@@ -235,6 +357,7 @@ def main():
             random_speed=0.00,
             rgbcolor=Vector3D(0.0, 0.0, 1.0),
             rgbcolor_on_speed=Vector3D(0.0, 1.0, 0.0),
+            seed=rng,
             debug=args.debug
         )
         balls2 = random_balls_in_empty_container(
@@ -243,6 +366,7 @@ def main():
             radius=radius,
             random_speed=0.10,
             rgbcolor=Vector3D(1.0, 0.0, 0.0),
+            seed=rng,
             debug=args.debug
         )
         balls3 = random_balls_in_empty_container(
@@ -252,35 +376,45 @@ def main():
             random_speed=0.00,
             rgbcolor=Vector3D(0.0, 0.0, 1.0),
             rgbcolor_on_speed=Vector3D(0.0, 1.0, 0.0),
+            seed=rng,
             debug=args.debug
         )
         balls = balls1 + balls2 + balls3
-        dict_snapshots = run_simulation(
-            dict_snapshots=None,
+        run_simulation(
+            sink=sinks,
             balls=balls,
             time_interval=100,
+            checkpoint=checkpointer,
+            nround=args.nround,
             debug=args.debug
         )
         for idball in balls.dict:
             b = balls.dict[idball]
             b.container = box
-        dict_snapshots = run_simulation(
-            dict_snapshots=dict_snapshots,
+        run_simulation(
+            sink=sinks,
             balls=balls,
             time_interval=600,
+            checkpoint=checkpointer,
+            nround=args.nround,
             debug=args.debug
         )
 
     else:
         print('ERROR: undefined example number')
 
-    if dict_snapshots is not None:
-        print(f'Number of snapshots: {len(dict_snapshots)}')
-        if args.pickle.lower() != 'none':
-            pickle_object = {'dict_snapshots': dict_snapshots, 'container': box}
+    if box is not None:
+        if event_log is not None:
+            print(f'Number of events: {event_log.nevents}')
+            pickle_object = {'event_log': event_log, 'container': box}
             with open(args.pickle, 'wb') as f:
                 pickle.dump(pickle_object, f)
             print(f'Pickle file {args.pickle} saved')
+        if trajectory_writer is not None:
+            trajectory_writer.container = box
+            trajectory_writer.close()
+            print(f'Number of frames: {trajectory_writer.nframes}')
+            print(f'Trajectory directory {args.trajectory} saved')
 
     print('End of program')
 
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2025 Nicolás Cardiel
+#
+# This file is part of simelastic
+#
+# SPDX-License-Identifier: GPL-3.0+
+# License-Filename: LICENSE
+#
+
+from abc import ABC, abstractmethod
+import copy
+
+
+class SnapshotSink(ABC):
+    """Destination of the states computed by run_simulation.
+
+    run_simulation calls .start() once with the initial balls (unless
+    the sink has already been started in a previous simulation, which
+    is then continued from self.tend), and .record() after every event
+    with the indices of the balls whose velocity or color has changed.
+    The sink can store the information in memory or stream it to disk;
+    in the latter case .flush() must write to disk everything recorded
+    so far (run_simulation only calls it when the next event happens
+    later than the last recorded one).
+
+    During the simulation only the balls involved in each event are
+    moved to the time of the event (see BallState.advance). Sinks that
+    read the state of all the balls in .record() must keep
+    reads_all_balls = True, so that run_simulation synchronizes the
+    balls before calling it; sinks that only read the balls ids can
+    set it to False.
+    """
+    reads_all_balls = True
+
+    def __init__(self):
+        self.tstart = None
+        self.tend = None
+
+    @property
+    def started(self):
+        return self.tend is not None
+
+    @abstractmethod
+    def start(self, time, balls):
+        raise NotImplementedError("no .start method")
+
+    @abstractmethod
+    def record(self, time, ids, balls):
+        raise NotImplementedError("no .record method")
+
+    def resume(self, time, balls):
+        """Discard what was recorded at times >= time and continue from balls.
+
+        This is used to continue an interrupted simulation from a
+        checkpoint (see Checkpointer).
+        """
+        raise NotImplementedError(f'{type(self).__name__} cannot be resumed')
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class DictSnapshots(SnapshotSink):
+    """In-memory sink storing a deep copy of the balls after every event.
+
+    The copies are stored in self.dict_snapshots, with the time (rounded
+    to time_resolution decimals) as key. Since the memory grows with the
+    number of events times the number of balls, it is only convenient
+    for small simulations.
+    """
+
+    def __init__(self, time_resolution=2):
+        super().__init__()
+        self.time_resolution = time_resolution
+        self.dict_snapshots = dict()
+
+    def __str__(self):
+        output = '<DictSnapshots instance>\n'
+        output += f'    nsnapshots = {len(self.dict_snapshots)}'
+        return output
+
+    def start(self, time, balls):
+        self.tstart = time
+        self.record(time, None, balls)
+
+    def record(self, time, ids, balls):
+        self.dict_snapshots[round(time, self.time_resolution)] = copy.deepcopy(balls)
+        self.tend = time
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2025 Nicolás Cardiel
+#
+# This file is part of simelastic
+#
+# SPDX-License-Identifier: GPL-3.0+
+# License-Filename: LICENSE
+#
+
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from .container3D import Cuboid3D
+from .png_writer import png_bytes
+
+# scene parameters, the same as in the HTML files
+# (see write_html_camera and write_html_container)
+CAMERA_FOV = 45
+CAMERA_NEAR = 0.1
+LIGHT_POSITION_CAMERA = np.array([-5.0, 5.0, 0.0])
+LIGHT_INTENSITY = 0.8
+AMBIENT_INTENSITY = 0x55 / 255
+SPECULAR_COLOR = 0x11 / 255
+SHININESS = 30
+
+
+def camera_basis(camera):
+    """Position and orthonormal axes of the camera.
+
+    The camera parameters (phi, theta, r, lookat_x, lookat_y, lookat_z)
+    are interpreted as in write_html_camera: the camera is placed at
+    spherical coordinates (r, phi, theta), with angles in degrees and
+    the z axis pointing up, and it looks at (lookat_x, lookat_y,
+    lookat_z). Returns (eye, right, up, forward).
+    """
+    camera_phi, camera_theta, camera_r, camera_lookat_x, camera_lookat_y, camera_lookat_z = camera
+    phi = np.radians(camera_phi)
+    theta = np.radians(camera_theta)
+    eye = camera_r * np.array([np.cos(phi) * np.cos(theta), np.sin(phi) * np.cos(theta), np.sin(theta)])
+    forward = np.array([camera_lookat_x, camera_lookat_y, camera_lookat_z], dtype=float) - eye
+    forward /= np.linalg.norm(forward)
+    right = np.cross(forward, [0.0, 0.0, 1.0])
+    if np.linalg.norm(right) < 1e-12:
+        # looking along the z axis
+        right = np.array([1.0, 0.0, 0.0])
+    right /= np.linalg.norm(right)
+    up = np.cross(right, forward)
+    return eye, right, up, forward
+
+
+class SoftwareRenderer:
+    """Render the balls and the container into NumPy image buffers.
+
+    This is an offline alternative to rendering the HTML scene with a
+    headless browser. It uses the same camera model as the HTML files
+    (perspective projection with a vertical field of view of 45 degrees
+    and the z axis pointing up), and approximately the same lighting
+    (ambient light and a directional light attached to the camera,
+    with Blinn-Phong shading). The spheres are drawn from back to front
+    with antialiased edges, and the edges of the container are drawn
+    with a depth test. No text is displayed.
+
+    Parameters
+    ----------
+    container : Cuboid3D
+        Container drawn as a white wireframe.
+    radius : array_like
+        Radius of each ball (N,).
+    width, height : int
+        Size of the images.
+    """
+    def __init__(self, container=None, radius=None, width=1600, height=900):
+        if not isinstance(container, Cuboid3D):
+            raise ValueError(f'container: {type(container)} not implemented')
+        self.container = container
+        self.radius = np.asarray(radius, dtype=float)
+        self.width = width
+        self.height = height
+        self.focal = (height / 2) / np.tan(np.radians(CAMERA_FOV / 2))
+
+    def __str__(self):
+        output = '<SoftwareRenderer instance>\n'
+        output += f'    nballs = {len(self.radius)}\n'
+        output += f'    width = {self.width}\n'
+        output += f'    height = {self.height}'
+        return output
+
+    def box_edges(self):
+        """Pairs of corners (12, 2, 3) of the edges of the container."""
+        c = self.container
+        corners = np.array([[x, y, z] for x in [c.xmin, c.xmax] for y in [c.ymin, c.ymax] for z in [c.zmin, c.zmax]])
+        edges = [(i, j) for i in range(8) for j in range(i + 1, 8) if bin(i ^ j).count('1') == 1]
+        return np.array([[corners[i], corners[j]] for i, j in edges])
+
+    def render(self, position, rgbcolor, camera):
+        """Render a frame as an array (height, width, 3) of type uint8.
+
+        Parameters
+        ----------
+        position : array_like
+            Position of the balls (N, 3).
+        rgbcolor : array_like
+            Color of the balls (N, 3), in the range [0, 1].
+        camera : tuple
+            Camera parameters (phi, theta, r, lookat_x, lookat_y, lookat_z).
+        """
+        eye, right, up, forward = camera_basis(camera)
+        image = np.zeros((self.height, self.width, 3))
+        zbuffer = np.full((self.height, self.width), np.inf)
+
+        # light direction and half vector in camera coordinates
+        # (x: right, y: up, z: towards the viewer)
+        light = eye + LIGHT_POSITION_CAMERA[0] * right + LIGHT_POSITION_CAMERA[1] * up
+        light /= np.linalg.norm(light)
+        light = np.array([light @ right, light @ up, -(light @ forward)])
+        half = light + [0.0, 0.0, 1.0]
+        half /= np.linalg.norm(half)
+
+        # spheres, from back to front
+        d = np.asarray(position, dtype=float) - eye
+        xc, yc, zc = d @ right, d @ up, d @ forward
+        rgbcolor = np.clip(np.asarray(rgbcolor, dtype=float), 0, 1)
+        for i in np.argsort(-zc):
+            if zc[i] - self.radius[i] < CAMERA_NEAR:
+                continue
+            u = self.width / 2 + self.focal * xc[i] / zc[i]
+            v = self.height / 2 - self.focal * yc[i] / zc[i]
+            rp = self.focal * self.radius[i] / zc[i]
+            i1, i2 = max(int(np.floor(v - rp - 1)), 0), min(int(np.ceil(v + rp + 1)), self.height)
+            j1, j2 = max(int(np.floor(u - rp - 1)), 0), min(int(np.ceil(u + rp + 1)), self.width)
+            if i1 >= i2 or j1 >= j2:
+                continue
+            dx = (np.arange(j1, j2) + 0.5 - u)[np.newaxis, :] / rp
+            dy = (v - np.arange(i1, i2) - 0.5)[:, np.newaxis] / rp
+            rr = dx**2 + dy**2
+            # fraction of each pixel covered by the sphere
+            coverage = np.clip((1 - np.sqrt(rr)) * rp + 0.5, 0, 1)
+            if not np.any(coverage > 0):
+                continue
+            nz = np.sqrt(np.clip(1 - rr, 0, 1))
+            ndotl = np.clip(dx * light[0] + dy * light[1] + nz * light[2], 0, None)
+            ndoth = np.clip(dx * half[0] + dy * half[1] + nz * half[2], 0, None)
+            # Blinn-Phong, as in the MeshPhongMaterial of three.js
+            diffuse = AMBIENT_INTENSITY + LIGHT_INTENSITY * ndotl
+            specular = LIGHT_INTENSITY * SPECULAR_COLOR * 4 * ndotl * ndoth**SHININESS
+            color = rgbcolor[i] * diffuse[:, :, np.newaxis] + specular[:, :, np.newaxis]
+            alpha = coverage[:, :, np.newaxis]
+            window = image[i1:i2, j1:j2]
+            window[:] = window * (1 - alpha) + np.clip(color, 0, 1) * alpha
+            depth = zc[i] - self.radius[i] * nz
+            zwindow = zbuffer[i1:i2, j1:j2]
+            visible = coverage > 0.5
+            zwindow[visible] = depth[visible]
+
+        # edges of the container
+        for p0, p1 in self.box_edges():
+            d0, d1 = p0 - eye, p1 - eye
+            z0, z1 = d0 @ forward, d1 @ forward
+            if z0 < CAMERA_NEAR and z1 < CAMERA_NEAR:
+                continue
+            # clip the edge in front of the camera
+            s0, s1 = 0.0, 1.0
+            if z0 < CAMERA_NEAR:
+                s0 = (CAMERA_NEAR - z0) / (z1 - z0)
+            elif z1 < CAMERA_NEAR:
+                s1 = (CAMERA_NEAR - z0) / (z1 - z0)
+            q0, q1 = d0 + s0 * (d1 - d0), d0 + s1 * (d1 - d0)
+            uv = [(self.focal * (q @ right) / (q @ forward), self.focal * (q @ up) / (q @ forward)) for q in [q0, q1]]
+            nsamples = int(np.ceil(2 * np.hypot(uv[1][0] - uv[0][0], uv[1][1] - uv[0][1]))) + 2
+            nsamples = min(nsamples, 4 * (self.width + self.height))
+            s = np.linspace(0, 1, nsamples)[:, np.newaxis]
+            q = q0 + s * (q1 - q0)
+            zq = q @ forward
+            u = (self.width / 2 + self.focal * (q @ right) / zq).astype(int)
+            v = (self.height / 2 - self.focal * (q @ up) / zq).astype(int)
+            inside = (u >= 0) & (u < self.width) & (v >= 0) & (v < self.height)
+            u, v, zq = u[inside], v[inside], zq[inside]
+            visible = zq <= zbuffer[v, u]
+            image[v[visible], u[visible]] = 1.0
+
+        return np.round(image * 255).astype(np.uint8)
+
+    def render_bytes(self, position, rgbcolor, camera, output='png'):
+        """Render a frame as PNG (output='png') or raw RGB24 (output='raw') bytes."""
+        image = self.render(position, rgbcolor, camera)
+        if output == 'png':
+            return png_bytes(image)
+        elif output == 'raw':
+            return image.tobytes()
+        else:
+            raise ValueError(f'output: {output} is not png or raw')
+
+
+def render_software_frame(args):
+    """Render a frame with SoftwareRenderer.render_bytes(*args[1:])."""
+    renderer = args[0]
+    return renderer.render_bytes(*args[1:])
+
+
+def iter_software_frames(renderer=None, fposition=None, frgbcolor=None, cameras=None, frames=None, jobs=1,
+                         output='png'):
+    """Render the frames with a SoftwareRenderer and yield them in order.
+
+    Yields (k, bytes) for each frame index k in frames (by default, all
+    the frames), using jobs processes.
+    """
+    if frames is None:
+        frames = range(len(fposition))
+    frames = list(frames)
+    args = ((renderer, fposition[k], frgbcolor[k], cameras[k], output) for k in frames)
+    if jobs <= 1:
+        for k, arg in zip(frames, args):
+            yield k, render_software_frame(arg)
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            for k, data in zip(frames, executor.map(render_software_frame, args, chunksize=4)):
+                yield k, data
@@ -9,56 +9,68 @@
 #
 
 from astropy.io import fits
-import copy
+import json
 import numpy as np
-import os
 from pathlib import Path
 import shutil
 import subprocess
 from tqdm import tqdm
 
 from .container3D import Container3D
-from .write_dummy_js import write_dummy_js
+from .event_log import EventLog
+from .frame_cache import FrameCache
+from .frame_cache import source_hash
+from .frame_server import iter_frames
+from .frame_server import render_frames
+from .png_writer import is_valid_png
+from .software_renderer import SoftwareRenderer
+from .software_renderer import iter_software_frames
+from .trajectory import Trajectory
 from .write_html_ball_definition import write_html_ball_definition
 from .write_html_camera import write_html_camera
 from .write_html_container import write_html_container
+from .write_html_frame_data import frame_data_bytes
+from .write_html_frame_data import write_html_frame_data
+from .write_html_frame_data import write_html_render_frames
+from .write_html_frame_data import write_html_set_frame
 from .write_html_header import write_html_header
 from .write_html_render_start import write_html_render_start
 from .write_html_render_end import write_html_render_end
 from .write_html_scene import write_html_scene
 
 
-def find_closest_on_the_right_side(x0, x_values, y_values):
-    """Find the closest value in x_values that is less than or equal to x0.
-    
-    This function is necessary because velocities cannot be interpolated.
-    If there are not values in x_values that are less than or equal to x0,
-    the closest value that is greater than x0 is returned.
-    """
-    indices = np.where(x_values <= x0)[0]
-    if len(indices) == 0:
-        indices = np.where(x_values >= x0)[0]
-        closest_index = indices[0]
-    else:
-        closest_index = indices[-1]
-    return y_values[closest_index]
-
-
 def time_rendering(
-        dict_snapshots=None,
+        event_log=None,
+        trajectory=None,
         container=None,
         tarray=None,
         ndelay_start=0,
         fontsize=20,
         outfilename=None,
+        html_mode='frames',
+        instanced=False,
         fcamera=None,
         workdir=None,
         width=1600,
         height=900,
+        jobs=1,
+        renderer='browser',
+        cache_dir=None,
+        overwrite=False,
+        resume_frames=False,
+        stream=False,
+        framerate=1,
+        crf=0,
+        preset='veryslow',
         debug=False
 ):
-    if not isinstance(dict_snapshots, dict):
-        raise ValueError(f'dict_snapshots: {dict_snapshots} is not a Python dictionary')
+    if trajectory is not None:
+        if not isinstance(trajectory, Trajectory):
+            raise ValueError(f'trajectory: {trajectory} is not a Trajectory instance')
+        if container is None:
+            container = trajectory.container
+    elif not isinstance(event_log, EventLog):
+        raise ValueError(f'event_log: {event_log} is not an EventLog instance')
     if not isinstance(container, Container3D):
         raise ValueError(f'container: {container} is not a Container3D instance')
     if outfilename is None:
@@ -72,14 +84,31 @@ def time_rendering(
         else:
             raise ValueError(f'outfilename: {outfilename} is not a HTML or MP4 file')
         print(f'Output file type: {outtype}')
+    if html_mode not in ['frames', 'base64', 'bin']:
+        raise ValueError(f'html_mode: {html_mode} is not frames, base64 or bin')
+    if renderer not in ['browser', 'numpy']:
+        raise ValueError(f'renderer: {renderer} is not browser or numpy')
+    # InstancedMesh with per-instance colors requires a more recent three.js
+    if instanced:
+        three_version = 'r124'
+    else:
+        three_version = 'r100'
         
-    tvalues = np.array([t for t in dict_snapshots.keys()])
-    if debug:
-        print(f'Number of frames in dict_snapshots: {len(tvalues)}')
+    if trajectory is not None:
+        # only the frames needed for the requested times are read
+        source = trajectory
+        initial_balls = trajectory.snapshot(0)
+        if debug:
+            print(f'Number of snapshots: {trajectory.nframes}')
+    else:
+        source = event_log
+        initial_balls = event_log.initial_balls
+        if debug:
+            print(f'Number of events: {event_log.nevents}')
 
     if tarray is None:
-        tmin = min(tvalues)
-        tmax = max(tvalues)
+        tmin = source.tstart
+        tmax = source.tend
         tstep = 1.0
         tarray = np.arange(tmin, tmax + tstep/2, tstep)
     else:
@@ -102,158 +131,160 @@ def time_rendering(
             camera_lookat_z = 0
             return camera_phi, camera_theta, camera_r, camera_lookat_x, camera_lookat_y, camera_lookat_z
 
-    dummykey = list(dict_snapshots.keys())[0]
-    nballs = dict_snapshots[dummykey].nballs
-
-    finterp_balls = []
+    nballs = initial_balls.nballs
 
-    for i in range(nballs):
-        # ball position
-        xval = [dict_snapshots[t].dict[i].position.x for t in dict_snapshots]
-        yval = [dict_snapshots[t].dict[i].position.y for t in dict_snapshots]
-        zval = [dict_snapshots[t].dict[i].position.z for t in dict_snapshots]
-        # ball velocity
-        vxval = [dict_snapshots[t].dict[i].velocity.x for t in dict_snapshots]
-        vyval = [dict_snapshots[t].dict[i].velocity.y for t in dict_snapshots]
-        vzval = [dict_snapshots[t].dict[i].velocity.z for t in dict_snapshots]
-        # ball color
-        rcol = [dict_snapshots[t].dict[i].rgbcolor.x for t in dict_snapshots]
-        gcol = [dict_snapshots[t].dict[i].rgbcolor.y for t in dict_snapshots]
-        bcol = [dict_snapshots[t].dict[i].rgbcolor.z for t in dict_snapshots]
-        # interpolated functions
-        fxval = np.interp(tarray, tvalues, xval)
-        fyval = np.interp(tarray, tvalues, yval)
-        fzval = np.interp(tarray, tvalues, zval)
-        fvxval = np.array([find_closest_on_the_right_side(value, tvalues, vxval) for value in tarray])
-        fvyval = np.array([find_closest_on_the_right_side(value, tvalues, vyval) for value in tarray])
-        fvzval = np.array([find_closest_on_the_right_side(value, tvalues, vzval) for value in tarray])
-        frcol = np.interp(tarray, tvalues, rcol)
-        fgcol = np.interp(tarray, tvalues, gcol)
-        fbcol = np.interp(tarray, tvalues, bcol)
-        finterp_balls.append([fxval, fyval, fzval, fvxval, fvyval, fvzval, frcol, fgcol, fbcol])
+    # state of the balls at every frame, with shape (nframes, nballs, 3),
+    # computed analytically from the last event before each frame
+    fposition, fvelocity, frgbcolor = source.states_at(tarray)
 
     if outtype == 'html':
         print(f'Creating HTML output: {outfilename}')
         f = open(outfilename, 'wt')
-        write_html_header(f, outtype=outtype, fontsize=fontsize)
+        write_html_header(f, outtype=outtype, fontsize=fontsize, three_version=three_version)
         write_html_camera(f, fcamera(tmin), outtype=outtype)
         write_html_scene(f)
         write_html_container(f, container)
         print(f'- Defining balls')
-        write_html_ball_definition(f, snapshot=dict_snapshots[0])
-        write_html_render_start(f, ndelay_start)
-        print('- Creating frames')
-        for k in tqdm(range(nframes)):
-            t = tarray[k]
-            f.write(f'                if ( nframe == {k + 1} )' + ' {\n')
-            camera_phi, camera_theta, camera_r, camera_lookat_x, camera_lookat_y, camera_lookat_z = fcamera(t)
-            f.write(f'                    camera.position.set( {camera_r} * Math.cos( {camera_phi} * deg2rad ) * Math.cos( {camera_theta} * deg2rad ),\n')
-            f.write(f'                                         {camera_r} * Math.sin( {camera_phi} * deg2rad ) * Math.cos( {camera_theta} * deg2rad ),\n')
-            f.write(f'                                         {camera_r} * Math.sin( {camera_theta} * deg2rad ) );\n')
-            f.write(f'                    camera.lookAt( {camera_lookat_x}, {camera_lookat_y}, {camera_lookat_z} );\n')
-            f.write(f'                    var frametime = {t};\n')
-            f.write('                    disp_time.innerHTML = frametime.toFixed(4);')
-            for i in range(nballs):
-                fxval, fyval, fzval, fvxval, fvyval, fvzval, frcol, fgcol, fbcol = finterp_balls[i]
-                f.write(f'                    balls[{i}].position.set( {fxval[k]}, {fyval[k]}, {fzval[k]} );\n')
-                f.write(f'                    balls[{i}].material.color =  new THREE.Color().setRGB( {frcol[k]}, {fgcol[k]}, {fbcol[k]});\n')
-            f.write('                }\n')
+        write_html_ball_definition(f, snapshot=initial_balls, instanced=instanced)
+        if html_mode == 'frames':
+            # one block of JavaScript code per frame
+            write_html_render_start(f, ndelay_start, instanced=instanced)
+            print('- Creating frames')
+            for k in tqdm(range(nframes)):
+                t = tarray[k]
+                f.write(f'                if ( nframe == {k + 1} )' + ' {\n')
+                camera_phi, camera_theta, camera_r, camera_lookat_x, camera_lookat_y, camera_lookat_z = fcamera(t)
+                f.write(f'                    camera.position.set( {camera_r} * Math.cos( {camera_phi} * deg2rad ) * Math.cos( {camera_theta} * deg2rad ),\n')
+                f.write(f'                                         {camera_r} * Math.sin( {camera_phi} * deg2rad ) * Math.cos( {camera_theta} * deg2rad ),\n')
+                f.write(f'                                         {camera_r} * Math.sin( {camera_theta} * deg2rad ) );\n')
+                f.write(f'                    camera.lookAt( {camera_lookat_x}, {camera_lookat_y}, {camera_lookat_z} );\n')
+                f.write(f'                    var frametime = {t};\n')
+                f.write('                    disp_time.innerHTML = frametime.toFixed(4);')
+                for i in range(nballs):
+                    x, y, z = fposition[k, i]
+                    r, g, b = frgbcolor[k, i]
+                    f.write(f'                    balls[{i}].position.set( {x}, {y}, {z} );\n')
+                    f.write(f'                    balls[{i}].material.color =  new THREE.Color().setRGB( {r}, {g}, {b});\n')
+                f.write('                }\n')
+        else:
+            # frames stored as binary data read by a fixed render loop
+            print('- Creating frame data')
+            data = frame_data_bytes(tarray, [fcamera(t) for t in tarray], fposition, frgbcolor)
+            if html_mode == 'bin':
+                binfile = outfilename.with_suffix('.bin')
+                print(f'- Saving frame data: {binfile}')
+                with open(binfile, 'wb') as fbin:
+                    fbin.write(data)
+                write_html_frame_data(f, nframes, nballs, binfile=binfile.name)
+            else:
+                write_html_frame_data(f, nframes, nballs, data=data)
+            write_html_render_start(f, ndelay_start, instanced=instanced)
+            write_html_render_frames(f)
+            camera_phi, camera_theta, camera_r, camera_lookat_x, camera_lookat_y, camera_lookat_z = fcamera(tarray[-1])
         # camera looking at last position
         f.write(f'                camera.lookAt( {camera_lookat_x}, {camera_lookat_y}, {camera_lookat_z} );\n')
         write_html_render_end(f, outtype=outtype)
         f.close()
 
     elif outtype == 'mp4':
-        # install puppeteer
-        command_line_list = ['npm', 'install', 'puppeteer']
-        if debug:
-            print(f'Installing puppeteer...')
-            print(' '.join(command_line_list))
-        sp = subprocess.run(command_line_list, capture_output=True, text=True)
-        if sp.returncode != 0:
-            print(f'Error installing puppeteer: {sp.stderr}')
-            raise SystemExit()
-        else:
-            if debug:
-                print(sp.stdout)
-                print('Puppeteer installed!')
-        # create dummydir
+        cameras = [fcamera(t) for t in tarray]
+        # create working directory
         if workdir is None:
             workdir = Path('dummydir')
         else:
             workdir = Path(f'{workdir}')
         if workdir.exists():
-            print(f'Directory {workdir} already exists. All its content will be deleted.')
-            rmdir = input('Do you want to continue (y/[n])? ')
-            if rmdir.lower() == 'y':
+            if overwrite:
+                print(f'Directory {workdir} already exists. All its content will be deleted.')
                 shutil.rmtree(workdir)
-            else:
-                raise SystemExit('End of program')
-        os.mkdir(workdir)
-        # generate dummy JavaScript file
-        jsfile = Path('./dummy.js')
-        write_dummy_js(jsfile=jsfile, width=width, height=height)
-        # renderize each frame
+            elif not resume_frames:
+                raise SystemExit(f'ERROR: directory {workdir} already exists (use --overwrite or --resume_frames)')
+        workdir.mkdir(parents=True, exist_ok=True)
         nzeros = len(str(nframes))
-        image2d_velocity = np.zeros((nframes, nballs))
-        image2d_xpos = np.zeros((nframes, nballs))
-        image2d_ypos = np.zeros((nframes, nballs))
-        image2d_zpos = np.zeros((nframes, nballs))
-        for k in tqdm(range(nframes)):
-            t = tarray[k]
-            # generate dummy HTML file
-            f = open('dummy.html', 'wt')
-            write_html_header(f, outtype=outtype, frameinfo=f'Frame {k}, t={t}', fontsize=fontsize)
-            write_html_camera(f, fcamera(t), outtype=outtype)
+        pngfiles = [workdir / f'frame_{str(k).zfill(nzeros)}.png' for k in range(nframes)]
+        # key of each frame: digest of everything that determines the
+        # image, only needed to reuse the frames of the cache or of a
+        # previous execution (the digest of the source reads all of it)
+        if cache_dir is not None or resume_frames:
+            digest = source_hash(source)
+            frame_keys = []
+            for k in range(nframes):
+                parameters = dict(source=digest, time=float(tarray[k]), camera=[float(c) for c in cameras[k]],
+                                  width=width, height=height, renderer=renderer)
+                if renderer == 'browser':
+                    # the frame number is displayed in the image
+                    parameters.update(frame=k, fontsize=fontsize, instanced=instanced, three_version=three_version)
+                frame_keys.append(FrameCache.key(**parameters))
+        else:
+            frame_keys = None
+        # frames rendered in a previous (possibly interrupted) execution
+        # with the same parameters, according to the manifest of the keys
+        # of the frames in the working directory
+        if resume_frames:
+            manifestfile = workdir / 'frames.json'
+            if manifestfile.is_file():
+                with open(manifestfile, 'rt') as fmanifest:
+                    manifest = json.load(fmanifest)
+            else:
+                manifest = dict()
+            on_disk = [manifest.get(pngfiles[k].name) == frame_keys[k] and
+                       is_valid_png(pngfiles[k], width=width, height=height) for k in range(nframes)]
+            print(f'Valid frames found in {workdir}: {sum(on_disk)} of {nframes}')
+            # the frames that are not reused are removed before writing
+            # the new manifest, so that they are never taken as rendered
+            # with the new keys
+            for k in range(nframes):
+                if not on_disk[k]:
+                    pngfiles[k].unlink(missing_ok=True)
+            with open(manifestfile, 'wt') as fmanifest:
+                json.dump({pngfiles[k].name: frame_keys[k] for k in range(nframes)}, fmanifest, indent=0)
+        else:
+            on_disk = [False] * nframes
+        # frames rendered in previous executions with the same parameters
+        if cache_dir is None:
+            frame_cache = None
+            cached = [False] * nframes
+        else:
+            frame_cache = FrameCache(cache_dir)
+            cached = [frame_cache.contains(key) for key in frame_keys]
+            print(f'Frames found in cache {cache_dir}: {sum(cached)} of {nframes}')
+        missing = [k for k in range(nframes) if not (cached[k] or on_disk[k])]
+        if renderer == 'browser' and len(missing) > 0:
+            # install puppeteer
+            command_line_list = ['npm', 'install', 'puppeteer']
+            if debug:
+                print(f'Installing puppeteer...')
+                print(' '.join(command_line_list))
+            sp = subprocess.run(command_line_list, capture_output=True, text=True)
+            if sp.returncode != 0:
+                print(f'Error installing puppeteer: {sp.stderr}')
+                raise SystemExit()
+            else:
+                if debug:
+                    print(sp.stdout)
+                    print('Puppeteer installed!')
+            # single HTML page with all the frames, rendered on demand by a
+            # long-lived headless browser
+            htmlfile = workdir / 'scene.html'
+            f = open(htmlfile, 'wt')
+            write_html_header(f, outtype=outtype, fontsize=fontsize, three_version=three_version)
+            write_html_camera(f, fcamera(tmin), outtype=outtype)
             write_html_scene(f)
             write_html_container(f, container)
-            snapshot = copy.deepcopy(dict_snapshots[0])
-            for i in range(nballs):
-                fxval, fyval, fzval, fvxval, fvyval, fvzval, frcol, fgcol, fbcol = finterp_balls[i]
-                b = snapshot.dict[i]
-                b.position.x = fxval[k]
-                b.position.y = fyval[k]
-                b.position.z = fzval[k]
-                b.rgbcolor.x = frcol[k]
-                b.rgbcolor.y = fgcol[k]
-                b.rgbcolor.z = fbcol[k]
-                image2d_xpos[k, i] = fxval[k]
-                image2d_ypos[k, i] = fyval[k]
-                image2d_zpos[k, i] = fzval[k]
-                image2d_velocity[k, i] = np.sqrt(fvxval[k]**2 + fvyval[k]**2 + fvzval[k]**2)
-            write_html_ball_definition(f, snapshot=snapshot)
-            f.write('        // ---\n\n')
-            f.write('        renderer.render(scene, camera);\n\n')
-            f.write('        // ---\n\n')
-            f.write(f'        var nframe = {k};\n')
-            f.write('        disp_nframe.innerHTML = nframe.toString();\n')
-            camera_phi, camera_theta, camera_r, camera_lookat_x, camera_lookat_y, camera_lookat_z = fcamera(t)
-            f.write(f'        var phi = {camera_phi};\n')
-            f.write(f'        var theta = {camera_theta};\n')
-            f.write(f'        var r = {camera_r};\n')
-            f.write(f'        camera.position.set( r * Math.cos( phi * deg2rad) * Math.cos( theta * deg2rad ),\n')
-            f.write(f'                             r * Math.sin( phi * deg2rad) * Math.cos( theta * deg2rad ),\n')
-            f.write(f'                             r * Math.sin( theta ) );\n')
-            f.write(f'        camera.lookAt( {camera_lookat_x}, {camera_lookat_y}, {camera_lookat_z} );\n')
-            f.write(f'        var frametime = {t};\n')
-            f.write('        disp_time.innerHTML = frametime.toFixed(4);\n')
-            f.write('        disp_camera_phi.innerHTML = phi.toFixed(2);\n')
-            f.write('        disp_camera_theta.innerHTML = theta.toFixed(2);\n')
-            f.write('        disp_camera_r.innerHTML = r.toFixed(4);\n')
-
+            write_html_ball_definition(f, snapshot=initial_balls, instanced=instanced)
+            data = frame_data_bytes(tarray, cameras, fposition, frgbcolor)
+            write_html_frame_data(f, nframes, nballs, data=data)
+            write_html_set_frame(f, instanced=instanced)
             write_html_render_end(f, outtype=outtype)
             f.close()
-            # renderize HTML file
-            command_line_list = ['node', jsfile.name]
-            sp = subprocess.run(command_line_list, capture_output=True, text=True)
-            if sp.returncode != 0:
-                print(f'Error executing {' '.join(command_line_list)}: {sp.stderr}')
-                raise SystemExit()
-            command_line_list = ['mv', 'image.png', f'{workdir}/frame_{str(k).zfill(nzeros)}.png']
-            sp = subprocess.run(command_line_list, capture_output=True, text=True)
-            if sp.returncode != 0:
-                print(f'Error executing {' '.join(command_line_list)}: {sp.stderr}')
-                raise SystemExit()
+        elif renderer == 'numpy':
+            software_renderer = SoftwareRenderer(container=container, radius=initial_balls.state.radius,
+                                                 width=width, height=height)
+        # velocity and position of each ball in each frame
+        image2d_velocity = np.linalg.norm(fvelocity, axis=2)
+        image2d_xpos = fposition[:, :, 0]
+        image2d_ypos = fposition[:, :, 1]
+        image2d_zpos = fposition[:, :, 2]
         # save FITS files with velocities
         print(f'Creating FITS file with velocities: {workdir}/velocities.fits')
         hdu = fits.PrimaryHDU(image2d_velocity)
@@ -280,20 +311,89 @@ def time_rendering(
         hdu.header['NBALLS'] = (nballs, 'Number of balls')
         hdulist = fits.HDUList([hdu])
         hdulist.writeto(f'{workdir}/zpositions.fits', overwrite=True)
-        # create mp4 file
-        command_line_list = ['ffmpeg', 
-                             '-y',  # overwrite output file
-                             '-framerate', '1', 
-                             '-i', f'{workdir}/frame_%0{nzeros}d.png', 
-                             '-vcodec', 'libx264', '-r', '30', '-crf', '0',
-                             '-preset', 'veryslow',
-                               outfilename.name]
-        print(f'Creating MP4 file: {outfilename.name}')
-        print(f"$ {' '.join(command_line_list)}")
-        sp = subprocess.run(command_line_list, capture_output=True, text=True)
-        if sp.returncode != 0:
-            print(f'Error executing {' '.join(command_line_list)}: {sp.stderr}')
-            raise SystemExit()
+        # ffmpeg options
+        ffmpeg_options = ['-vcodec', 'libx264', '-r', '30', '-crf', f'{crf}', '-preset', preset, outfilename.name]
+        if stream:
+            # the images are piped to ffmpeg as they are rendered,
+            # without saving them in the working directory
+            # PNG images are needed to store the frames in the cache, and
+            # to pipe them with the frames already in the working directory
+            if renderer == 'numpy' and frame_cache is None and not any(on_disk):
+                output = 'raw'
+                input_options = ['-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}']
+            else:
+                output = 'png'
+                input_options = ['-f', 'image2pipe', '-vcodec', 'png']
+            # nothing is rendered when all the frames are cached
+            if len(missing) == 0:
+                frame_iterator = None
+            elif renderer == 'browser':
+                frame_iterator = iter_frames(htmlfile=htmlfile, frames=missing, width=width, height=height,
+                                             jobs=jobs, jsdir=workdir)
+            else:
+                frame_iterator = iter_software_frames(renderer=software_renderer, fposition=fposition,
+                                                      frgbcolor=frgbcolor, cameras=cameras, frames=missing,
+                                                      jobs=jobs, output=output)
+            command_line_list = ['ffmpeg',
+                                 '-y',  # overwrite output file
+                                 '-framerate', f'{framerate}'] + input_options + ['-i', '-'] + ffmpeg_options
+            print(f'Creating MP4 file: {outfilename.name}')
+            print(f"$ {' '.join(command_line_list)}")
+            logfile = workdir / 'ffmpeg.log'
+            with open(logfile, 'wb') as flog:
+                sp = subprocess.Popen(command_line_list, stdin=subprocess.PIPE, stdout=flog, stderr=flog)
+                try:
+                    for k in tqdm(range(nframes)):
+                        if on_disk[k]:
+                            with open(pngfiles[k], 'rb') as fpng:
+                                data = fpng.read()
+                        elif cached[k]:
+                            data = frame_cache.read(frame_keys[k])
+                        else:
+                            _, data = next(frame_iterator)
+                        if frame_cache is not None and not cached[k]:
+                            frame_cache.write(frame_keys[k], data)
+                        sp.stdin.write(data)
+                except BrokenPipeError:
+                    pass
+                finally:
+                    if frame_iterator is not None:
+                        frame_iterator.close()
+                    sp.stdin.close()
+                    sp.wait()
+            if sp.returncode != 0:
+                print(f'Error executing {' '.join(command_line_list)}: see {logfile}')
+                raise SystemExit()
+        else:
+            for k in range(nframes):
+                if cached[k] and not on_disk[k]:
+                    frame_cache.copy_to(frame_keys[k], pngfiles[k])
+            if renderer == 'browser':
+                if len(missing) > 0:
+                    render_frames(htmlfile=htmlfile, frames=[(k, pngfiles[k]) for k in missing], width=width,
+                                  height=height, jobs=jobs, jsdir=workdir)
+            else:
+                for k, data in tqdm(iter_software_frames(renderer=software_renderer, fposition=fposition,
+                                                         frgbcolor=frgbcolor, cameras=cameras, frames=missing,
+                                                         jobs=jobs),
+                                    total=len(missing)):
+                    with open(pngfiles[k], 'wb') as fpng:
+                        fpng.write(data)
+            if frame_cache is not None:
+                for k in range(nframes):
+                    if not cached[k]:
+                        frame_cache.store_file(frame_keys[k], pngfiles[k])
+            # create mp4 file
+            command_line_list = ['ffmpeg',
+                                 '-y',  # overwrite output file
+                                 '-framerate', f'{framerate}',
+                                 '-i', f'{workdir}/frame_%0{nzeros}d.png'] + ffmpeg_options
+            print(f'Creating MP4 file: {outfilename.name}')
+            print(f"$ {' '.join(command_line_list)}")
+            sp = subprocess.run(command_line_list, capture_output=True, text=True)
+            if sp.returncode != 0:
+                print(f'Error executing {' '.join(command_line_list)}: {sp.stderr}')
+                raise SystemExit()
         print(f'File {outfilename} created!')
 
     else:
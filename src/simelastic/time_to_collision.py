@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2025 Nicolás Cardiel
+#
+# This file is part of simelastic
+#
+# SPDX-License-Identifier: GPL-3.0+
+# License-Filename: LICENSE
+#
+
+import numpy as np
+
+
+def time_to_collision(
+        position1, velocity1, radius1,
+        position2, velocity2, radius2,
+        nround=None
+):
+    """Vectorized version of Ball.time_to_collision_with_ball.
+
+    The positions and velocities must be arrays with shape (..., 3),
+    and the radii arrays with shape (...); all of them are broadcast
+    against each other. Parallel motion, negative roots and balls
+    moving away from each other lead to np.inf, as in the scalar
+    version. If nround is not None, the times are rounded to nround
+    decimals; otherwise, overlapping balls approaching each other (due
+    to rounding errors) collide immediately.
+    """
+    v_relative = np.asarray(velocity1) - np.asarray(velocity2)
+    delta = np.asarray(position1) - np.asarray(position2)
+    dcol = np.asarray(radius1) + np.asarray(radius2)
+    a = np.einsum('...k,...k->...', v_relative, v_relative)
+    b = 2 * np.einsum('...k,...k->...', delta, v_relative)
+    c = np.einsum('...k,...k->...', delta, delta) - dcol ** 2
+    discriminant = b * b - 4 * a * c
+    valid = (a > 0) & (discriminant > 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sqrt_discriminant = np.sqrt(np.where(valid, discriminant, 0))
+        tmin1 = (-b + sqrt_discriminant) / (2 * a)
+        tmin2 = (-b - sqrt_discriminant) / (2 * a)
+    tmin1 = np.where(valid & (tmin1 >= 0), tmin1, np.inf)
+    tmin2 = np.where(valid & (tmin2 >= 0), tmin2, np.inf)
+    tmin = np.minimum(tmin1, tmin2)
+    with np.errstate(invalid='ignore'):
+        derivative = 2 * a * tmin + b
+    tmin = np.where(derivative >= 0, np.inf, tmin)
+    if nround is None:
+        return np.where((c < 0) & (b < 0), 0.0, tmin)
+    return np.round(tmin, nround)
+
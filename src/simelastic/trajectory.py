@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2025 Nicolás Cardiel
+#
+# This file is part of simelastic
+#
+# SPDX-License-Identifier: GPL-3.0+
+# License-Filename: LICENSE
+#
+
+import json
+import numpy as np
+from pathlib import Path
+import struct
+
+from .ball import BallCollection
+from .ball_state import BallState
+from .container3D import Container3D, container_from_dict
+from .resample_snapshots import step_hold_indices
+from .snapshot_sink import SnapshotSink
+
+TRAJECTORY_FORMAT = 'simelastic-trajectory'
+TRAJECTORY_VERSION = 1
+
+# fixed size of the .npy headers, so that they can be rewritten in place
+# once the final number of frames is known
+NPY_HEADER_SIZE = 128
+
+# arrays with one row per frame
+FRAME_ARRAYS = ['time', 'position', 'velocity', 'rgbcolor']
+
+
+def npy_header(shape, dtype=float):
+    """Header (version 1.0) of a .npy file, padded to NPY_HEADER_SIZE bytes."""
+    header = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (np.dtype(dtype).str, tuple(shape))
+    header = header.ljust(NPY_HEADER_SIZE - 11) + '\n'
+    if len(header) != NPY_HEADER_SIZE - 10:
+        raise ValueError(f'Unexpected .npy header length for shape {shape}')
+    return np.lib.format.MAGIC_PREFIX + bytes([1, 0]) + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+class TrajectoryWriter(SnapshotSink):
+    """Write a trajectory directory frame by frame.
+
+    A trajectory is a directory containing fixed-width columns stored
+    as .npy files: time.npy (T,), position.npy, velocity.npy and
+    rgbcolor.npy (T, N, 3), radius.npy and mass.npy (N,), and a
+    metadata.json file with the container description.
+
+    The writer is a SnapshotSink, so it can be passed to run_simulation
+    to stream the simulation to disk: the frames are buffered and
+    appended to the files in chunks of chunk_size frames, and the .npy
+    headers are updated after every chunk. The memory used does not
+    depend on the length of the simulation, and the frames already
+    written are readable even if the program is interrupted. Several
+    events at the same time produce a single frame.
+    """
+    def __init__(self, dirname=None, container=None, chunk_size=64):
+        super().__init__()
+        if dirname is None:
+            raise ValueError('Undefined dirname')
+        if container is not None and not isinstance(container, Container3D):
+            raise ValueError(f'container: {container} is not a Container3D instance')
+        self.dirname = Path(dirname)
+        self.container = container
+        self.chunk_size = chunk_size
+        self.nballs = 0
+        self.nframes = 0
+        self.files = dict()
+        self.buffers = dict()
+        self.pending = None
+
+    def __str__(self):
+        output = '<TrajectoryWriter instance>\n'
+        output += f'    dirname = {self.dirname}\n'
+        output += f'    nballs = {self.nballs}\n'
+        output += f'    nframes = {self.nframes}'
+        return output
+
+    def frame_shape(self, name, nframes=0):
+        if name == 'time':
+            return (nframes,)
+        return (nframes, self.nballs, 3)
+
+    def write_metadata(self):
+        metadata = {
+            'format': TRAJECTORY_FORMAT,
+            'version': TRAJECTORY_VERSION,
+            'nballs': self.nballs,
+            'nframes': self.nframes,
+            'container': self.container.to_dict()
+        }
+        with open(self.dirname / 'metadata.json', 'wt') as f:
+            json.dump(metadata, f, indent=2)
+
+    def start(self, time, balls):
+        if not isinstance(balls, BallCollection):
+            raise ValueError(f'balls: {balls} is not an instance of BallCollection')
+        if self.container is None:
+            self.container = balls.state.container[0]
+        self.dirname.mkdir(parents=True, exist_ok=True)
+        self.nballs = balls.nballs
+        np.save(self.dirname / 'radius.npy', balls.state.radius)
+        np.save(self.dirname / 'mass.npy', balls.state.mass)
+        for name in FRAME_ARRAYS:
+            self.files[name] = open(self.dirname / f'{name}.npy', 'wb')
+            self.files[name].write(npy_header(self.frame_shape(name)))
+            self.buffers[name] = []
+        self.write_metadata()
+        self.tstart = time
+        self.record(time, None, balls)
+
+    def record(self, time, ids, balls):
+        state = balls.state
+        self.append(time, state.position, state.velocity, state.rgbcolor)
+
+    def append(self, time, position, velocity, rgbcolor):
+        """Append the state of all the balls at a given time."""
+        if self.pending is not None and self.pending[0] != time:
+            for name, value in zip(FRAME_ARRAYS, self.pending):
+                self.buffers[name].append(value)
+            if len(self.buffers['time']) >= self.chunk_size:
+                self.write_buffers()
+        self.pending = (
+            time,
+            np.array(position, dtype=float),
+            np.array(velocity, dtype=float),
+            np.array(rgbcolor, dtype=float)
+        )
+        self.tend = time
+
+    def resume(self, time, balls):
+        """Reopen the trajectory directory and continue it from time.
+
+        The frames at times >= time (which may have been written after
+        the last checkpoint) are removed, and the state of balls is
+        recorded as the frame at time.
+        """
+        self.truncate(time)
+        if balls.nballs != self.nballs:
+            raise ValueError(f'balls.nballs: {balls.nballs} does not match nballs: {self.nballs}')
+        self.record(time, None, balls)
+
+    def truncate(self, time):
+        """Reopen the trajectory directory and remove the frames at times >= time."""
+        self.close()
+        with open(self.dirname / 'metadata.json', 'rt') as f:
+            metadata = json.load(f)
+        if metadata.get('format') != TRAJECTORY_FORMAT:
+            raise ValueError(f'{self.dirname} is not a {TRAJECTORY_FORMAT} directory')
+        if self.container is None:
+            self.container = container_from_dict(metadata['container'])
+        self.nballs = metadata['nballs']
+        # the .npy headers contain the number of frames completely written
+        frame_time = np.load(self.dirname / 'time.npy', mmap_mode='r')
+        self.nframes = int(np.searchsorted(frame_time, time, side='left'))
+        self.tstart = float(frame_time[0]) if self.nframes > 0 else time
+        self.tend = float(frame_time[self.nframes - 1]) if self.nframes > 0 else None
+        del frame_time
+        for name in FRAME_ARRAYS:
+            f = open(self.dirname / f'{name}.npy', 'r+b')
+            itemsize = np.dtype(float).itemsize * int(np.prod(self.frame_shape(name, 1)))
+            f.truncate(NPY_HEADER_SIZE + self.nframes * itemsize)
+            f.seek(0)
+            f.write(npy_header(self.frame_shape(name, self.nframes)))
+            f.seek(0, 2)
+            self.files[name] = f
+            self.buffers[name] = []
+        self.pending = None
+
+    def flush(self):
+        """Write all the frames recorded so far.
+
+        The last frame is no longer merged with later events at the same
+        time, so this must not be called between simultaneous events.
+        """
+        if not self.files:
+            return
+        if self.pending is not None:
+            for name, value in zip(FRAME_ARRAYS, self.pending):
+                self.buffers[name].append(value)
+            self.pending = None
+        self.write_buffers()
+
+    def write_buffers(self):
+        nnew = len(self.buffers['time'])
+        if nnew == 0:
+            return
+        self.nframes += nnew
+        for name in FRAME_ARRAYS:
+            f = self.files[name]
+            chunk = np.array(self.buffers[name], dtype=float)
+            f.write(chunk.tobytes())
+            self.buffers[name] = []
+            # update header with the current number of frames
+            f.seek(0)
+            f.write(npy_header(self.frame_shape(name, self.nframes)))
+            f.seek(0, 2)
+            f.flush()
+
+    def close(self):
+        if not self.files:
+            return
+        self.flush()
+        for name in FRAME_ARRAYS:
+            self.files[name].close()
+        self.files = dict()
+        self.write_metadata()
+
+
+class Trajectory:
+    """Read-only access to a trajectory directory.
+
+    The per-frame arrays are opened with numpy memory maps, so opening a
+    trajectory is nearly instantaneous whatever its size, and only the
+    frames actually used are read from disk.
+    """
+    def __init__(self, dirname=None):
+        if dirname is None:
+            raise ValueError('Undefined dirname')
+        self.dirname = Path(dirname)
+        with open(self.dirname / 'metadata.json', 'rt') as f:
+            metadata = json.load(f)
+        if metadata.get('format') != TRAJECTORY_FORMAT:
+            raise ValueError(f'{self.dirname} is not a {TRAJECTORY_FORMAT} directory')
+        self.nballs = metadata['nballs']
+        self.container = container_from_dict(metadata['container'])
+        self.radius = np.load(self.dirname / 'radius.npy')
+        self.mass = np.load(self.dirname / 'mass.npy')
+        self.time = np.load(self.dirname / 'time.npy', mmap_mode='r')
+        self.position = np.load(self.dirname / 'position.npy', mmap_mode='r')
+        self.velocity = np.load(self.dirname / 'velocity.npy', mmap_mode='r')
+        self.rgbcolor = np.load(self.dirname / 'rgbcolor.npy', mmap_mode='r')
+
+    def __str__(self):
+        output = '<Trajectory instance>\n'
+        output += f'    dirname = {self.dirname}\n'
+        output += f'    nballs = {self.nballs}\n'
+        output += f'    nframes = {self.nframes}\n'
+        output += f'    container = {repr(self.container)}'
+        return output
+
+    @property
+    def nframes(self):
+        return len(self.time)
+
+    @property
+    def tstart(self):
+        return float(self.time[0])
+
+    @property
+    def tend(self):
+        return float(self.time[-1])
+
+    def window(self, tmin, tmax):
+        """Slice of the frames needed to interpolate between tmin and tmax."""
+        i1 = max(np.searchsorted(self.time, tmin, side='right') - 1, 0)
+        i2 = min(np.searchsorted(self.time, tmax, side='left') + 1, self.nframes)
+        return slice(i1, i2)
+
+    def states_at(self, times):
+        """Position, velocity and color of all the balls at several times.
+
+        The positions are computed from the last frame before every time
+        as pos_k + vel_k * (t - t_k), which is exact because the balls
+        move in straight lines between events. Returns arrays with shape
+        (F, N, 3).
+        """
+        times = np.atleast_1d(np.asarray(times, dtype=float))
+        window = self.window(times.min(), times.max())
+        time = np.array(self.time[window])
+        k = step_hold_indices(times, time)
+        # read each required frame from disk only once
+        frames, k = np.unique(k, return_inverse=True)
+        dt = times - time[frames][k]
+        frames = frames + window.start
+        position = self.position[frames][k]
+        velocity = self.velocity[frames][k]
+        rgbcolor = self.rgbcolor[frames][k]
+        return position + velocity * dt[:, np.newaxis, np.newaxis], velocity, rgbcolor
+
+    def positions_at(self, times):
+        """Position of all the balls at several times, with shape (F, N, 3)."""
+        return self.states_at(times)[0]
+
+    def snapshot(self, k=0):
+        """BallCollection with the state of the balls in frame k."""
+        state = BallState.from_arrays(
+            position=self.position[k],
+            velocity=self.velocity[k],
+            radius=self.radius,
+            mass=self.mass,
+            rgbcolor=self.rgbcolor[k],
+            container=self.container
+        )
+        return BallCollection.from_state(state)
+
+
+def save_trajectory(dirname=None, event_log=None, container=None):
+    """Save the states rebuilt from an EventLog as a trajectory directory."""
+    writer = TrajectoryWriter(dirname=dirname, container=container)
+    writer.start(event_log.tstart, event_log.initial_balls)
+    for t, position, velocity, rgbcolor in event_log.iter_states():
+        writer.append(t, position, velocity, rgbcolor)
+    writer.close()
+    return Trajectory(dirname)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2025 Nicolás Cardiel
+#
+# This file is part of simelastic
+#
+# SPDX-License-Identifier: GPL-3.0+
+# License-Filename: LICENSE
+#
+
+from pathlib import Path
+
+
+def write_frame_server_js(jsfile=None, htmlfile=None, width=1400, height=700):
+    """Create a JavaScript file that renders frames on demand.
+
+    The script launches a headless browser with puppeteer, loads
+    htmlfile (which must define a setFrame(k) function) only once, and
+    then reads requests from stdin, one per line, with the format
+    'k pngfile'. For each request, frame k is rendered and saved as
+    pngfile, and the line 'done k' is written to stdout. If pngfile is
+    '-', the PNG image is written to stdout instead, encoded in base64,
+    in the line 'done k data'.
+    """
+    if jsfile is None:
+        raise ValueError(f'Undefined jsfile')
+    if htmlfile is None:
+        raise ValueError(f'Undefined htmlfile')
+
+    f = open(jsfile, 'wt')
+    f.write(f"""// render frames of a HTML file on demand and export them to PNG files
+const puppeteer = require('puppeteer');
+const readline = require('readline');
+(async () => {{
+    const browser = await puppeteer.launch();
+    const page = await browser.newPage();
+    await page.setViewport({{ width: {width}, height: {height} }}); // Set the desired width and height
+""")
+    f.write(f"""
+    await page.goto('file://{Path(htmlfile).absolute()}'""")
+    f.write(""", {waitUntil: 'load'});
+    console.log('ready');
+    const rl = readline.createInterface({ input: process.stdin });
+    for await (const line of rl) {
+        const request = line.trim();
+        if (request.length === 0) {
+            continue;
+        }
+        const nsep = request.indexOf(' ');
+        const k = parseInt(request.substring(0, nsep));
+        const pngfile = request.substring(nsep + 1);
+        await page.evaluate((k) => setFrame(k), k);
+        if (pngfile === '-') {
+            const data = await page.screenshot({ encoding: 'base64' });
+            console.log(`done ${k} ${data}`);
+        } else {
+            await page.screenshot({ path: pngfile });
+            console.log(`done ${k}`);
+        }
+    }
+    await browser.close();
+})().catch((error) => {
+    console.error(error);
+    process.exit(1);
+});
+// end of code""")
+    f.close()
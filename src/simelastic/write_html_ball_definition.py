@@ -8,13 +8,24 @@
 # License-Filename: LICENSE
 #
 
-def write_html_ball_definition(f, snapshot):
+def write_html_ball_definition(f, snapshot, instanced=False):
     """
     Write the ball definition in the HTML file.
+
+    When instanced is True, all the balls are drawn with a single
+    InstancedMesh sharing one unit sphere geometry, which is scaled
+    by the radius of each ball. The elements of the balls array are
+    then plain objects (with position, v, radius, mass and
+    material.color) that are copied to the instance matrices and
+    colors by updateBallInstances() before rendering.
     """
 
     nballs = len(snapshot.dict)
 
+    if instanced:
+        write_html_ball_definition_instanced(f, snapshot, nballs)
+        return
+
     f.write(f"""
         // ---------------------------
         
@@ -35,4 +46,71 @@ def write_html_ball_definition(f, snapshot):
         ball.mass = {b.mass};
         balls.push( ball );
         scene.add( ball );
-""")
\ No newline at end of file
+""")
+
+
+def write_html_ball_definition_instanced(f, snapshot, nballs):
+    """
+    Write the ball definition using an InstancedMesh (three.js >= r124, with the
+    per-instance colors of setColorAt, as loaded by time_rendering).
+    """
+
+    f.write(f"""
+        // ---------------------------
+        
+        var count = {nballs};
+        var balls = [];
+        var ballMesh = null;
+
+        // position, velocity, color, radius and mass of each ball
+        var ballData = [
+""")
+
+    state = snapshot.state
+    for i in range(nballs):
+        x, y, z = state.position[i]
+        vx, vy, vz = state.velocity[i]
+        r, g, b = state.rgbcolor[i]
+        f.write(f"""            [ {x}, {y}, {z}, {vx}, {vy}, {vz}, {r}, {g}, {b}, {state.radius[i]}, {state.mass[i]} ],
+""")
+
+    f.write("""        ];
+
+        for ( var i = 0 ; i < count ; i++ ) {
+                var d = ballData[i];
+                var ball = {
+                        position: new THREE.Vector3( d[0], d[1], d[2] ),
+                        v: new THREE.Vector3( d[3], d[4], d[5] ),
+                        material: { color: new THREE.Color().setRGB( d[6], d[7], d[8] ) },
+                        radius: d[9],
+                        mass: d[10]
+                };
+                balls.push( ball );
+        }
+        ballData = null;
+
+        if ( count > 0 ) {
+                var geometry = new THREE.SphereGeometry( 1, 36, 36 );
+                var material = new THREE.MeshPhongMaterial();
+                ballMesh = new THREE.InstancedMesh( geometry, material, count );
+                ballMesh.instanceMatrix.setUsage( THREE.DynamicDrawUsage );
+                scene.add( ballMesh );
+        }
+        var ballMatrix = new THREE.Matrix4();
+
+        function updateBallInstances() {
+                for ( var i = 0 ; i < count ; i++ ) {
+                        var b = balls[i];
+                        ballMatrix.makeScale( b.radius, b.radius, b.radius );
+                        ballMatrix.setPosition( b.position.x, b.position.y, b.position.z );
+                        ballMesh.setMatrixAt( i, ballMatrix );
+                        ballMesh.setColorAt( i, b.material.color );
+                }
+                if ( count > 0 ) {
+                        ballMesh.instanceMatrix.needsUpdate = true;
+                        ballMesh.instanceColor.needsUpdate = true;
+                }
+        }
+
+        updateBallInstances();
+""")
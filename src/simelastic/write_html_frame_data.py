@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2025 Nicolás Cardiel
+#
+# This file is part of simelastic
+#
+# SPDX-License-Identifier: GPL-3.0+
+# License-Filename: LICENSE
+#
+
+import base64
+import numpy as np
+
+# number of values stored per frame in the frame header:
+# time, camera_phi, camera_theta, camera_r,
+# camera_lookat_x, camera_lookat_y, camera_lookat_z
+NVALUES_FRAME_HEADER = 7
+
+
+def frame_data_bytes(tarray, camera, fposition, frgbcolor):
+    """Binary representation of the frames of the HTML animation.
+
+    The buffer contains, one after the other and with little-endian byte
+    order, the frame headers as float64 (F, 7), the ball positions as
+    float32 (F, N, 3) and the ball colors as uint8 (F, N, 3). The size
+    of each block is a multiple of the item size of the following one,
+    so that the browser can create the typed arrays without copying.
+
+    Parameters
+    ----------
+    tarray : array_like
+        Time of each frame (F,).
+    camera : array_like
+        Camera parameters (phi, theta, r, lookat_x, lookat_y, lookat_z)
+        for each frame (F, 6).
+    fposition : array_like
+        Position of the balls in each frame (F, N, 3).
+    frgbcolor : array_like
+        Color of the balls in each frame (F, N, 3), in the range [0, 1].
+    """
+    frames = np.column_stack([tarray, np.asarray(camera, dtype=float).reshape(-1, 6)])
+    position = np.asarray(fposition, dtype='<f4')
+    rgbcolor = np.round(np.clip(frgbcolor, 0, 1) * 255).astype(np.uint8)
+    return frames.astype('<f8').tobytes() + position.tobytes() + rgbcolor.tobytes()
+
+
+def write_html_frame_data(f, nframes, nballs, data=None, binfile=None):
+    """Write the definition of the frame data in the HTML file.
+
+    The frame data (see frame_data_bytes) are either embedded in the
+    HTML file as a base64 string (data), or read from a sidecar binary
+    file (binfile). In the latter case the HTML file must be served
+    over HTTP, since browsers do not allow to fetch local files.
+    """
+    if (data is None) == (binfile is None):
+        raise ValueError('Either data or binfile must be provided')
+
+    f.write(f"""
+        // ---------------------------
+
+        var frameData = null;
+
+        function setFrameData( buffer ) {{
+                var nframes = {nframes};
+                var nballs = {nballs};
+                var offset = 0;
+                var frames = new Float64Array( buffer, offset, nframes * {NVALUES_FRAME_HEADER} );
+                offset += frames.byteLength;
+                var position = new Float32Array( buffer, offset, nframes * nballs * 3 );
+                offset += position.byteLength;
+                var color = new Uint8Array( buffer, offset, nframes * nballs * 3 );
+                frameData = {{ nframes: nframes, frames: frames, position: position, color: color }};
+        }}
+""")
+
+    if binfile is None:
+        f.write("""
+        var frameDataBase64 = '""")
+        f.write(base64.b64encode(data).decode('ascii'))
+        f.write("""';
+        var frameDataString = atob( frameDataBase64 );
+        var frameDataBytes = new Uint8Array( frameDataString.length );
+        for ( var i = 0 ; i < frameDataString.length ; i++ ) {
+                frameDataBytes[i] = frameDataString.charCodeAt( i );
+        }
+        setFrameData( frameDataBytes.buffer );
+        frameDataBase64 = null;
+        frameDataString = null;
+""")
+    else:
+        f.write(f"""
+        fetch( '{binfile}' )
+                .then( response => response.arrayBuffer() )
+                .then( buffer => setFrameData( buffer ) );
+""")
+
+
+def write_html_render_frames(f):
+    """Write the render loop that displays the frames from frameData."""
+    f.write(f"""
+                if ( frameData === null ) {{
+                    // wait until the frame data are available
+                    nframe = nframe - 1;
+                }} else if ( nframe >= 1 && nframe <= frameData.nframes ) {{
+                    var k = nframe - 1;
+                    var c = frameData.frames.subarray( {NVALUES_FRAME_HEADER} * k, {NVALUES_FRAME_HEADER} * ( k + 1 ) );
+                    camera.position.set( c[3] * Math.cos( c[1] * deg2rad ) * Math.cos( c[2] * deg2rad ),
+                                         c[3] * Math.sin( c[1] * deg2rad ) * Math.cos( c[2] * deg2rad ),
+                                         c[3] * Math.sin( c[2] * deg2rad ) );
+                    camera.lookAt( c[4], c[5], c[6] );
+                    var frametime = c[0];
+                    disp_time.innerHTML = frametime.toFixed(4);
+                    var j = 3 * count * k;
+                    for ( var i = 0 ; i < count ; i++, j += 3 ) {{
+                        balls[i].position.set( frameData.position[j], frameData.position[j + 1], frameData.position[j + 2] );
+                        balls[i].material.color.setRGB( frameData.color[j] / 255, frameData.color[j + 1] / 255, frameData.color[j + 2] / 255 );
+                    }}
+                }}
+""")
+
+
+def write_html_set_frame(f, instanced=False):
+    """Write a setFrame(k) function that renders frame k from frameData.
+
+    This is used to render the frames of a video from a single page
+    that is loaded only once (see FrameServer).
+    """
+    if instanced:
+        update_instances = '\n                updateBallInstances();'
+    else:
+        update_instances = ''
+
+    f.write(f"""
+        // ---------------------------
+
+        function setFrame( k ) {{
+                var c = frameData.frames.subarray( {NVALUES_FRAME_HEADER} * k, {NVALUES_FRAME_HEADER} * ( k + 1 ) );
+                var phi = c[1];
+                var theta = c[2];
+                var r = c[3];
+                camera.position.set( r * Math.cos( phi * deg2rad ) * Math.cos( theta * deg2rad ),
+                                     r * Math.sin( phi * deg2rad ) * Math.cos( theta * deg2rad ),
+                                     r * Math.sin( theta * deg2rad ) );
+                camera.lookAt( c[4], c[5], c[6] );
+                var j = 3 * count * k;
+                for ( var i = 0 ; i < count ; i++, j += 3 ) {{
+                        balls[i].position.set( frameData.position[j], frameData.position[j + 1], frameData.position[j + 2] );
+                        balls[i].material.color.setRGB( frameData.color[j] / 255, frameData.color[j + 1] / 255, frameData.color[j + 2] / 255 );
+                }}{update_instances}
+                renderer.render( scene, camera );
+                var nframe = k;
+                disp_nframe.innerHTML = nframe.toString();
+                var frametime = c[0];
+                disp_time.innerHTML = frametime.toFixed(4);
+                disp_camera_phi.innerHTML = phi.toFixed(2);
+                disp_camera_theta.innerHTML = theta.toFixed(2);
+                disp_camera_r.innerHTML = r.toFixed(4);
+        }}
+""")
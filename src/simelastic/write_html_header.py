@@ -8,9 +8,12 @@
 # License-Filename: LICENSE
 #
 
-def write_html_header(f, outtype=None, frameinfo=None, fontsize=20):
+def write_html_header(f, outtype=None, frameinfo=None, fontsize=20, three_version='r100'):
     """
     Write the header of the HTML file.
+
+    three_version is the release of three.js to be loaded (the
+    InstancedMesh rendering mode requires r124).
     """
 
     if outtype is None:
@@ -48,9 +51,9 @@ def write_html_header(f, outtype=None, frameinfo=None, fontsize=20):
 <div id=display_camera_r>r = <span id=disp_camera_r></span></div>
 
 <!-- See https://exploratoria.github.io/exhibits/mechanics/elastic-collisions-in-3d/ -->
-<script src="https://cdn.jsdelivr.net/gh/mrdoob/three.js@r100/build/three.min.js"></script>
+<script src="https://cdn.jsdelivr.net/gh/mrdoob/three.js@{three_version}/build/three.min.js"></script>
 """)
     
     if outtype == 'html':
-        f.write("""<script src="https://cdn.jsdelivr.net/gh/mrdoob/three.js@r100/examples/js/controls/OrbitControls.js"></script>
+        f.write(f"""<script src="https://cdn.jsdelivr.net/gh/mrdoob/three.js@{three_version}/examples/js/controls/OrbitControls.js"></script>
 """)
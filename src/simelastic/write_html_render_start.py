@@ -8,26 +8,30 @@
 # License-Filename: LICENSE
 #
 
-def write_html_render_start(f, ndelay_start=0):
+def write_html_render_start(f, ndelay_start=0, instanced=False):
     """
     Write the start of the HTML file.
     """
+    if instanced:
+        update_instances = '\n                updateBallInstances();'
+    else:
+        update_instances = ''
     f.write(f"""
         // ---------------------------
 
         var nframe = -{ndelay_start};
 """)
 
-    f.write("""
-        function render() {
-                requestAnimationFrame( render );
+    f.write(f"""
+        function render() {{
+                requestAnimationFrame( render );{update_instances}
                 renderer.render( scene, camera );
 
                 nframe = nframe + 1;
 
                 // ---
 
-                if ( nframe <= 0 ) { 
+                if ( nframe <= 0 ) {{ 
                     // nothing
-                };
+                }};
 """)
\ No newline at end of file
@@ -8,7 +8,603 @@
 # License-Filename: LICENSE
 #
 
+import copy
+import io
+import json
+import numpy as np
+import os
+import pytest
+import re
+import stat
+import zlib
+
 import simelastic
+from simelastic.ball import Ball, BallCollection
+from simelastic.ball_state import BallState
+from simelastic.checkpoint import Checkpointer
+from simelastic.container3D import Cuboid3D, VerticalCylinder3D
+from simelastic.event_log import EventLog
+from simelastic.frame_cache import FrameCache
+from simelastic.frame_server import iter_frames
+from simelastic.grown_balls_in_container import grown_balls_in_empty_container
+from simelastic.lattice_balls_in_container import lattice_balls_in_empty_container
+from simelastic.png_writer import png_bytes
+from simelastic.random_balls_in_container import isotropic_velocities, random_balls_in_empty_container
+from simelastic.run_simulation import run_simulation
+from simelastic.snapshot_sink import DictSnapshots
+from simelastic.software_renderer import SoftwareRenderer
+from simelastic.time_rendering import time_rendering
+from simelastic.time_to_collision import time_to_collision
+from simelastic.trajectory import Trajectory, TrajectoryWriter
+from simelastic.vector3D import Vector3D
+from simelastic.write_html_frame_data import NVALUES_FRAME_HEADER, frame_data_bytes, write_html_set_frame
+
 
 def test_simelastic():
     assert 1 == 1
+
+
+def test_run_simulation_head_on_collision():
+    box = Cuboid3D()
+    b1 = Ball(position=Vector3D(-2, 0, 0), velocity=Vector3D(1, 0, 0), container=box)
+    b2 = Ball(position=Vector3D(2, 0, 0), velocity=Vector3D(-1, 0, 0), container=box)
+    balls = BallCollection()
+    balls.add_list([b1, b2])
+    event_log = run_simulation(balls=balls, time_interval=5, debug=True)
+    # balls touch at t=1.5, bounce and reach the walls at t=5.5
+    assert event_log.time[0] == pytest.approx(1.5)
+    assert event_log.time[-1] == pytest.approx(5.5)
+    position, velocity, rgbcolor = event_log.state_at(2)
+    assert velocity[:, 0].tolist() == [-1, 1]
+    position, velocity, rgbcolor = event_log.state_at(event_log.tend)
+    assert position[:, 0] == pytest.approx([-4.5, 4.5])
+
+
+def test_collision_colour_of_resting_ball():
+    box = Cuboid3D()
+    # ball 0 is at rest until ball 1 hits it at t=2
+    b0 = Ball(position=Vector3D(0, 0, 0), rgbcolor=Vector3D(0, 0, 1), rgbcolor_on_speed=Vector3D(1, 0, 0),
+              container=box)
+    b1 = Ball(position=Vector3D(-3, 0, 0), velocity=Vector3D(1, 0, 0), rgbcolor=Vector3D(0, 1, 0),
+              container=box)
+    balls = BallCollection()
+    balls.add_list([b0, b1])
+    event_log = run_simulation(balls=balls, time_interval=2.5, use_cell_list=False)
+    assert event_log.time[0] == pytest.approx(2)
+    position, velocity, rgbcolor = event_log.states_at([2.5])
+    assert velocity[0].tolist() == [[1, 0, 0], [0, 0, 0]]
+    assert rgbcolor[0].tolist() == [[1, 0, 0], [0, 1, 0]]
+    # the simulation stops after the next event (ball 0 hits the wall)
+    position, velocity, rgbcolor = event_log.states_at([event_log.tend])
+    assert position[0] == pytest.approx(balls.state.position)
+    assert velocity[0].tolist() == balls.state.velocity.tolist()
+    assert rgbcolor[0].tolist() == balls.state.rgbcolor.tolist()
+
+
+def test_event_log_positions_at():
+    box = Cuboid3D()
+    b1 = Ball(position=Vector3D(-2, 0, 0), velocity=Vector3D(1, 0, 0), container=box)
+    b2 = Ball(position=Vector3D(2, 0, 0), velocity=Vector3D(-1, 0, 0), container=box)
+    b3 = Ball(position=Vector3D(0, 2, 2), velocity=Vector3D(0, 0, 0), container=box)
+    balls = BallCollection()
+    balls.add_list([b1, b2, b3])
+    event_log = run_simulation(balls=balls, time_interval=5)
+    position = event_log.positions_at([0, 1, 3, 5.5])
+    assert position.shape == (4, 3, 3)
+    assert position[:, 0, 0] == pytest.approx([-2, -1, -2, -4.5])
+    assert position[:, 1, 0] == pytest.approx([2, 1, 2, 4.5])
+    assert np.all(position[:, 2] == [0, 2, 2])
+    # same result as the dense reconstruction
+    time, dense_position, dense_velocity, dense_rgbcolor = event_log.dense()
+    position, velocity, rgbcolor = event_log.states_at(time)
+    assert position == pytest.approx(dense_position)
+    assert np.array_equal(velocity, dense_velocity)
+
+
+def test_software_renderer_png():
+    renderer = SoftwareRenderer(container=Cuboid3D(), radius=[1.0], width=64, height=36)
+    # ball at the point the camera is looking at
+    image = renderer.render([[0, 0, 0]], [[1, 0, 0]], (20, 30, 25, 0, 0, 0))
+    assert image.shape == (36, 64, 3)
+    assert image[18, 32, 0] > 0 and image[18, 32, 1] == 0
+    assert np.all(image[0, 0] == 0)
+    data = png_bytes(image)
+    assert data[:8] == b'\x89PNG\r\n\x1a\n'
+    raw = np.frombuffer(zlib.decompress(data[41:-16]), dtype=np.uint8).reshape(36, 1 + 64 * 3)
+    assert np.array_equal(raw[:, 1:].reshape(36, 64, 3), image)
+
+
+def test_run_simulation_resume_from_checkpoint(tmp_path):
+    class InterruptedEventLog(EventLog):
+        nmax = 30
+
+        def record(self, time, ids, balls):
+            if self.nmax is not None and self.nevents == self.nmax:
+                raise KeyboardInterrupt
+            super().record(time, ids, balls)
+
+    def new_balls():
+        return random_balls_in_empty_container(container=Cuboid3D(), nballs=20, random_speed=1)
+
+    reference_balls = new_balls()
+    reference = run_simulation(balls=reference_balls, time_interval=20)
+    filename = tmp_path / 'checkpoint.npz'
+    event_log = InterruptedEventLog()
+    with pytest.raises(KeyboardInterrupt):
+        run_simulation(sink=event_log, balls=new_balls(), time_interval=20,
+                       checkpoint=Checkpointer(filename, interval=0))
+    event_log.nmax = None
+    balls = new_balls()
+    run_simulation(sink=event_log, balls=balls, time_interval=20,
+                   checkpoint=Checkpointer(filename, resume=True))
+    # the resumed simulation is identical to the uninterrupted one
+    assert event_log.tend == reference.tend
+    assert np.array_equal(balls.state.position, reference_balls.state.position)
+    assert np.array_equal(balls.state.velocity, reference_balls.state.velocity)
+    times = np.linspace(0, reference.tend, 101)
+    position, velocity, rgbcolor = event_log.states_at(times)
+    reference_position, reference_velocity, reference_rgbcolor = reference.states_at(times)
+    assert position == pytest.approx(reference_position)
+    assert np.array_equal(velocity, reference_velocity)
+
+
+def test_run_simulation_sample_interval():
+    box = Cuboid3D()
+    b1 = Ball(position=Vector3D(-2, 0, 0), velocity=Vector3D(1, 0, 0), container=box)
+    b2 = Ball(position=Vector3D(2, 0, 0), velocity=Vector3D(-1, 0, 0), container=box)
+    balls = BallCollection()
+    balls.add_list([b1, b2])
+    sampler = run_simulation(balls=balls, time_interval=5, sample_interval=0.5, debug=True)
+    time, position, velocity, rgbcolor = sampler.arrays()
+    # the last event happens at t=5.5
+    assert time == pytest.approx(np.arange(0, 5.5, 0.5))
+    assert position.shape == (11, 2, 3)
+    # balls touch at t=1.5 and bounce
+    assert position[:, 0, 0] == pytest.approx([-2, -1.5, -1, -0.5, -1, -1.5, -2, -2.5, -3, -3.5, -4])
+    assert velocity[:3, 1, 0].tolist() == [-1] * 3
+    assert velocity[4:, 1, 0].tolist() == [1] * 7
+
+
+def test_ball_collection_overlap_grid():
+    box = Cuboid3D()
+    balls = BallCollection()
+    balls.add_list([Ball(position=Vector3D(x, 0, 0), container=box) for x in [-3, -1, 1, 3]])
+    assert balls.nballs == 4
+    assert not balls.add_single(Ball(position=Vector3D(1.5, 0.5, 0), container=box), warning=False)
+    # larger balls are checked against neighbours farther away
+    assert not balls.add_single(Ball(position=Vector3D(0, 1.5, 0), radius=1.5, container=box), warning=False)
+    # the grid is rebuilt when the balls are moved
+    balls.dict[2].position = Vector3D(1, 3, 3)
+    assert balls.add_single(Ball(position=Vector3D(1.5, 0.5, 0), container=box), warning=False)
+    assert balls.nballs == 5
+
+
+def test_sample_positions_and_velocities():
+    rng = np.random.default_rng(1234)
+    position = Cuboid3D(xmin=-8, xmax=4).sample_positions(rng, 1000, ball_radius=0.5)
+    assert position.shape == (1000, 3)
+    assert np.all(position.min(axis=0) >= [-7.5, -4.5, -4.5])
+    assert np.all(position.max(axis=0) <= [3.5, 4.5, 4.5])
+    cylinder = VerticalCylinder3D(radius=2, height=3, base_center_position=Vector3D(1, 0, -1))
+    position = cylinder.sample_positions(rng, 1000, ball_radius=0.5)
+    assert np.all(np.hypot(position[:, 0] - 1, position[:, 1]) <= 1.5)
+    assert np.all((position[:, 2] >= -0.5) & (position[:, 2] <= 1.5))
+    velocity = isotropic_velocities(rng, 1000, 0.1)
+    assert np.linalg.norm(velocity, axis=1) == pytest.approx(np.full(1000, 0.1))
+    assert np.abs(velocity.mean(axis=0)).max() < 0.01
+
+
+def test_lattice_and_grown_balls():
+    def min_distance(position):
+        distance = np.linalg.norm(position[:, np.newaxis] - position[np.newaxis], axis=2)
+        np.fill_diagonal(distance, np.inf)
+        return distance.min()
+
+    container = Cuboid3D(xmin=0, xmax=4.01, ymin=0, ymax=4.01, zmin=0, zmax=4.01)
+    volume = 4.01 ** 3
+    for lattice, nballs in [('sc', 64), ('fcc', 63), ('hcp', 56)]:
+        balls = lattice_balls_in_empty_container(container, radius=0.5, lattice=lattice, random_speed=1)
+        state = balls.state
+        assert state.nballs == nballs
+        assert min_distance(state.position) == pytest.approx(1.0)
+        assert min_distance(state.position) >= 1.0
+        assert np.all((state.position >= 0.5) & (state.position <= 3.51))
+    balls = lattice_balls_in_empty_container(container, nballs=40, radius=0.45, lattice='fcc', spacing=1, jitter=0.04)
+    assert balls.state.nballs == 40
+    assert min_distance(balls.state.position) >= 0.9
+    with pytest.raises(ValueError):
+        lattice_balls_in_empty_container(container, radius=0.45, spacing=1, jitter=0.1)
+
+    # packing fraction 0.45, beyond the limit of random sequential insertion
+    balls = grown_balls_in_empty_container(container, nballs=56, radius=0.5, random_speed=1,
+                                           growth_rate=0.02)
+    state = balls.state
+    assert state.nballs * np.pi / 6 / volume > 0.45
+    assert min_distance(state.position) >= 1.0
+    assert np.all((state.position >= 0.5) & (state.position <= 3.51))
+    assert np.linalg.norm(state.velocity, axis=1) == pytest.approx(np.ones(56))
+
+
+def test_run_simulation_local_clocks():
+    results = []
+    for local_clocks in [True, False]:
+        balls = random_balls_in_empty_container(container=Cuboid3D(), nballs=30, random_speed=1)
+        event_log = run_simulation(balls=balls, time_interval=2, local_clocks=local_clocks)
+        # the balls are synchronized at the end of the simulation
+        assert np.all(balls.state.time == event_log.tend)
+        results.append((event_log, balls))
+    (event_log, balls), (reference, reference_balls) = results
+    assert event_log.nevents == reference.nevents
+    assert balls.state.position == pytest.approx(reference_balls.state.position, abs=1e-8)
+    assert np.array_equal(np.sign(balls.state.velocity), np.sign(reference_balls.state.velocity))
+
+    state = balls.state
+    state.advance([0], state.time[0] + 1)
+    assert state.time[0] == state.time[1] + 1
+    position = state.positions_at(np.arange(state.nballs), state.time[0])
+    state.synchronize(state.time[0])
+    assert np.all(state.time == state.time[0])
+    assert state.position == pytest.approx(position)
+
+
+def test_time_to_collision_matches_ball():
+    rng = np.random.default_rng(1234)
+    nballs = 30
+    position = rng.uniform(-3, 3, (nballs, 3))
+    velocity = rng.normal(size=(nballs, 3))
+    # parallel motion, and overlapping balls approaching each other
+    velocity[1] = velocity[0]
+    position[3] = position[2] + [0.9, 0, 0]
+    velocity[2], velocity[3] = [1, 0, 0], [-1, 0, 0]
+    radius = rng.uniform(0.2, 0.6, nballs)
+    radius[2:4] = 0.5
+    state = BallState.from_arrays(position=position, velocity=velocity, radius=radius, mass=1,
+                                  rgbcolor=[1, 0, 0], container=Cuboid3D())
+    balls = [Ball.view(state, i) for i in range(nballs)]
+    for nround in [None, 12]:
+        tmatrix = time_to_collision(position[:, np.newaxis], velocity[:, np.newaxis], radius[:, np.newaxis],
+                                    position[np.newaxis], velocity[np.newaxis], radius[np.newaxis],
+                                    nround=nround)
+        expected = np.array([[b1.time_to_collision_with_ball(b2, nround=nround) for b2 in balls]
+                             for b1 in balls])
+        assert np.array_equal(np.isinf(tmatrix), np.isinf(expected))
+        finite = np.isfinite(expected)
+        assert np.sum(finite) > 0
+        assert tmatrix[finite] == pytest.approx(expected[finite], rel=1e-12, abs=1e-12)
+        assert tmatrix[0, 1] == np.inf
+        assert tmatrix[2, 3] == (0 if nround is None else np.inf)
+
+
+def test_time_tolerance_and_overlap_correction():
+    # overlapping balls (by a rounding error) approaching each other
+    position1, position2 = np.array([0.0, 0, 0]), np.array([1 - 1e-15, 0, 0])
+    velocity1, velocity2 = np.array([1.0, 0, 0]), np.array([-1.0, 0, 0])
+    assert time_to_collision(position1, velocity1, 0.5, position2, velocity2, 0.5) == 0
+    assert time_to_collision(position1, velocity1, 0.5, position2, velocity2, 0.5, nround=12) == np.inf
+    # moving away from each other
+    assert time_to_collision(position1, -velocity1, 0.5, position2, -velocity2, 0.5) == np.inf
+
+    container = Cuboid3D()
+    position = [[4.5 + 1e-15, 0, 0], [0, 0, 0]]
+    velocity = [[1, 0, 0], [1, 1 + 1e-14, 0]]
+    tmin, hit = container.collision_times_with_container(position, velocity, [0.5, 0.5])
+    assert tmin[0] == 0
+    assert hit.tolist() == [[True, False, False], [True, True, False]]
+
+
+def test_frame_cache(tmp_path, monkeypatch):
+    cache = FrameCache(tmp_path / 'cache')
+    key = cache.key(time=1.0, width=64)
+    assert key == cache.key(width=64, time=1.0)
+    assert key != cache.key(time=2.0, width=64)
+    assert not cache.contains(key)
+    cache.write(key, b'frame')
+    assert cache.contains(key)
+    assert cache.read(key) == b'frame'
+    pngfile = tmp_path / 'frame.png'
+    pngfile.write_bytes(b'other frame')
+    cache.store_file(key, pngfile)
+    assert cache.read(key) == b'other frame'
+
+    # ffmpeg replacement that reads the piped frames and creates the output file
+    bindir = tmp_path / 'bin'
+    bindir.mkdir()
+    ffmpeg = bindir / 'ffmpeg'
+    ffmpeg.write_text('#!/bin/sh\nfor a in "$@"; do last="$a"; done\ncat > /dev/null\ntouch "$last"\n')
+    ffmpeg.chmod(ffmpeg.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('PATH', f'{bindir}{os.pathsep}{os.environ["PATH"]}')
+    monkeypatch.chdir(tmp_path)
+
+    nrendered = []
+    render_bytes = SoftwareRenderer.render_bytes
+
+    def counting_render_bytes(self, *args, **kwargs):
+        nrendered.append(1)
+        return render_bytes(self, *args, **kwargs)
+
+    monkeypatch.setattr(SoftwareRenderer, 'render_bytes', counting_render_bytes)
+    container = Cuboid3D()
+    event_log = run_simulation(balls=random_balls_in_empty_container(container=container, nballs=5,
+                                                                     random_speed=1),
+                               time_interval=3)
+    nframes = 4
+    for run in range(2):
+        nrendered.clear()
+        time_rendering(event_log=event_log, container=container, outfilename='simulation.mp4',
+                       workdir=tmp_path / f'work{run}', width=64, height=36, renderer='numpy', cache_dir=tmp_path / 'cache', stream=True)
+        assert (tmp_path / 'simulation.mp4').is_file()
+        assert len(nrendered) == (nframes if run == 0 else 0)
+    assert len(list(cache.cache_dir.glob('*/*.png'))) == nframes + 1
+
+    # browser frames, all of them in the cache: the browser is not needed
+    monkeypatch.setattr(FrameCache, 'contains', lambda self, key: True)
+    monkeypatch.setattr(FrameCache, 'read', lambda self, key: b'frame')
+    time_rendering(event_log=event_log, container=container, outfilename='simulation.mp4',
+                   workdir=tmp_path / 'work2', width=64, height=36, renderer='browser', cache_dir=tmp_path / 'cache', stream=True)
+    assert not (tmp_path / 'work2' / 'scene.html').exists()
+
+
+def test_resume_frames(tmp_path, monkeypatch):
+    # ffmpeg replacement that saves its arguments and the piped frames
+    bindir = tmp_path / 'bin'
+    bindir.mkdir()
+    ffmpeg = bindir / 'ffmpeg'
+    ffmpeg.write_text('#!/bin/sh\necho "$@" > ffmpeg_args\nfor a in "$@"; do last="$a"; done\n'
+                      'if [ "$*" != "${*%-i - *}" ]; then cat > ffmpeg_stdin; fi\ntouch "$last"\n')
+    ffmpeg.chmod(ffmpeg.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('PATH', f'{bindir}{os.pathsep}{os.environ["PATH"]}')
+    monkeypatch.chdir(tmp_path)
+
+    container = Cuboid3D()
+    event_log = run_simulation(balls=random_balls_in_empty_container(container=container, nballs=5,
+                                                                     random_speed=1),
+                               time_interval=3)
+    # without cache nor resume, the keys of the frames are not computed
+    with monkeypatch.context() as m:
+        m.setattr('simelastic.time_rendering.source_hash', None)
+        time_rendering(event_log=event_log, container=container, outfilename='simulation.mp4',
+                       workdir=tmp_path / 'plain', width=64, height=36, renderer='numpy')
+    assert not (tmp_path / 'plain' / 'frames.json').exists()
+
+    workdir = tmp_path / 'work'
+    time_rendering(event_log=event_log, container=container, outfilename='simulation.mp4', workdir=workdir,
+                   width=64, height=36, renderer='numpy', resume_frames=True)
+    pngfiles = sorted(workdir.glob('frame_*.png'))
+    assert len(pngfiles) == 4
+    frames = [pngfile.read_bytes() for pngfile in pngfiles]
+    manifest = json.loads((workdir / 'frames.json').read_text())
+    assert sorted(manifest) == [pngfile.name for pngfile in pngfiles]
+
+    # the frames on disk are PNG images, so the missing frames are also
+    # piped as PNG images instead of raw RGB data
+    pngfiles[1].unlink()
+    time_rendering(event_log=event_log, container=container, outfilename='simulation.mp4', workdir=workdir,
+                   width=64, height=36, renderer='numpy', resume_frames=True, stream=True)
+    assert 'rawvideo' not in (tmp_path / 'ffmpeg_args').read_text()
+    assert (tmp_path / 'ffmpeg_stdin').read_bytes() == b''.join(frames)
+
+    nrendered = []
+    render_bytes = SoftwareRenderer.render_bytes
+
+    def counting_render_bytes(self, *args, **kwargs):
+        nrendered.append(1)
+        return render_bytes(self, *args, **kwargs)
+
+    monkeypatch.setattr(SoftwareRenderer, 'render_bytes', counting_render_bytes)
+    # only the missing frame is rendered
+    time_rendering(event_log=event_log, container=container, outfilename='simulation.mp4', workdir=workdir,
+                   width=64, height=36, renderer='numpy', resume_frames=True)
+    assert len(nrendered) == 1
+    assert [pngfile.read_bytes() for pngfile in pngfiles] == frames
+    # the frames rendered with other parameters are not reused
+    nrendered.clear()
+    time_rendering(event_log=event_log, container=container, outfilename='simulation.mp4', workdir=workdir,
+                   tarray=[0.5, 1.5, 2.5, 3.5], width=64, height=36, renderer='numpy', resume_frames=True)
+    assert len(nrendered) == 4
+    assert json.loads((workdir / 'frames.json').read_text()) != manifest
+
+
+def test_trajectory_round_trip(tmp_path):
+    balls = random_balls_in_empty_container(container=Cuboid3D(), nballs=10, random_speed=1)
+    event_log = EventLog()
+    # chunks smaller than the number of frames, so that the .npy headers are rewritten
+    writer = TrajectoryWriter(dirname=tmp_path / 'trajectory', chunk_size=4)
+    run_simulation(sink=[event_log, writer], balls=balls, time_interval=10)
+    writer.close()
+    trajectory = Trajectory(tmp_path / 'trajectory')
+    states = [(t, position.copy(), velocity.copy(), rgbcolor.copy())
+              for t, position, velocity, rgbcolor in event_log.iter_states()]
+    assert trajectory.nframes == len(states) > 2 * writer.chunk_size
+    assert trajectory.tstart == event_log.tstart
+    assert trajectory.tend == event_log.tend
+    assert trajectory.time.tolist() == [t for t, _, _, _ in states]
+
+    times = np.linspace(event_log.tstart, event_log.tend, 37)
+    for expected, result in zip(event_log.states_at(times), trajectory.states_at(times)):
+        assert result == pytest.approx(expected, abs=1e-12)
+    assert trajectory.positions_at(times) == pytest.approx(event_log.positions_at(times), abs=1e-12)
+    for k, (t, position, velocity, rgbcolor) in enumerate(states):
+        snapshot = trajectory.snapshot(k)
+        assert snapshot.state.position == pytest.approx(position, abs=1e-12)
+        assert np.array_equal(snapshot.state.velocity, velocity)
+        assert np.array_equal(snapshot.state.rgbcolor, rgbcolor)
+        assert np.array_equal(snapshot.state.radius, event_log.initial_balls.state.radius)
+
+
+def test_simultaneous_events_in_sinks(tmp_path):
+    box = Cuboid3D()
+    balls = BallCollection()
+    # three balls hitting different walls at t=4.5
+    balls.add_list([Ball(position=Vector3D(0, 0, 0), velocity=Vector3D(1, 0, 0), container=box),
+                    Ball(position=Vector3D(0, 2, 0), velocity=Vector3D(-1, 0, 0), container=box),
+                    Ball(position=Vector3D(2, -2, 0), velocity=Vector3D(0, 0, -1), container=box)])
+    event_log = EventLog()
+    writer = TrajectoryWriter(dirname=tmp_path / 'trajectory', chunk_size=2)
+    dict_snapshots = DictSnapshots(time_resolution=6)
+    run_simulation(sink=[event_log, writer, dict_snapshots], balls=balls, time_interval=10)
+    writer.close()
+    assert event_log.time[:3] == [4.5, 4.5, 4.5]
+
+    states = [(t, position.copy(), velocity.copy(), rgbcolor.copy())
+              for t, position, velocity, rgbcolor in event_log.iter_states()]
+    times = [t for t, _, _, _ in states]
+    assert times == [0, 4.5, 13.5]
+    trajectory = Trajectory(tmp_path / 'trajectory')
+    assert trajectory.time.tolist() == times
+    assert sorted(dict_snapshots.dict_snapshots) == times
+    for k, (t, position, velocity, rgbcolor) in enumerate(states):
+        for snapshot in [trajectory.snapshot(k), dict_snapshots.dict_snapshots[t]]:
+            assert snapshot.state.position == pytest.approx(position, abs=1e-12)
+            assert np.array_equal(snapshot.state.velocity, velocity)
+            assert np.array_equal(snapshot.state.rgbcolor, rgbcolor)
+    # all the balls have bounced in the frame at t=4.5
+    assert trajectory.velocity[1].tolist() == [[-1, 0, 0], [1, 0, 0], [0, 0, 1]]
+
+
+def test_ball_state_views_and_copies():
+    box = Cuboid3D()
+    balls = BallCollection()
+    capacity = len(balls.state._radius)
+    for i in range(5):
+        balls.add_single(Ball(position=Vector3D(2 * i - 4, 0, 0), velocity=Vector3D(0, i, 0),
+                              radius=0.1 * (i + 1), container=box))
+    # growing past the capacity keeps the balls already stored
+    assert len(balls.state._radius) > capacity
+    assert balls.state.position[:, 0].tolist() == [-4, -2, 0, 2, 4]
+    assert balls.state.velocity[:, 1].tolist() == [0, 1, 2, 3, 4]
+    assert balls.state.radius == pytest.approx([0.1, 0.2, 0.3, 0.4, 0.5])
+    assert balls.state.container == [box] * 5
+
+    # the balls of the collection are views of the shared state
+    ball = balls.dict[2]
+    version = balls.state.version
+    ball.position.y = 1.5
+    ball.velocity = Vector3D(1, 2, 3)
+    ball.rgbcolor_on_speed = Vector3D(0, 1, 0)
+    assert balls.state.position[2].tolist() == [0, 1.5, 0]
+    assert balls.state.velocity[2].tolist() == [1, 2, 3]
+    assert balls.state.has_rgbcolor_on_speed.tolist() == [False, False, True, False, False]
+    assert balls.state.version > version
+    balls.state.mass[2] = 3
+    assert ball.mass == 3
+
+    # the deep copies do not share memory with the original
+    ball_copy = copy.deepcopy(ball)
+    assert ball_copy.state is not balls.state
+    ball_copy.position.x = 1
+    assert ball.position.x == 0
+    balls_copy = copy.deepcopy(balls)
+    for name in ['_position', '_velocity', '_rgbcolor', '_radius', '_mass', '_time']:
+        assert not np.shares_memory(getattr(balls_copy.state, name), getattr(balls.state, name))
+    balls_copy.dict[2].velocity = Vector3D(0, 0, 0)
+    balls_copy.state.position[:] = 0
+    assert balls.state.velocity[2].tolist() == [1, 2, 3]
+    assert balls.state.position[:, 0].tolist() == [-4, -2, 0, 2, 4]
+    assert balls_copy.dict[2].state is balls_copy.state
+
+
+def test_frame_data_bytes():
+    rng = np.random.default_rng(1234)
+    nframes, nballs = 5, 7
+    tarray = np.linspace(0, 2, nframes)
+    camera = rng.uniform(-10, 10, (nframes, 6))
+    fposition = rng.uniform(-5, 5, (nframes, nballs, 3))
+    frgbcolor = rng.uniform(-0.5, 1.5, (nframes, nballs, 3))
+    data = frame_data_bytes(tarray, camera, fposition, frgbcolor)
+
+    # same layout as setFrameData in the HTML file
+    offset = 0
+    frames = np.frombuffer(data, dtype='<f8', count=nframes * NVALUES_FRAME_HEADER, offset=offset)
+    offset += frames.nbytes
+    position = np.frombuffer(data, dtype='<f4', count=nframes * nballs * 3, offset=offset)
+    assert offset % position.itemsize == 0
+    offset += position.nbytes
+    color = np.frombuffer(data, dtype='u1', count=nframes * nballs * 3, offset=offset)
+    offset += color.nbytes
+    assert offset == len(data)
+
+    frames = frames.reshape(nframes, NVALUES_FRAME_HEADER)
+    assert np.array_equal(frames[:, 0], tarray)
+    assert np.array_equal(frames[:, 1:], camera)
+    assert np.array_equal(position.reshape(nframes, nballs, 3), fposition.astype(np.float32))
+    color = color.reshape(nframes, nballs, 3)
+    assert np.array_equal(color, np.round(np.clip(frgbcolor, 0, 1) * 255))
+    assert color.min() == 0 and color.max() == 255
+
+
+def test_frame_server_log(tmp_path, monkeypatch):
+    # node replacement writing many warnings before replying to the requests
+    bindir = tmp_path / 'bin'
+    bindir.mkdir()
+    node = bindir / 'node'
+    node.write_text('#!/bin/sh\nhead -c 1000000 /dev/zero | tr "\\\\0" w >&2\necho ready\n'
+                    'while read k pngfile; do echo "done $k cG5n"; done\n')
+    node.chmod(node.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv('PATH', f'{bindir}{os.pathsep}{os.environ["PATH"]}')
+
+    htmlfile = tmp_path / 'scene.html'
+    htmlfile.write_text('')
+    frames = list(iter_frames(htmlfile=htmlfile, frames=range(5), jobs=2, jsdir=tmp_path))
+    # the JavaScript files are removed when the servers are closed
+    assert not list(tmp_path.glob('*.js'))
+    assert frames == [(k, b'png') for k in range(5)]
+    assert (tmp_path / 'frame_server_0.log').stat().st_size == 1000000
+    # by default, the files of the servers are created in a temporary directory
+    cwd = tmp_path / 'cwd'
+    cwd.mkdir()
+    monkeypatch.chdir(cwd)
+    assert len(list(iter_frames(htmlfile=htmlfile, frames=range(3), jobs=2))) == 3
+    assert not list(cwd.iterdir())
+
+
+def test_cell_list_matches_all_pairs():
+    balls = random_balls_in_empty_container(container=Cuboid3D(), nballs=40, random_speed=1)
+    # balls touching the walls while crossing cells along them
+    balls.state.position[0] = [4.5, -4.4, -4.3]
+    balls.state.velocity[0] = [0, 1, 0.7]
+    balls.state.position[1] = [-4.5, 4.5, 0.2]
+    balls.state.velocity[1] = [0, 0, -1]
+    position = balls.state.position
+    for i in [0, 1]:
+        assert np.min(np.linalg.norm(np.delete(position, i, axis=0) - position[i], axis=1)) > 1
+    event_log_cells = run_simulation(balls=copy.deepcopy(balls), time_interval=20, use_cell_list=True)
+    event_log_pairs = run_simulation(balls=copy.deepcopy(balls), time_interval=20, use_cell_list=False)
+    assert event_log_cells.nevents == event_log_pairs.nevents > 100
+    # the times differ by rounding errors, amplified by the later collisions
+    assert event_log_cells.time == pytest.approx(event_log_pairs.time, abs=1e-6)
+    for ids_cells, ids_pairs in zip(event_log_cells.ids, event_log_pairs.ids):
+        assert sorted(ids_cells.tolist()) == sorted(ids_pairs.tolist())
+    assert any(0 in ids.tolist() and len(ids) == 2 for ids in event_log_cells.ids)
+
+
+def test_instanced_html(tmp_path):
+    container = Cuboid3D()
+    nballs = 6
+    event_log = run_simulation(balls=random_balls_in_empty_container(container=container, nballs=nballs,
+                                                                     random_speed=1),
+                               time_interval=3)
+    for html_mode in ['frames', 'base64']:
+        for instanced in [False, True]:
+            outfilename = tmp_path / f'{html_mode}_{instanced}.html'
+            time_rendering(event_log=event_log, container=container, outfilename=outfilename,
+                           html_mode=html_mode, instanced=instanced)
+            html = outfilename.read_text()
+            if not instanced:
+                assert 'three.js@r100' in html
+                assert 'InstancedMesh' not in html
+                continue
+            assert 'three.js@r124' in html
+            assert f'var count = {nballs};' in html
+            assert 'ballMesh = new THREE.InstancedMesh( geometry, material, count );' in html
+            # one row of initial data per ball
+            ball_data = html[html.index('var ballData = ['):html.index('];', html.index('var ballData = ['))]
+            assert len(re.findall(r'^ +\[ .+ \],$', ball_data, re.MULTILINE)) == nballs
+            # the matrix and the color of every instance are updated in each frame
+            assert 'ballMesh.setMatrixAt( i, ballMatrix );' in html
+            assert 'ballMesh.setColorAt( i, b.material.color );' in html
+            assert 'requestAnimationFrame( render );\n                updateBallInstances();' in html
+
+    for instanced in [False, True]:
+        f = io.StringIO()
+        write_html_set_frame(f, instanced=instanced)
+        assert ('updateBallInstances();' in f.getvalue()) == instanced